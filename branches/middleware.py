@@ -1,107 +1,230 @@
 """
-Middleware to safely manage branch context using thread-local storage.
+Middleware to safely manage branch context using context variables.
 Ensures ONLY saved Branch instances are ever injected into filters.
+
+Context variables (rather than thread-locals) keep the branch and user
+correct under ASGI and async views as well as waitress' thread pool.
+Branch lookups go through a small in-process TTL cache keyed by branch id
+and user id; ``branches.signals`` drops entries when a Branch or UserProfile
+changes, and the TTL bounds staleness across worker processes.
 """
 
-from threading import local
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_branch_context = ContextVar('branch_context', default=None)
+_request_context = ContextVar('request_context', default=None)
+_user_context = ContextVar('user_context', default=None)
+
+BRANCH_CACHE_TTL = getattr(settings, 'BRANCH_CACHE_TTL', 300)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A tiny thread-safe dict whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires, value = entry
+        if expires < time.monotonic():
+            self.delete(key)
+            return _MISSING
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                # Drop the entry closest to expiry to make room
+                oldest = min(self._data, key=lambda k: self._data[k][0])
+                del self._data[oldest]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# branch_id -> active Branch or None; the key 'default' holds the fallback branch
+_branch_cache = TTLCache(BRANCH_CACHE_TTL)
+# user_id -> branch_id from the user's profile (or None)
+_user_branch_cache = TTLCache(BRANCH_CACHE_TTL)
+
+
+def get_active_branch(branch_id):
+    """Active Branch with this id, or None; cached"""
+    branch_id = int(branch_id)
+    branch = _branch_cache.get(branch_id)
+    if branch is _MISSING:
+        from branches.models import Branch
+        branch = Branch.objects.filter(id=branch_id, is_active=True).first()
+        _branch_cache.set(branch_id, branch)
+    return branch
+
+
+def get_user_branch(user_id):
+    """Active branch assigned to the user's profile, or None; cached"""
+    branch_id = _user_branch_cache.get(user_id)
+    if branch_id is _MISSING:
+        from users.models import UserProfile
+        branch_id = UserProfile._base_manager.filter(user_id=user_id).values_list('branch_id', flat=True).first()
+        _user_branch_cache.set(user_id, branch_id)
+    return get_active_branch(branch_id) if branch_id else None
+
+
+def get_default_branch():
+    """First active branch, used when nothing else identifies one; cached"""
+    branch = _branch_cache.get('default')
+    if branch is _MISSING:
+        from branches.models import Branch
+        branch = Branch.objects.filter(is_active=True).first()
+        _branch_cache.set('default', branch)
+    return branch
 
-_branch_context = local()
-_user_context = local()
+
+def invalidate_branch(branch_id=None):
+    """Forget a cached branch (and the default, which may be the same row)"""
+    if branch_id is None:
+        _branch_cache.clear()
+    else:
+        _branch_cache.delete(int(branch_id))
+        _branch_cache.delete('default')
+
+
+def invalidate_user(user_id=None):
+    """Forget a cached user -> branch assignment"""
+    if user_id is None:
+        _user_branch_cache.clear()
+    else:
+        _user_branch_cache.delete(user_id)
+
+
+def _token_claims(request):
+    """branch_id and user_id claims from a SimpleJWT bearer token, if any"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, None
+    try:
+        from rest_framework_simplejwt.settings import api_settings
+        from rest_framework_simplejwt.tokens import AccessToken
+        access = AccessToken(auth_header.split(" ")[1])
+        return access.get("branch_id"), access.get(api_settings.USER_ID_CLAIM)
+    except Exception as e:
+        logger.debug("Failed to read branch from JWT: %s", e)
+        return None, None
 
 
 class BranchContextMiddleware:
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
 
+        tokens = self._enter(request, self.resolve_branch(request))
         try:
-            # Set current user
-            if hasattr(request, "user") and request.user.is_authenticated:
-                self._set_user(request.user)
-                print(f"[USER] Set current user: {request.user.username}")
-
-            # -------------------------------------------------------------
-            # 1. Try getting branch from JWT (SimpleJWT)
-            # -------------------------------------------------------------
-            auth_header = request.headers.get('Authorization')
-            if auth_header and auth_header.startswith('Bearer '):
-                try:
-                    token = auth_header.split(" ")[1]
-                    from rest_framework_simplejwt.tokens import AccessToken
-                    access = AccessToken(token)
-                    branch_id = access.get("branch_id")
-
-                    if branch_id:
-                        from branches.models import Branch
-                        branch = Branch.objects.get(id=branch_id, is_active=True)
-                        self._set_branch(branch)
-                        print(f"[BRANCH] Using branch from JWT: {branch.id} - {branch.name}")
-
-                except Exception as e:
-                    print(f"[BRANCH] Failed to load branch from JWT: {e}")
-
-            # -------------------------------------------------------------
-            # 2. Try Header X-Branch-Id
-            # -------------------------------------------------------------
-            if not self._has_branch():
-                try:
-                    branch_id = request.headers.get("X-Branch-Id")
-                    if branch_id:
-                        from branches.models import Branch
-                        branch = Branch.objects.get(id=int(branch_id), is_active=True)
-                        self._set_branch(branch)
-                        print(f"[BRANCH] Using branch from Header: {branch.id}")
-                except Exception:
-                    pass
-
-            # -------------------------------------------------------------
-            # 3. Try from authenticated user's profile
-            # -------------------------------------------------------------
-            if not self._has_branch():
-                if hasattr(request, "user") and request.user.is_authenticated:
-                    try:
-                        from users.models import UserProfile
-                        profile = UserProfile.objects.get(user=request.user)
-
-                        if profile.branch and profile.branch.is_active:
-                            self._set_branch(profile.branch)
-                            print(f"[BRANCH] Using branch from user profile: {profile.branch.id}")
-
-                    except Exception:
-                        pass
-
-            # -------------------------------------------------------------
-            # 4. Fallback: First active branch
-            # -------------------------------------------------------------
-            if not self._has_branch():
+            return self.get_response(request)
+        finally:
+            self._exit(tokens)
+
+    async def __acall__(self, request):
+        # Cache misses hit the database, so resolve off the event loop
+        branch = await sync_to_async(self.resolve_branch)(request)
+        tokens = self._enter(request, branch)
+        try:
+            return await self.get_response(request)
+        finally:
+            self._exit(tokens)
+
+    @classmethod
+    def resolve_branch(cls, request):
+        """
+        Work out the request's branch, in order of preference:
+        JWT branch_id claim, X-Branch-Id header, the user's profile, then the
+        first active branch.
+        """
+        try:
+            branch_id, token_user_id = _token_claims(request)
+
+            # 1. Branch from JWT (SimpleJWT)
+            if branch_id:
+                branch = get_active_branch(branch_id)
+                if branch:
+                    return branch
+
+            # 2. Header X-Branch-Id
+            header_branch_id = request.headers.get("X-Branch-Id")
+            if header_branch_id:
                 try:
-                    from branches.models import Branch
-                    branch = Branch.objects.filter(is_active=True).first()
-                    if branch:
-                        self._set_branch(branch)
-                        print(f"[BRANCH] Using default branch: {branch.id}")
-                except Exception:
-                    pass
+                    branch = get_active_branch(header_branch_id)
+                except (TypeError, ValueError):
+                    branch = None
+                if branch:
+                    return branch
 
-        except Exception as e:
-            print(f"[BRANCH] Middleware error: {e}")
+            # 3. Authenticated user's profile (JWT subject or session user)
+            user_id = token_user_id
+            if not user_id:
+                user = getattr(request, "user", None)
+                user_id = user.pk if user is not None and user.is_authenticated else None
+            if user_id:
+                branch = get_user_branch(user_id)
+                if branch:
+                    return branch
+
+            # 4. Fallback: first active branch
+            return get_default_branch()
 
-        response = self.get_response(request)
+        except Exception as e:
+            logger.warning("Branch resolution failed: %s", e)
+            return None
 
-        # Cleanup per-request
-        self._clear_branch()
-        self._clear_user()
+    @classmethod
+    def _enter(cls, request, branch):
+        if branch is not None and not getattr(branch, "pk", None):
+            raise ValueError("Cannot set unsaved Branch instance in context")
+        return (
+            _request_context.set(request),
+            _branch_context.set(branch),
+        )
 
-        return response
+    @classmethod
+    def _exit(cls, tokens):
+        request_token, branch_token = tokens
+        _branch_context.reset(branch_token)
+        _request_context.reset(request_token)
 
     # ------------------------------------------------------------------
-    # Thread-Local Access Methods
+    # Context Access Methods
     # ------------------------------------------------------------------
     @classmethod
     def get_current_branch(cls):
-        return getattr(_branch_context, "branch", None)
+        return _branch_context.get()
 
     @classmethod
     def _set_branch(cls, branch):
@@ -112,26 +235,35 @@ class BranchContextMiddleware:
         if not getattr(branch, "pk", None):
             raise ValueError("Cannot set unsaved Branch instance in context")
 
-        _branch_context.branch = branch
+        _branch_context.set(branch)
 
     @classmethod
     def _has_branch(cls):
-        return hasattr(_branch_context, "branch")
+        return _branch_context.get() is not None
 
     @classmethod
     def _clear_branch(cls):
-        if hasattr(_branch_context, "branch"):
-            delattr(_branch_context, "branch")
+        _branch_context.set(None)
 
     @classmethod
     def get_current_user(cls):
-        return getattr(_user_context, "user", None)
+        """
+        The authenticated user for the current request.
+
+        Read from the request lazily, because DRF authenticates (and sets
+        ``request.user``) after this middleware has run.
+        """
+        user = _user_context.get()
+        if user is not None:
+            return user
+        request = _request_context.get()
+        user = getattr(request, "user", None) if request is not None else None
+        return user if user is not None and user.is_authenticated else None
 
     @classmethod
     def _set_user(cls, user):
-        _user_context.user = user
+        _user_context.set(user)
 
     @classmethod
     def _clear_user(cls):
-        if hasattr(_user_context, "user"):
-            delattr(_user_context, "user")
+        _user_context.set(None)
@@ -1,78 +1,29 @@
 """
 Security middleware to prevent cross-branch data access.
-This middleware ensures all database queries are branch-aware.
+
+While a request is being handled, querysets from ``BranchManager`` (the
+default manager of every branch-scoped model) are restricted to the request's
+branch. Models without a branch field are never touched, and nothing global
+is patched, so concurrent requests in other threads are unaffected.
 """
 
-from threading import local
-from django.db import connection
 from branches.middleware import BranchContextMiddleware
+from branches.utils import enforce_branch, release_branch
 
-# Thread-local storage for branch enforcement
-_branch_enforcement = local()
 
 class BranchSecurityMiddleware:
     """
     Middleware that enforces branch security at the database level.
     This provides an additional layer of protection against cross-branch data leakage.
+    Must come after BranchContextMiddleware.
     """
-    
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Set branch enforcement context
-        current_branch = BranchContextMiddleware.get_current_branch()
-        _branch_enforcement.branch = current_branch
-        
-        # Add branch filtering to ORM queries
-        from django.db import models
-        
-        # Monkey patch QuerySet to enforce branch filtering
-        original_filter = models.QuerySet.filter
-        original_all = models.QuerySet.all
-        
-        def branch_aware_filter(self, *args, **kwargs):
-            """Filter that enforces branch security"""
-            result = original_filter(self, *args, **kwargs)
-            
-            # Check if this query needs branch filtering
-            model = result.model
-            has_branch_field = any(field.name == 'branch' for field in model._meta.get_fields())
-            
-            if has_branch_field and _branch_enforcement.branch:
-                # Apply branch filter if not already applied
-                if 'branch' not in kwargs:
-                    result = result.filter(branch=_branch_enforcement.branch)
-            
-            return result
-        
-        def branch_aware_all(self):
-            """All that enforces branch security"""
-            result = original_all(self)
-            
-            # Check if this query needs branch filtering
-            model = result.model
-            has_branch_field = any(field.name == 'branch' for field in model._meta.get_fields())
-            
-            if has_branch_field and _branch_enforcement.branch:
-                # Apply branch filter
-                result = result.filter(branch=_branch_enforcement.branch)
-            
-            return result
-        
-        # Apply monkey patches
-        models.QuerySet.filter = branch_aware_filter
-        models.QuerySet.all = branch_aware_all
-        
+        token = enforce_branch(BranchContextMiddleware.get_current_branch())
         try:
-            response = self.get_response(request)
+            return self.get_response(request)
         finally:
-            # Restore original methods
-            models.QuerySet.filter = original_filter
-            models.QuerySet.all = original_all
-            
-            # Clean up thread-local storage
-            if hasattr(_branch_enforcement, 'branch'):
-                del _branch_enforcement.branch
-        
-        return response
+            release_branch(token)
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .middleware import invalidate_branch, invalidate_user
+from .models import Branch
+from .utils import branch_field_for
+from .versions import MODEL_DOMAINS, bump_on_commit
+
+
+@receiver([post_save, post_delete], sender=Branch)
+def forget_cached_branch(sender, instance, **kwargs):
+    """Drop a changed branch from the middleware's branch cache."""
+    invalidate_branch(instance.pk)
+
+
+@receiver([post_save, post_delete], sender='users.UserProfile')
+def forget_cached_user_branch(sender, instance, **kwargs):
+    """Drop a user's cached branch assignment when their profile changes."""
+    invalidate_user(instance.user_id)
+
+
+def bump_data_versions(sender, instance, **kwargs):
+    """Move the written model's data domains on to a new version."""
+    field_name = branch_field_for(sender)
+    branch_id = getattr(instance, f'{field_name}_id', None) if field_name else None
+    bump_on_commit(MODEL_DOMAINS[sender._meta.label], branch_id)
+
+
+for label in MODEL_DOMAINS:
+    post_save.connect(bump_data_versions, sender=label, dispatch_uid=f'data-version-save-{label}')
+    post_delete.connect(bump_data_versions, sender=label, dispatch_uid=f'data-version-delete-{label}')
@@ -1,3 +1,211 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from inventory.models import Category, Product, StockMovement
+from users.models import UserProfile
+from .middleware import BranchContextMiddleware, invalidate_branch, invalidate_user
+from .models import Branch
+from .security_middleware import BranchSecurityMiddleware
+from .utils import branch_field_for, filter_by_current_branch, get_enforced_branch
+from . import versions
+from .versions import bump, get_versions, version_stamp
+
+
+class BranchContextMiddlewareTest(TestCase):
+    def setUp(self):
+        invalidate_branch()
+        invalidate_user()
+        self.factory = RequestFactory()
+        self.main = Branch.objects.create(name='Main', location='Town')
+        self.east = Branch.objects.create(name='East', location='Eastlands')
+        self.user = User.objects.create_user(username='cashier', password='testpass')
+        self.profile = UserProfile.objects.create(user=self.user, role='cashier', branch=self.east)
+        self.seen = []
+
+        def view(request):
+            self.seen.append(BranchContextMiddleware.get_current_branch())
+            return HttpResponse()
+
+        self.middleware = BranchContextMiddleware(view)
+
+    def tearDown(self):
+        invalidate_branch()
+        invalidate_user()
+
+    def bearer(self, **claims):
+        token = AccessToken.for_user(self.user)
+        for key, value in claims.items():
+            token[key] = value
+        return f'Bearer {token}'
+
+    def test_header_branch(self):
+        self.middleware(self.factory.get('/', HTTP_X_BRANCH_ID=str(self.east.pk)))
+        self.assertEqual(self.seen, [self.east])
+        self.assertIsNone(BranchContextMiddleware.get_current_branch())
+
+    def test_jwt_branch_claim_wins(self):
+        request = self.factory.get(
+            '/', HTTP_AUTHORIZATION=self.bearer(branch_id=self.main.pk), HTTP_X_BRANCH_ID=str(self.east.pk)
+        )
+        self.middleware(request)
+        self.assertEqual(self.seen, [self.main])
+
+    def test_jwt_user_profile_branch(self):
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION=self.bearer()))
+        self.assertEqual(self.seen, [self.east])
+
+    def test_default_branch(self):
+        self.middleware(self.factory.get('/'))
+        self.assertEqual(self.seen, [self.main])
+
+    def test_cached_resolution_runs_no_queries(self):
+        request = self.factory.get('/', HTTP_AUTHORIZATION=self.bearer())
+        self.middleware(request)
+        with self.assertNumQueries(0):
+            self.middleware(self.factory.get('/', HTTP_AUTHORIZATION=self.bearer()))
+            self.middleware(self.factory.get('/', HTTP_X_BRANCH_ID=str(self.east.pk)))
+        self.assertEqual(self.seen, [self.east] * 3)
+
+    def test_profile_change_invalidates_user(self):
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION=self.bearer()))
+        self.profile.branch = self.main
+        self.profile.save()
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION=self.bearer()))
+        self.assertEqual(self.seen, [self.east, self.main])
+
+    def test_deactivated_branch_invalidates(self):
+        self.middleware(self.factory.get('/', HTTP_X_BRANCH_ID=str(self.east.pk)))
+        self.east.is_active = False
+        self.east.save()
+        self.middleware(self.factory.get('/', HTTP_X_BRANCH_ID=str(self.east.pk)))
+        self.assertEqual(self.seen, [self.east, self.main])
+
+    def test_async_request(self):
+        async def view(request):
+            self.seen.append(BranchContextMiddleware.get_current_branch())
+            return HttpResponse()
+
+        middleware = BranchContextMiddleware(view)
+        # Warm the cache so the async path doesn't need the database
+        self.middleware(self.factory.get('/', HTTP_X_BRANCH_ID=str(self.east.pk)))
+        asyncio.run(middleware(self.factory.get('/', HTTP_X_BRANCH_ID=str(self.east.pk))))
+        self.assertEqual(self.seen, [self.east, self.east])
+        self.assertIsNone(BranchContextMiddleware.get_current_branch())
+
+
+class BranchSecurityMiddlewareTest(TestCase):
+    def setUp(self):
+        invalidate_branch()
+        invalidate_user()
+        self.factory = RequestFactory()
+        self.main = Branch.objects.create(name='Main', location='Town')
+        self.east = Branch.objects.create(name='East', location='Eastlands')
+        for name, branch in [('main_cashier', self.main), ('east_cashier', self.east)]:
+            user = User.objects.create_user(username=name, password='testpass')
+            UserProfile.objects.create(user=user, role='cashier', branch=branch)
+        Category.objects.create(name='Spirits')
+
+    def tearDown(self):
+        invalidate_branch()
+        invalidate_user()
+
+    def run_view(self, view, **headers):
+        middleware = BranchContextMiddleware(BranchSecurityMiddleware(view))
+        return middleware(self.factory.get('/', **headers))
+
+    def test_branch_fields_detected_per_model(self):
+        self.assertEqual(branch_field_for(UserProfile), 'branch')
+        self.assertIsNone(branch_field_for(Category))
+        self.assertIsNone(branch_field_for(Branch))
+
+    def test_branch_scoped_querysets_are_restricted(self):
+        def view(request):
+            names = list(UserProfile.objects.values_list('user__username', flat=True))
+            everyone = UserProfile.objects.all_branches().count()
+            return HttpResponse(f'{",".join(names)}|{everyone}')
+
+        response = self.run_view(view, HTTP_X_BRANCH_ID=str(self.east.pk))
+        self.assertEqual(response.content.decode(), 'east_cashier|2')
+        self.assertIsNone(get_enforced_branch())
+        self.assertEqual(UserProfile.objects.count(), 2)
+
+    def test_models_without_branch_field_are_untouched(self):
+        def view(request):
+            sql = str(Category.objects.filter(name='Spirits').query)
+            return HttpResponse(sql)
+
+        response = self.run_view(view, HTTP_X_BRANCH_ID=str(self.east.pk))
+        self.assertEqual(response.content.decode(), str(Category.objects.filter(name='Spirits').query))
+
+    def test_filter_by_current_branch_keeps_existing_filters(self):
+        def view(request):
+            qs = filter_by_current_branch(UserProfile.objects.all_branches().filter(role='cashier'))
+            return HttpResponse(qs.count())
+
+        response = self.run_view(view, HTTP_X_BRANCH_ID=str(self.main.pk))
+        self.assertEqual(response.content, b'1')
+
+
+class DataVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Spirits')
+
+    def make_product(self, sku='P1'):
+        return Product.objects.create(
+            sku=sku, name=f'Product {sku}', category=self.category,
+            cost_price=Decimal('10.00'), selling_price=Decimal('15.00'), stock_quantity=5
+        )
+
+    def test_writes_bump_their_domains_on_commit(self):
+        before = get_versions(versions.DOMAINS)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.make_product()
+            # Not visible to readers until the transaction commits
+            self.assertEqual(get_versions(versions.DOMAINS), before)
+        after = get_versions(versions.DOMAINS)
+        changed = {key for key in before if before[key] != after[key]}
+        self.assertEqual(changed, {'data-version:catalogue:all', 'data-version:stock:all'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StockMovement.objects.create(product=product, movement_type='in', quantity=2)
+        self.assertNotEqual(version_stamp([versions.STOCK]), str(after['data-version:stock:all']))
+        self.assertEqual(version_stamp([versions.CATALOGUE]), str(after['data-version:catalogue:all']))
+
+    def test_each_domain_is_bumped_once_per_transaction(self):
+        start = get_versions([versions.CATALOGUE])['data-version:catalogue:all']
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(5):
+                self.make_product(f'P{n}')
+        self.assertEqual(get_versions([versions.CATALOGUE])['data-version:catalogue:all'], start + 1)
+
+    def queue_bumps(self, domains):
+        versions.bump_on_commit(domains)
+        return versions._pending.get()
+
+    def test_pending_bumps_are_kept_per_context(self):
+        # Two coroutines on one thread each queue only their own writes
+        with self.captureOnCommitCallbacks():
+            first = contextvars.Context().run(self.queue_bumps, [versions.SALES])
+            second = contextvars.Context().run(self.queue_bumps, [versions.CATALOGUE])
+        self.assertEqual(first, {(versions.SALES, None)})
+        self.assertEqual(second, {(versions.CATALOGUE, None)})
+
+    def test_branch_versions_are_included_for_the_branch(self):
+        branch = Branch.objects.create(name='Main', location='Town', address='1 Main St', phone='0700000001')
+        stamp = version_stamp([versions.SALES], branch)
+        self.assertEqual(len(get_versions([versions.SALES], branch)), 2)
+        bump([versions.SALES], branch.pk)
+        self.assertNotEqual(version_stamp([versions.SALES], branch), stamp)
+        # Other branches only see the global counter move
+        other = Branch.objects.create(name='Other', location='Town', address='2 Main St', phone='0700000002')
+        other_stamp = version_stamp([versions.SALES], other)
+        bump([versions.SALES], branch.pk)
+        self.assertEqual(version_stamp([versions.SALES], other), other_stamp)
@@ -3,107 +3,167 @@ Branch filtering utilities for Django models and queries.
 
 This module provides utilities to automatically filter queries by the current branch
 context, ensuring proper data isolation between branches.
+
+Whether a model is branch-scoped (has a ``branch`` foreign key to
+``branches.Branch``) is worked out once, when the model class is prepared, and
+kept in ``_branch_fields``. Querysets only ever do a dict lookup; models
+without a branch field never get a filter added.
 """
 
-from django.db.models import QuerySet, Q
+from contextvars import ContextVar
+
+from django.db import models
+from django.db.models import QuerySet
+from django.db.models.signals import class_prepared
 from .middleware import BranchContextMiddleware
 
+# model -> name of its branch foreign key, or None if it isn't branch-scoped
+_branch_fields = {}
+
+# Branch that BranchManager restricts querysets to; set by BranchSecurityMiddleware
+_enforced_branch = ContextVar('enforced_branch', default=None)
+
+
+def _points_to_branch(field):
+    if not (field.is_relation and field.many_to_one) or field.name != 'branch':
+        return False
+    related = field.remote_field.model
+    # The target may still be a lazy "app_label.Model" string at prepare time
+    name = related if isinstance(related, str) else related.__name__
+    return name.rsplit('.', 1)[-1] == 'Branch'
+
+
+def _detect_branch_field(model):
+    opts = model._meta
+    if opts.proxy:
+        return branch_field_for(opts.concrete_model)
+    for field in opts.local_fields:
+        if _points_to_branch(field):
+            return field.name
+    for parent in opts.parents:
+        field_name = branch_field_for(parent)
+        if field_name:
+            return field_name
+    return None
+
+
+def branch_field_for(model):
+    """Name of the model's branch foreign key, or None"""
+    try:
+        return _branch_fields[model]
+    except KeyError:
+        # Prepared before this module was imported
+        field_name = _branch_fields[model] = _detect_branch_field(model)
+        return field_name
+
+
+def is_branch_scoped(model):
+    return branch_field_for(model) is not None
+
+
+def _register_model(sender, **kwargs):
+    _branch_fields[sender] = _detect_branch_field(sender)
+
+
+class_prepared.connect(_register_model, dispatch_uid='branches.utils.register_model')
+
+
+def get_enforced_branch():
+    return _enforced_branch.get()
+
+
+def enforce_branch(branch):
+    """Restrict BranchManager querysets to ``branch``; returns a token for ``release_branch``"""
+    return _enforced_branch.set(branch)
+
+
+def release_branch(token):
+    _enforced_branch.reset(token)
+
 
 class BranchQuerySet(QuerySet):
     """
-    Custom QuerySet that automatically filters by branch context.
+    QuerySet that can filter itself by branch context.
     """
-    
-    def __init__(self, model=None, query=None, using=None, hints=None):
-        super().__init__(model, query, using, hints)
-        self._branch_filtered = False
-    
-    def _clone(self):
-        clone = super()._clone()
-        clone._branch_filtered = getattr(self, '_branch_filtered', False)
-        return clone
-    
+
     def filter_by_branch(self, branch=None, exclude_null=False):
         """
         Filter the queryset by the specified branch or current branch context.
-        
+
         Args:
             branch: Branch instance to filter by. If None, uses current branch context.
             exclude_null: If True, excludes records without branch assignment.
         """
+        field_name = branch_field_for(self.model)
+        if field_name is None:
+            return self
+
         if branch is None:
             branch = BranchContextMiddleware.get_current_branch()
-        
+
         if branch is None:
             # If no branch context, return as-is or filter out nulls
             if exclude_null:
-                return self.filter(branch__isnull=False)
+                return self.filter(**{f'{field_name}__isnull': False})
             return self
-        
-        # Check if the model has a branch field
-        model_branch_field = None
-        for field in self.model._meta.get_fields():
-            if field.name == 'branch' and hasattr(field, 'related_model'):
-                if field.related_model.__name__ == 'Branch':
-                    model_branch_field = 'branch'
-                    break
-        
-        if model_branch_field:
-            if exclude_null:
-                return self.filter(**{model_branch_field: branch})
-            return self.filter(**{model_branch_field: branch})
-        
-        return self
-    
+
+        return self.filter(**{field_name: branch})
+
+
+class BranchManager(models.Manager.from_queryset(BranchQuerySet)):
+    """
+    Default manager for branch-scoped models.
+
+    While BranchSecurityMiddleware is enforcing a branch, every queryset
+    starts out filtered to it. ``all_branches()`` skips the restriction for
+    code that legitimately works across branches.
+    """
+
     def get_queryset(self):
-        """
-        Override get_queryset to automatically apply branch filtering.
-        """
         qs = super().get_queryset()
-        
-        # Only apply branch filtering if not already applied and model has branch field
-        if not getattr(self, '_branch_filtered', False):
-            for field in self.model._meta.get_fields():
-                if field.name == 'branch' and hasattr(field, 'related_model'):
-                    if field.related_model.__name__ == 'Branch':
-                        current_branch = BranchContextMiddleware.get_current_branch()
-                        if current_branch:
-                            qs = qs.filter(branch=current_branch)
-                            self._branch_filtered = True
-                        break
-        
+        branch = _enforced_branch.get()
+        if branch is not None:
+            field_name = branch_field_for(self.model)
+            if field_name is not None:
+                qs = qs.filter(**{field_name: branch})
         return qs
 
+    def all_branches(self):
+        return super().get_queryset()
+
 
 def get_branch_filtered_queryset(model_class):
     """
     Get a branch-filtered queryset for the given model class.
-    
+
     Args:
         model_class: Django model class
-        
+
     Returns:
         BranchQuerySet instance filtered by current branch context
     """
-    return BranchQuerySet(model_class)
+    return BranchQuerySet(model_class).filter_by_branch()
 
 
 def filter_by_current_branch(obj_or_qs):
     """
     Filter an object or queryset by the current branch context.
-    
+
     Args:
         obj_or_qs: Django model instance or QuerySet
-        
+
     Returns:
         Filtered object or queryset
     """
+    current_branch = BranchContextMiddleware.get_current_branch()
     if hasattr(obj_or_qs, 'filter'):
         # It's a queryset
-        return get_branch_filtered_queryset(obj_or_qs.model).filter_by_branch()
+        field_name = branch_field_for(obj_or_qs.model)
+        if current_branch and field_name:
+            return obj_or_qs.filter(**{field_name: current_branch})
+        return obj_or_qs
     else:
         # It's a single object
-        current_branch = BranchContextMiddleware.get_current_branch()
-        if current_branch and hasattr(obj_or_qs, 'branch'):
+        if current_branch and is_branch_scoped(type(obj_or_qs)):
             return obj_or_qs if obj_or_qs.branch == current_branch else None
-        return obj_or_qs
\ No newline at end of file
+        return obj_or_qs
@@ -0,0 +1,117 @@
+"""
+Data versions: counters that change whenever a domain's data is written.
+
+Caches, ETags and rollups can key on a domain's version instead of a fixed
+TTL; once a write commits, every key built from the old version is simply
+never asked for again. ``branches.signals`` bumps the counters on
+``post_save``/``post_delete`` of the models in ``MODEL_DOMAINS``.
+
+Counters live in the default cache, so they are shared between processes
+when it is Redis. Each domain has a global counter and one per branch;
+writes to branch-scoped models bump their branch's counter, writes to
+other models the global one, and readers get both.
+"""
+
+import time
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .middleware import BranchContextMiddleware
+
+SALES = 'sales'
+STOCK = 'stock'
+CATALOGUE = 'catalogue'
+SHIFT = 'shift'
+CUSTOMER = 'customer'
+
+DOMAINS = [SALES, STOCK, CATALOGUE, SHIFT, CUSTOMER]
+
+# Checkout moves stock and shift totals with bulk and F() updates that send
+# no signals, so a sale also stands for those writes
+MODEL_DOMAINS = {
+    'sales.Sale': [SALES, STOCK, SHIFT],
+    'sales.SaleItem': [SALES, STOCK],
+    # Held carts are listed in the shift's sales summary
+    'sales.Cart': [SALES, SHIFT],
+    'payments.Payment': [SALES, CUSTOMER],
+    'inventory.Category': [CATALOGUE],
+    'inventory.Product': [CATALOGUE, STOCK],
+    'inventory.Batch': [STOCK],
+    'inventory.StockMovement': [STOCK],
+    'shifts.Shift': [SHIFT],
+    'customers.Customer': [CUSTOMER],
+}
+
+# (domain, branch_id) pairs waiting for the current transaction to commit;
+# per context rather than per thread, like the request context in
+# branches.middleware, so coroutines sharing a thread don't see each other's
+_pending = ContextVar('pending_version_bumps', default=None)
+
+
+def _key(domain, branch_id):
+    return f'data-version:{domain}:{branch_id or "all"}'
+
+
+def _branch_id(branch):
+    if branch is None:
+        branch = BranchContextMiddleware.get_current_branch()
+    return getattr(branch, 'pk', branch)
+
+
+def get_versions(domains, branch=None):
+    """
+    ``{key: version}`` for the domains, global and for the branch (default:
+    current; ``False`` for the global counters only)
+    """
+    branch_id = _branch_id(branch)
+    keys = [_key(domain, None) for domain in domains]
+    if branch_id:
+        keys += [_key(domain, branch_id) for domain in domains]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Start from the clock, so a flushed cache never brings back old versions
+        start = int(time.time() * 1000)
+        for key in missing:
+            cache.add(key, start, timeout=None)
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+def version_stamp(domains, branch=None):
+    """The domains' versions as one short string, for cache keys and ETags"""
+    versions = get_versions(domains, branch)
+    return '.'.join(str(versions[key]) for key in sorted(versions))
+
+
+def bump(domains, branch_id=None):
+    """Move the domains (global, or one branch's) on to a new version now"""
+    for domain in domains:
+        key = _key(domain, branch_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Never read (or evicted); the next read starts a fresh version
+            pass
+
+
+def _flush():
+    pending = _pending.get()
+    _pending.set(None)
+    for domain, branch_id in pending or ():
+        bump([domain], branch_id)
+
+
+def bump_on_commit(domains, branch_id=None):
+    """
+    Bump the domains once the current transaction commits (immediately
+    outside one). Repeated calls within a transaction bump each domain once.
+    """
+    writes = _pending.get()
+    if writes is None:
+        writes = set()
+        _pending.set(writes)
+    writes.update((domain, branch_id) for domain in domains)
+    transaction.on_commit(_flush)
@@ -4,7 +4,7 @@ from .models import Chit
 from .serializers import ChitSerializer
 
 class ChitViewSet(viewsets.ModelViewSet):
-    queryset = Chit.objects.all()
+    queryset = Chit.objects.select_related('customer')
     serializer_class = ChitSerializer
 
     def create(self, request, *args, **kwargs):
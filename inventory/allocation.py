@@ -0,0 +1,191 @@
+"""
+FIFO stock allocation for sales.
+
+An allocation locks the product rows it touches and then their sellable
+batches, both in primary-key order, so concurrent tills selling the same SKU
+queue behind each other instead of deadlocking or overwriting each other's
+counts. Quantities are allocated FIFO over the locked rows and written back as
+guarded ``F()`` decrements, never as absolute values computed in Python.
+
+Must be used inside ``transaction.atomic()``.
+"""
+
+from datetime import date
+
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Batch, Product
+
+
+class StockAllocationError(Exception):
+    """Base class for allocation failures; the message is safe to show to the till."""
+
+
+class InsufficientStock(StockAllocationError):
+    """Not enough sellable stock for a requested quantity."""
+
+
+class StockConflict(StockAllocationError):
+    """A guarded update matched fewer rows than planned; the transaction must be retried."""
+
+
+def sellable_batches(product_ids):
+    """Batches that can be sold from for the given products"""
+    return Batch.objects.filter(
+        product_id__in=product_ids,
+        quantity__gt=0
+    ).exclude(
+        status__in=['damaged', 'expired'],
+        expiry_date__lt=timezone.now().date()
+    )
+
+
+def fifo_key(batch):
+    """Oldest expiry first, batches without an expiry date last, then purchase date"""
+    return (
+        batch.expiry_date is None,
+        batch.expiry_date or date.min,
+        batch.purchase_date,
+        batch.pk,
+    )
+
+
+def _guarded_update(model, field, amounts, sign, **extra):
+    """
+    Add ``sign * amounts[pk]`` to ``field`` on every row in one UPDATE.
+
+    Decrements only match rows that still hold enough stock; if any row is
+    missed the whole allocation is stale and StockConflict is raised so the
+    surrounding transaction rolls back. Increments are never refused.
+    """
+    if not amounts:
+        return
+    delta = Case(
+        *[When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()],
+        output_field=IntegerField()
+    )
+    if sign < 0:
+        rows = Q()
+        for pk, amount in amounts.items():
+            rows |= Q(pk=pk, **{f'{field}__gte': amount})
+        value = F(field) - delta
+    else:
+        rows = Q(pk__in=list(amounts))
+        value = F(field) + delta
+
+    updated = model.objects.filter(rows).update(**{field: value}, **extra)
+    if sign < 0 and updated != len(amounts):
+        raise StockConflict(
+            f'Stock for {model._meta.verbose_name} changed while this sale was being processed. Please retry.'
+        )
+
+
+class StockAllocation:
+    """
+    FIFO allocation of ``(product_id, quantity)`` lines over locked rows.
+
+    ``parts`` holds one list of ``(batch, quantity)`` pairs per line. ``batch``
+    is None for products with no batch records at all; those are sold straight
+    off ``Product.stock_quantity``.
+    """
+
+    def __init__(self, lines):
+        self.lines = [(int(product_id), int(quantity)) for product_id, quantity in lines]
+        self.products = {}
+        self.batches = {}
+        self.parts = []
+        self.batch_totals = {}
+        self.product_totals = {}
+
+    @classmethod
+    def allocate(cls, lines):
+        allocation = cls(lines)
+        allocation._lock()
+        allocation._allocate()
+        return allocation
+
+    def _lock(self):
+        product_ids = sorted({product_id for product_id, _ in self.lines})
+
+        # Products first, then batches, each in pk order: every allocation
+        # takes its locks in the same global order.
+        self.products = {
+            product.pk: product
+            for product in Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk')
+        }
+        missing = [product_id for product_id in product_ids if product_id not in self.products]
+        if missing:
+            raise InsufficientStock(f'Product {missing[0]} not found')
+
+        for batch in sellable_batches(product_ids).select_for_update().order_by('pk'):
+            self.batches.setdefault(batch.product_id, []).append(batch)
+        for batches in self.batches.values():
+            batches.sort(key=fifo_key)
+
+    def _allocate(self):
+        requested = {}
+        for product_id, quantity in self.lines:
+            requested[product_id] = requested.get(product_id, 0) + quantity
+        for product_id, quantity in requested.items():
+            product = self.products[product_id]
+            if product.stock_quantity < quantity:
+                raise InsufficientStock(
+                    f'Insufficient stock for product "{product.name}". '
+                    f'Available: {product.stock_quantity}, Requested: {quantity}'
+                )
+
+        # Units still free on each batch, so repeated lines for one product
+        # don't allocate the same units twice
+        free_on_batch = {}
+        for product_id, required in self.lines:
+            product = self.products[product_id]
+            batches = self.batches.get(product_id)
+            self.product_totals[product_id] = self.product_totals.get(product_id, 0) + required
+
+            if not batches:
+                # Fallback for products without batch data
+                self.parts.append([(None, required)])
+                continue
+
+            parts = []
+            remaining = required
+            for batch in batches:
+                if remaining <= 0:
+                    break
+                free = free_on_batch.get(batch.pk, batch.quantity)
+                if free <= 0:
+                    continue
+                take = min(remaining, free)
+                parts.append((batch, take))
+                free_on_batch[batch.pk] = free - take
+                self.batch_totals[batch.pk] = self.batch_totals.get(batch.pk, 0) + take
+                remaining -= take
+
+            if remaining > 0:
+                raise InsufficientStock(
+                    f'Insufficient stock for product "{product.name}". '
+                    f'Available: {required - remaining}, Required: {required}'
+                )
+            self.parts.append(parts)
+
+    def apply(self):
+        """Write the allocation as two guarded grouped decrements"""
+        _guarded_update(Batch, 'quantity', self.batch_totals, -1)
+        _guarded_update(Product, 'stock_quantity', self.product_totals, -1, updated_at=timezone.now())
+
+        # Keep the locked instances in step with the rows we just updated
+        for batch_list in self.batches.values():
+            for batch in batch_list:
+                batch.quantity -= self.batch_totals.get(batch.pk, 0)
+        for product_id, quantity in self.product_totals.items():
+            product = self.products[product_id]
+            product.stock_quantity -= quantity
+            # The sale's movements record this; a later save mustn't adjust for it again
+            product._snapshot_tracked_fields(['stock_quantity'])
+
+
+def restore_stock(product_totals, batch_totals=None):
+    """Put stock back (voids, returns) or take deliveries in, with grouped F() increments"""
+    _guarded_update(Batch, 'quantity', batch_totals or {}, 1)
+    _guarded_update(Product, 'stock_quantity', product_totals, 1, updated_at=timezone.now())
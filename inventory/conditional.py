@@ -0,0 +1,57 @@
+"""
+Conditional GET (ETag / Last-Modified) for list endpoints that tills poll.
+
+Validators come from one aggregate over the filtered queryset (row count,
+highest id and, where the model has one, latest modification time) plus
+the version stamp of the data domains the payload depends on. A poll whose
+``If-None-Match`` or ``If-Modified-Since`` still matches gets a 304 without
+loading or serializing a single row.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from branches.versions import version_stamp
+
+
+class ConditionalListMixin:
+    """
+    Add ETag and Last-Modified to a viewset's ``list``.
+
+    ``last_modified_field`` names an auto-updated timestamp on the model (or
+    None), and ``version_domains`` the data domains the serialized rows read
+    from, which covers changes the timestamp cannot see (such as a category
+    rename showing up in product rows).
+    """
+    last_modified_field = None
+    version_domains = ()
+
+    def get_list_validators(self, request, queryset):
+        aggregates = {'count': Count('pk'), 'last_id': Max('pk')}
+        if self.last_modified_field:
+            aggregates['last_modified'] = Max(self.last_modified_field)
+        summary = queryset.order_by().aggregate(**aggregates)
+        last_modified = summary.get('last_modified')
+        fingerprint = '|'.join([
+            request.get_full_path(),
+            str(summary['count']),
+            str(summary['last_id']),
+            last_modified.isoformat() if last_modified else '-',
+            version_stamp(self.version_domains),
+        ])
+        etag = quote_etag(hashlib.sha1(fingerprint.encode()).hexdigest())
+        return etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_list_validators(request, self.filter_queryset(self.get_queryset()))
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
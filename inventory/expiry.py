@@ -0,0 +1,129 @@
+"""
+Set-based expiry sweep.
+
+Received batches whose expiry date has passed are marked expired and their
+units taken off product stock a chunk at a time. Each chunk is one short
+transaction: it locks its products and then its batches in pk order (the
+same order ``inventory.allocation`` uses, so it queues behind tills instead
+of deadlocking with them), marks the batches with one UPDATE, takes the
+units off every product with one grouped UPDATE and writes the
+StockMovements with ``bulk_create``.
+
+Progress is kept in one ``ExpirySweep`` row per cutoff day, moved on in the
+same transaction as the chunk it records. A run that stops early (a
+``max_chunks`` or ``max_seconds`` limit, or a crash) leaves only whole
+chunks behind, and the next run for the same day carries on after the last
+batch it finished.
+"""
+
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from branches import versions
+from .models import Batch, ExpirySweep, Product, StockMovement
+
+EXPIRY_CHUNK_SIZE = getattr(settings, 'EXPIRY_CHUNK_SIZE', 200)
+
+
+def expired_batches(cutoff):
+    """Received batches with stock left that expired before ``cutoff``"""
+    return Batch.objects.filter(expiry_date__lt=cutoff, status='received', quantity__gt=0)
+
+
+def _sweep_chunk(sweep_id, chunk_size):
+    """Expire the next chunk after the checkpoint; returns the sweep and the number of batches looked at"""
+    with transaction.atomic():
+        sweep = ExpirySweep.objects.select_for_update().get(pk=sweep_id)
+        candidates = list(
+            expired_batches(sweep.cutoff).filter(
+                pk__gt=sweep.last_batch_id
+            ).order_by('pk').values_list('pk', 'product_id')[:chunk_size]
+        )
+        if not candidates:
+            sweep.completed_at = timezone.now()
+            sweep.save(update_fields=['completed_at'])
+            return sweep, 0
+
+        # Products first, then batches, each in pk order, like a sale. The
+        # batches are filtered again under the lock so ones sold out or
+        # recalled in the meantime are left alone.
+        stock = dict(
+            Product.objects.select_for_update().filter(
+                pk__in={product_id for _, product_id in candidates}
+            ).order_by('pk').values_list('pk', 'stock_quantity')
+        )
+        batches = list(
+            expired_batches(sweep.cutoff).select_for_update().filter(
+                pk__in=[pk for pk, _ in candidates]
+            ).order_by('pk').values_list('pk', 'product_id', 'batch_number', 'quantity')
+        )
+
+        # Stock never goes below zero; if a product holds less than its
+        # expired batches, what is left is all that can be taken off
+        removed = {}
+        movements = []
+        for _, product_id, batch_number, quantity in batches:
+            take = min(quantity, stock[product_id] - removed.get(product_id, 0))
+            if take <= 0:
+                continue
+            removed[product_id] = removed.get(product_id, 0) + take
+            movements.append(StockMovement(
+                product_id=product_id,
+                movement_type='adjustment',
+                quantity=-take,
+                reason=f'Batch {batch_number} expired',
+                user=None
+            ))
+
+        Batch.objects.filter(pk__in=[batch[0] for batch in batches]).update(status='expired')
+        if removed:
+            Product.objects.filter(pk__in=list(removed)).update(
+                stock_quantity=F('stock_quantity') - Case(
+                    *[When(pk=pk, then=Value(amount)) for pk, amount in removed.items()],
+                    output_field=IntegerField()
+                ),
+                updated_at=timezone.now()
+            )
+        StockMovement.objects.bulk_create(movements)
+
+        sweep.last_batch_id = candidates[-1][0]
+        sweep.batches_expired += len(batches)
+        sweep.units_removed += sum(removed.values())
+        sweep.completed_at = None
+        sweep.save(update_fields=['last_batch_id', 'batches_expired', 'units_removed', 'completed_at'])
+
+        # Bulk updates send no signals
+        versions.bump_on_commit([versions.CATALOGUE, versions.STOCK])
+    return sweep, len(candidates)
+
+
+def sweep_expired(cutoff=None, chunk_size=EXPIRY_CHUNK_SIZE, max_chunks=None, max_seconds=None, pause=0):
+    """
+    Expire every received batch with stock left whose expiry date is before
+    ``cutoff`` (default: today, local time) and return the ``ExpirySweep``.
+
+    ``max_chunks`` and ``max_seconds`` bound a run, for schedulers that must
+    stay out of the way during trading hours; ``pause`` sleeps between
+    chunks to let tills in. The returned sweep's ``completed_at`` is set
+    once nothing is left to expire.
+    """
+    cutoff = cutoff or timezone.localdate()
+    sweep, _ = ExpirySweep.objects.get_or_create(cutoff=cutoff)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    chunks = 0
+    while True:
+        sweep, swept = _sweep_chunk(sweep.pk, chunk_size)
+        if not swept:
+            break
+        chunks += 1
+        if max_chunks and chunks >= max_chunks:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        if pause:
+            time.sleep(pause)
+    return sweep
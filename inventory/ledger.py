@@ -0,0 +1,222 @@
+"""
+Stock ledger: StockMovement as the append-only record of every change to
+product stock, with daily checkpoints.
+
+Every path that moves ``Product.stock_quantity`` (checkout, voids,
+receiving, expiry, recalls) writes a signed StockMovement, and so does any
+other ``Product.save`` that changes it (an ``adjustment`` for the
+difference, e.g. editing a product through the API), so a product's stock
+at any moment is its closing stock at the last checkpoint plus the
+movements since. Movements are read-only in the API. ``take_checkpoint`` writes a ``DailyStockSnapshot`` per
+product for a closed day, carried forward from the previous checkpoint's
+snapshots and that day's movements (one grouped query), and records a
+``StockCheckpoint``. A point-in-time query (``stock_at``) is then one
+snapshot lookup plus a scan of less than a day or so of movements, and
+``drift`` compares every product with the ledger in one query.
+
+The first checkpoint has nothing to carry forward and takes the current
+stock, less the movements recorded since the day closed, as its baseline
+(read in one statement, see ``snapshots.stock_before``); products added
+after a checkpoint are baselined the same way the first time they are seen.
+This job is the only writer of ``DailyStockSnapshot``.
+
+Writes that bypass ``save`` (``QuerySet.update``, raw SQL) still leave
+stock off the ledger; ``drift`` finds them and ``rebaseline`` accepts the
+current stock, treating the unrecorded change as made before the latest
+checkpoint.
+
+Batch quantities are also moved without a movement of their own (voids put
+units back onto batches from the sales history), so ``DailyBatchSnapshot``
+rows record batch quantities as they stand when the checkpoint for the day
+that has just closed is taken; run the job shortly after midnight.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from reports.rollups import day_bounds
+from .models import Batch, DailyBatchSnapshot, DailyStockSnapshot, Product, StockCheckpoint, StockMovement
+from .snapshots import SIGNED_QUANTITY, stock_before
+
+
+class LedgerError(Exception):
+    """The ledger can't answer yet; the message says what to run."""
+
+
+def _net_movements(start=None, end=None, product_ids=None):
+    """``{product_id: net quantity}`` for movements in ``[start, end)``"""
+    movements = StockMovement.objects.all()
+    if start is not None:
+        movements = movements.filter(created_at__gte=start)
+    if end is not None:
+        movements = movements.filter(created_at__lt=end)
+    if product_ids is not None:
+        movements = movements.filter(product_id__in=product_ids)
+    return dict(
+        movements.values('product_id').annotate(net=Sum(SIGNED_QUANTITY)).order_by().values_list('product_id', 'net')
+    )
+
+
+def latest_checkpoint(before=None):
+    """The most recent checkpoint, or the most recent one for a day before ``before``"""
+    checkpoints = StockCheckpoint.objects.order_by('-date')
+    if before is not None:
+        checkpoints = checkpoints.filter(date__lt=before)
+    return checkpoints.first()
+
+
+def take_checkpoint(day):
+    """Write the closing snapshots for ``day`` (which must be over) and record the checkpoint"""
+    if day >= timezone.localdate():
+        raise LedgerError(f'{day} is not over yet')
+    _, day_end = day_bounds(day)
+
+    with transaction.atomic():
+        previous = latest_checkpoint(before=day)
+        opening, nets, baseline = {}, {}, {}
+        if previous is not None:
+            opening = dict(
+                DailyStockSnapshot.objects.filter(date=previous.date).values_list('product_id', 'closing_stock')
+            )
+            nets = _net_movements(day_bounds(previous.date)[1], day_end)
+
+        products = list(Product.objects.values_list('pk', flat=True))
+        unseen = [pk for pk in products if pk not in opening]
+        if unseen:
+            # Baseline: the stock as it stands, less what has moved since the day closed
+            baseline = stock_before(day_end, unseen)
+        closing = {}
+        for pk in products:
+            if pk in opening:
+                closing[pk] = opening[pk] + nets.get(pk, 0)
+            elif pk in baseline:
+                closing[pk] = baseline[pk]
+
+        DailyStockSnapshot.objects.bulk_create(
+            [DailyStockSnapshot(product_id=pk, date=day, closing_stock=quantity) for pk, quantity in closing.items()],
+            update_conflicts=True,
+            unique_fields=['product', 'date'],
+            update_fields=['closing_stock']
+        )
+
+        batch_rows = []
+        if day == timezone.localdate() - timedelta(days=1):
+            batch_rows = [
+                DailyBatchSnapshot(batch_id=pk, date=day, quantity=quantity)
+                for pk, quantity in Batch.objects.exclude(status='ordered').filter(
+                    quantity__gt=0
+                ).values_list('pk', 'quantity')
+            ]
+            DailyBatchSnapshot.objects.bulk_create(
+                batch_rows,
+                update_conflicts=True,
+                unique_fields=['batch', 'date'],
+                update_fields=['quantity']
+            )
+
+        checkpoint, _ = StockCheckpoint.objects.update_or_create(
+            date=day, defaults={'products': len(closing), 'batches': len(batch_rows)}
+        )
+    return checkpoint
+
+
+def run_checkpoints(until=None):
+    """
+    Checkpoint every day after the latest checkpoint up to ``until``
+    (default: yesterday), oldest first, one transaction per day. The first
+    run only checkpoints ``until``. Returns the new checkpoints.
+    """
+    until = until or timezone.localdate() - timedelta(days=1)
+    previous = latest_checkpoint()
+    day = previous.date + timedelta(days=1) if previous else until
+    checkpoints = []
+    while day <= until:
+        checkpoints.append(take_checkpoint(day))
+        day += timedelta(days=1)
+    return checkpoints
+
+
+def stock_at(moment, product_ids):
+    """
+    ``{product_id: stock}`` at ``moment``: the closing snapshot of the last
+    checkpoint before it plus the movements in between. Products without a
+    snapshot are worked back from their current stock instead.
+    """
+    product_ids = list(product_ids)
+    stock = {}
+    checkpoint = latest_checkpoint(before=timezone.localdate(moment))
+    if checkpoint is not None:
+        opening = dict(
+            DailyStockSnapshot.objects.filter(
+                date=checkpoint.date, product_id__in=product_ids
+            ).values_list('product_id', 'closing_stock')
+        )
+        nets = _net_movements(day_bounds(checkpoint.date)[1], moment, list(opening))
+        stock = {pk: quantity + nets.get(pk, 0) for pk, quantity in opening.items()}
+
+    missing = [pk for pk in product_ids if pk not in stock]
+    if missing:
+        stock.update(stock_before(moment, missing))
+    return stock
+
+
+def drift():
+    """
+    Products whose ``stock_quantity`` disagrees with the ledger, in one query.
+
+    Each row has the product's ``id``, ``sku``, ``name``, ``stock_quantity``
+    and ``ledger_stock`` (latest checkpoint plus movements since). Products
+    added since the latest checkpoint aren't on the ledger yet and are left
+    out.
+    """
+    checkpoint = latest_checkpoint()
+    if checkpoint is None:
+        raise LedgerError('No stock checkpoint yet; run snapshot_stock first')
+
+    opening = DailyStockSnapshot.objects.filter(
+        product=OuterRef('pk'), date=checkpoint.date
+    ).values('closing_stock')[:1]
+    since = StockMovement.objects.filter(
+        product=OuterRef('pk'), created_at__gte=day_bounds(checkpoint.date)[1]
+    ).values('product').annotate(net=Sum(SIGNED_QUANTITY)).order_by().values('net')
+
+    return Product.objects.annotate(
+        ledger_stock=Subquery(opening, output_field=IntegerField()) + Coalesce(
+            Subquery(since, output_field=IntegerField()), Value(0)
+        )
+    ).filter(
+        ledger_stock__isnull=False
+    ).exclude(
+        stock_quantity=F('ledger_stock')
+    ).order_by('pk').values('id', 'sku', 'name', 'stock_quantity', 'ledger_stock')
+
+
+def rebaseline(product_ids=None):
+    """
+    Accept the current ``stock_quantity`` of the given products (default:
+    every product that has drifted) by rewriting their closing snapshot at
+    the latest checkpoint, worked back from current stock as for a first
+    checkpoint. Returns the ids rebaselined.
+    """
+    checkpoint = latest_checkpoint()
+    if checkpoint is None:
+        raise LedgerError('No stock checkpoint yet; run snapshot_stock first')
+
+    with transaction.atomic():
+        if product_ids is None:
+            product_ids = [row['id'] for row in drift()]
+        closing = stock_before(day_bounds(checkpoint.date)[1], product_ids)
+        DailyStockSnapshot.objects.bulk_create(
+            [
+                DailyStockSnapshot(product_id=pk, date=checkpoint.date, closing_stock=quantity)
+                for pk, quantity in closing.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['product', 'date'],
+            update_fields=['closing_stock']
+        )
+    return list(closing)
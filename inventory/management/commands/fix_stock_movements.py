@@ -37,7 +37,8 @@ class Command(BaseCommand):
 
             old_stock = product.stock_quantity
             product.stock_quantity = max(0, int(total_movement))  # Ensure non-negative
-            product.save(update_fields=['stock_quantity'])
+            # Stock is being set from the movements; don't add one for the change
+            product.save(update_fields=['stock_quantity'], log_history=False)
 
             if old_stock != product.stock_quantity:
                 self.stdout.write(
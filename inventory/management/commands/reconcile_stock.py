@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.ledger import LedgerError, drift, latest_checkpoint, rebaseline
+
+
+class Command(BaseCommand):
+    help = 'Report products whose stock_quantity disagrees with the stock ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any product has drifted')
+        parser.add_argument(
+            '--rebaseline', action='store_true',
+            help="Accept the drifted products' current stock as the ledger's starting point"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            rows = list(drift())
+        except LedgerError as e:
+            raise CommandError(str(e))
+
+        for row in rows:
+            self.stdout.write(
+                f"{row['sku']} {row['name']}: stock {row['stock_quantity']}, ledger {row['ledger_stock']} "
+                f"({row['stock_quantity'] - row['ledger_stock']:+d})"
+            )
+
+        checkpoint = latest_checkpoint()
+        if rows and options['rebaseline']:
+            rebaseline([row['id'] for row in rows])
+            self.stdout.write(self.style.SUCCESS(f'Rebaselined {len(rows)} products at checkpoint {checkpoint.date}'))
+        elif not rows:
+            self.stdout.write(self.style.SUCCESS(f'Stock matches the ledger (checkpoint {checkpoint.date})'))
+        elif options['fail']:
+            raise CommandError(f'{len(rows)} products have drifted from the ledger')
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(rows)} products have drifted from the ledger'))
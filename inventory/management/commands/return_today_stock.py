@@ -4,6 +4,7 @@ from django.db import transaction
 from decimal import Decimal
 from inventory.models import Product, Batch, StockMovement, SalesHistory
 from sales.models import Sale, SaleItem
+from reports.rollups import day_bounds
 
 
 class Command(BaseCommand):
@@ -20,7 +21,7 @@ class Command(BaseCommand):
         dry_run = options['dry_run']
 
         # Always process today's date for automatic execution
-        target_date = timezone.now().date()
+        target_date = timezone.localdate()
 
         self.stdout.write(
             self.style.WARNING(f'Processing automatic stock return for today: {target_date}')
@@ -29,8 +30,9 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
 
         # Get all non-voided sales for the target date
+        start, end = day_bounds(target_date)
         today_sales = Sale.objects.filter(
-            sale_date__date=target_date,
+            sale_date__gte=start, sale_date__lt=end,
             voided=False
         ).select_related('shift').prefetch_related('saleitem_set__product')
 
@@ -64,7 +66,7 @@ class Command(BaseCommand):
                             # Return stock to product
                             from decimal import Decimal
                             product.stock_quantity = Decimal(str(product.stock_quantity)) + Decimal(str(quantity_to_return))
-                            product.save(update_fields=['stock_quantity'])
+                            product.save(update_fields=['stock_quantity'], log_history=False)
 
                             # Create stock movement record
                             StockMovement.objects.create(
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.ledger import LedgerError, run_checkpoints, take_checkpoint
+
+
+class Command(BaseCommand):
+    help = 'Write end-of-day stock snapshots for every day since the last checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Checkpoint (or re-checkpoint) only this day (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            if options['date']:
+                try:
+                    day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+                except ValueError:
+                    raise CommandError('Invalid date format. Use YYYY-MM-DD')
+                checkpoints = [take_checkpoint(day)]
+            else:
+                checkpoints = run_checkpoints()
+        except LedgerError as e:
+            raise CommandError(str(e))
+
+        for checkpoint in checkpoints:
+            self.stdout.write(
+                f'{checkpoint.date}: {checkpoint.products} product and {checkpoint.batches} batch snapshots'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(checkpoints)} stock checkpoints'))
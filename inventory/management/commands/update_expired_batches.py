@@ -1,52 +1,45 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from inventory.models import Batch, StockMovement
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.expiry import EXPIRY_CHUNK_SIZE, sweep_expired
 
 
 class Command(BaseCommand):
-    help = 'Update expired batches and remove them from stock'
+    help = 'Update expired batches and remove them from stock, in resumable chunks'
 
-    def handle(self, *args, **options):
-        today = timezone.now().date()
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Expire batches that expired before this day (YYYY-MM-DD, default today)')
+        parser.add_argument('--chunk-size', type=int, default=EXPIRY_CHUNK_SIZE, help='Batches per transaction')
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks; the next run resumes')
+        parser.add_argument('--max-seconds', type=float, help='Stop after this long; the next run resumes')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between chunks')
 
-        # Find batches that have expired but are still marked as received
-        expired_batches = Batch.objects.filter(
-            expiry_date__lt=today,
-            status='received',
-            quantity__gt=0
+    def handle(self, *args, **options):
+        cutoff = None
+        if options['date']:
+            try:
+                cutoff = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid date format. Use YYYY-MM-DD')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        sweep = sweep_expired(
+            cutoff,
+            chunk_size=options['chunk_size'],
+            max_chunks=options['max_chunks'],
+            max_seconds=options['max_seconds'],
+            pause=options['pause']
         )
 
-        updated_count = 0
-        total_quantity_removed = 0
-
-        for batch in expired_batches:
-            # Mark batch as expired
-            batch.status = 'expired'
-            batch.save()
-
-            # Remove from product stock
-            batch.product.stock_quantity -= batch.quantity
-            batch.product.save()
-
-            # Create stock movement record
-            StockMovement.objects.create(
-                product=batch.product,
-                movement_type='adjustment',
-                quantity=-batch.quantity,
-                reason=f'Batch {batch.batch_number} expired',
-                user=None
-            )
-
-            updated_count += 1
-            total_quantity_removed += batch.quantity
-
-            self.stdout.write(
-                f'Expired batch {batch.batch_number} for {batch.product.name} - removed {batch.quantity} units'
-            )
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Successfully updated {updated_count} expired batches, '
-                f'removed {total_quantity_removed} units from stock'
-            )
-        )
\ No newline at end of file
+        message = (
+            f'Successfully updated {sweep.batches_expired} expired batches, '
+            f'removed {sweep.units_removed} units from stock'
+        )
+        if sweep.completed_at:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{message}; stopped after batch {sweep.last_batch_id}, run again to resume'
+            ))
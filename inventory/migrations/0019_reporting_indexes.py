@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0005_remove_customer_branch_and_more'),
+        ('inventory', '0018_dailystocksnapshot'),
+        ('suppliers', '0013_remove_supplier_branch'),
+        ('users', '0002_alter_userprofile_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date', 'purchase_date'], name='inventory_batch_sellable_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producthistory',
+            index=models.Index(fields=['product', 'changed_at'], name='inventory_ph_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleshistory',
+            index=models.Index(fields=['sale_date'], name='inventory_sh_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleshistory',
+            index=models.Index(fields=['product', 'sale_date'], name='inventory_sh_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleshistory',
+            index=models.Index(fields=['receipt_number'], name='inventory_sh_receipt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['created_at'], name='inventory_movement_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'created_at'], name='inventory_movement_prod_idx'),
+        ),
+    ]
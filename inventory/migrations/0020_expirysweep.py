@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_reporting_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpirySweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateField(unique=True)),
+                ('last_batch_id', models.PositiveIntegerField(default=0)),
+                ('batches_expired', models.PositiveIntegerField(default=0)),
+                ('units_removed', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-cutoff'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0021_stock_ledger_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='saleshistory',
+            name='sale_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
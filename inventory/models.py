@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -33,59 +34,137 @@ class Product(models.Model):
     def is_low_stock(self):
         return self.stock_quantity <= self.low_stock_threshold
 
-    def save(self, *args, **kwargs):
-        # Track changes for history logging
-        is_new = self.pk is None
-        old_instance = None
+    # Fields whose changes are written to ProductHistory
+    TRACKED_FIELDS = [
+        'name', 'sku', 'cost_price', 'selling_price', 'wholesale_price',
+        'wholesale_min_qty', 'stock_quantity', 'low_stock_threshold',
+        'barcode', 'description', 'is_active', 'category'
+    ]
 
-        if not is_new:
-            try:
-                old_instance = Product.objects.get(pk=self.pk)
-            except Product.DoesNotExist:
-                is_new = True
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked_fields()
+
+    def _snapshot_tracked_fields(self, fields=None):
+        """
+        Remember the tracked values as they are in the database (deferred
+        fields are skipped). With ``fields``, only those are re-snapshotted.
+        """
+        values = {
+            field: self.__dict__[self._meta.get_field(field).attname]
+            for field in self.TRACKED_FIELDS
+            if (fields is None or field in fields) and self._meta.get_field(field).attname in self.__dict__
+        }
+        if fields is None:
+            self._loaded_values = values
+        else:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), **values}
+
+    def save(self, *args, log_history=True, **kwargs):
+        """
+        Save and record field changes in ProductHistory.
+
+        Changes are diffed against the values snapshotted when the instance
+        was loaded, so no extra SELECT is needed. A change to
+        ``stock_quantity`` also writes an ``adjustment`` StockMovement for
+        the difference, keeping the stock ledger (``inventory.ledger``)
+        complete. Pass ``log_history=False`` for stock updates that are
+        already recorded as StockMovements.
+        """
+        is_new = self.pk is None
+        old_values = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Accept attnames (``category_id``) as Django does
+            update_fields = {self._meta.get_field(field).name for field in update_fields}
+
+        if not is_new and log_history:
+            old_values = getattr(self, '_loaded_values', None)
+            if old_values is None:
+                # Not loaded from the database (e.g. built with an explicit pk)
+                attnames = [self._meta.get_field(field).attname for field in self.TRACKED_FIELDS]
+                row = Product.objects.filter(pk=self.pk).values_list(*attnames).first()
+                if row is None:
+                    is_new = True
+                else:
+                    old_values = dict(zip(self.TRACKED_FIELDS, row))
 
         super().save(*args, **kwargs)  # Save first to get pk for new instances
 
-        if is_new:
-            # New product
-            ProductHistory.objects.create(
-                product=self,
-                change_type='create',
-                notes='Product created'
-            )
-        else:
-            # Existing product - log changes
-            self._log_changes(old_instance)
-
-    def _log_changes(self, old_instance):
-        """Log changes to product fields"""
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-
-        # Fields to track
-        tracked_fields = [
-            'name', 'sku', 'cost_price', 'selling_price', 'wholesale_price',
-            'wholesale_min_qty', 'stock_quantity', 'low_stock_threshold',
-            'barcode', 'description', 'is_active', 'category'
-        ]
+        if log_history:
+            if is_new:
+                # New product
+                ProductHistory.objects.create(
+                    product=self,
+                    change_type='create',
+                    notes='Product created'
+                )
+            else:
+                # Existing product - log changes
+                self._log_changes(old_values, update_fields)
+
+        # Fields left out of update_fields still differ from the database
+        self._snapshot_tracked_fields(update_fields)
+
+    def _log_changes(self, old_values, update_fields=None):
+        """Log changes to product fields with a single bulk insert, and stock edits as a movement"""
+        fields = self.TRACKED_FIELDS
+        if update_fields is not None:
+            fields = [field for field in fields if field in update_fields]
+
+        changes = []
+        for field in fields:
+            if field not in old_values:
+                continue
+            old_value = old_values[field]
+            new_value = getattr(self, self._meta.get_field(field).attname)
+            if old_value != new_value:
+                changes.append((field, old_value, new_value))
 
-        for field in tracked_fields:
-            old_value = getattr(old_instance, field)
-            new_value = getattr(self, field)
+        if not changes:
+            return
 
-            if old_value != new_value:
-                # Get current user from middleware
-                from branches.middleware import BranchContextMiddleware
-                user = BranchContextMiddleware.get_current_user()
+        # Categories are compared by id; log their names like before
+        category_ids = [value for field, old, new in changes if field == 'category' for value in (old, new)]
+        categories = Category.objects.in_bulk([pk for pk in category_ids if pk is not None]) if category_ids else {}
 
-                ProductHistory.objects.create(
+        def display(field, value):
+            if field == 'category':
+                value = categories.get(value)
+            return str(value) if value is not None else ''
+
+        # Get current user from middleware
+        from branches.middleware import BranchContextMiddleware
+        user = BranchContextMiddleware.get_current_user()
+        profile = getattr(user, 'userprofile', None) if user else None
+
+        ProductHistory.objects.bulk_create([
+            ProductHistory(
+                product=self,
+                field_changed=field,
+                old_value=display(field, old_value),
+                new_value=display(field, new_value),
+                change_type='update',
+                user=profile,
+                notes=f'Updated {field}'
+            )
+            for field, old_value, new_value in changes
+        ])
+
+        for field, old_value, new_value in changes:
+            if field == 'stock_quantity':
+                StockMovement.objects.create(
                     product=self,
-                    field_changed=field,
-                    old_value=str(old_value) if old_value is not None else '',
-                    new_value=str(new_value) if new_value is not None else '',
-                    change_type='update',
-                    user=user.userprofile if user else None,
-                    notes=f'Updated {field}'
+                    movement_type='adjustment',
+                    quantity=new_value - old_value,
+                    reason='Stock quantity edited',
+                    user=profile
                 )
 
 class Batch(models.Model):
@@ -106,10 +185,20 @@ class Batch(models.Model):
     status = models.CharField(max_length=20, choices=BATCH_STATUS, default='ordered')
     received_date = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # FIFO allocation: a product's batches with stock left, by expiry then purchase date
+            models.Index(
+                fields=['product', 'expiry_date', 'purchase_date'],
+                condition=models.Q(quantity__gt=0),
+                name='inventory_batch_sellable_idx'
+            ),
+        ]
+
     def __str__(self):
         return f"{self.product.name} - Batch {self.batch_number}"
 
-    def receive_batch(self, actual_quantity=None):
+    def receive_batch(self, actual_quantity=None, reason=None, user=None):
         """Mark batch as received and add to stock"""
         from django.utils import timezone
         from .models import StockMovement
@@ -124,15 +213,15 @@ class Batch(models.Model):
 
             # Add to product stock
             self.product.stock_quantity += quantity_to_add
-            self.product.save()
+            self.product.save(log_history=False)
 
             # Create stock movement record
             StockMovement.objects.create(
                 product=self.product,
                 movement_type='in',
                 quantity=quantity_to_add,
-                reason=f'Batch {self.batch_number} received',
-                user=None  # TODO: Add user when authentication is available
+                reason=reason or f'Batch {self.batch_number} received',
+                user=user
             )
 
             # Update purchase order item
@@ -155,9 +244,72 @@ class StockMovement(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey('users.UserProfile', on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='inventory_movement_date_idx'),
+            models.Index(fields=['product', 'created_at'], name='inventory_movement_prod_idx'),
+        ]
+
     def __str__(self):
         return f"{self.product.name} - {self.movement_type} - {self.quantity}"
 
+class DailyStockSnapshot(models.Model):
+    """Closing stock of a product at the end of a completed day"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    date = models.DateField()
+    closing_stock = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['product', 'date']
+
+    def __str__(self):
+        return f"{self.product.name} - {self.date}: {self.closing_stock}"
+
+class DailyBatchSnapshot(models.Model):
+    """Quantity left in a batch when the stock checkpoint for a day was taken"""
+    batch = models.ForeignKey(Batch, on_delete=models.CASCADE)
+    date = models.DateField()
+    quantity = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['batch', 'date']
+
+    def __str__(self):
+        return f"Batch {self.batch_id} - {self.date}: {self.quantity}"
+
+class StockCheckpoint(models.Model):
+    """A day whose closing snapshots were written by the ledger job (see inventory.ledger)"""
+    date = models.DateField(unique=True)
+    products = models.PositiveIntegerField(default=0)
+    batches = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Stock checkpoint {self.date}"
+
+class ExpirySweep(models.Model):
+    """Progress of the expiry sweep for one cutoff day (see inventory.expiry)"""
+    cutoff = models.DateField(unique=True)
+    last_batch_id = models.PositiveIntegerField(default=0)
+    batches_expired = models.PositiveIntegerField(default=0)
+    units_removed = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-cutoff']
+
+    def __str__(self):
+        state = 'complete' if self.completed_at else f'at batch {self.last_batch_id}'
+        return f"Expiry sweep {self.cutoff}: {state}"
+
 class Supplier(models.Model):
     name = models.CharField(max_length=200)
     contact_person = models.CharField(max_length=100, blank=True)
@@ -199,16 +351,27 @@ class SalesHistory(models.Model):
     cost_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # Cost from batch
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     profit = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
-    sale_date = models.DateTimeField(auto_now_add=True)
+    sale_date = models.DateTimeField(default=timezone.now, editable=False)
     receipt_number = models.CharField(max_length=50)
 
-    def save(self, *args, **kwargs):
+    class Meta:
+        indexes = [
+            models.Index(fields=['sale_date'], name='inventory_sh_date_idx'),
+            models.Index(fields=['product', 'sale_date'], name='inventory_sh_product_date_idx'),
+            models.Index(fields=['receipt_number'], name='inventory_sh_receipt_idx'),
+        ]
+
+    def calculate_profit(self):
+        """Fill in profit from the selling and cost prices (also used before bulk_create)"""
         if self.cost_price and self.unit_price:
             # Ensure both are Decimal types for calculation
             from decimal import Decimal
             unit_price = Decimal(str(self.unit_price))
             cost_price = Decimal(str(self.cost_price))
             self.profit = (unit_price - cost_price) * Decimal(str(self.quantity))
+
+    def save(self, *args, **kwargs):
+        self.calculate_profit()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -233,3 +396,6 @@ class ProductHistory(models.Model):
 
     class Meta:
         ordering = ['-changed_at']
+        indexes = [
+            models.Index(fields=['product', 'changed_at'], name='inventory_ph_product_date_idx'),
+        ]
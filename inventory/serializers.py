@@ -6,7 +6,25 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = '__all__'
 
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Let GET requests pick the fields they need with ``?fields=a,b,c``.
+    Unknown names are ignored; without the parameter every field is returned.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = request.query_params.get('fields')
+        if not requested:
+            return
+        wanted = {name.strip() for name in requested.split(',') if name.strip()}
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.SerializerMethodField()
     is_low_stock = serializers.BooleanField(read_only=True)
     display_price = serializers.SerializerMethodField()
@@ -0,0 +1,124 @@
+"""
+End-of-day stock levels.
+
+A product's closing stock for a day is its current stock minus every
+movement recorded after that day. The closing stock of the last past day
+asked for is read in one statement (``stock_before``), so a sale committing
+meanwhile is counted in both the stock and the movements or in neither.
+Movements of the closed days before it are summed per product and local
+day in one grouped query, and the earlier closing balances come from
+walking those sums backwards (a reverse cumulative sum).
+
+Past days are read from ``DailyStockSnapshot`` where the daily checkpoint
+(``inventory.ledger``) has stored them. Nothing is written here: reports
+and the product timeline call this from GET requests.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailyStockSnapshot, Product, StockMovement
+
+# Signed effect of a movement on stock. 'out' rows are stored negative, but
+# older rows written before fix_stock_movements may still be positive.
+SIGNED_QUANTITY = Case(
+    When(movement_type='in', then=Abs(F('quantity'))),
+    When(movement_type='out', then=-Abs(F('quantity'))),
+    default=F('quantity'),
+    output_field=IntegerField()
+)
+
+
+def _day_end(day):
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def stock_before(moment, product_ids):
+    """
+    ``{product_id: stock}`` as it stood at ``moment``: the current stock less
+    every movement since, read together in one statement.
+    """
+    since = StockMovement.objects.filter(
+        product=OuterRef('pk'), created_at__gte=moment
+    ).values('product').annotate(net=Sum(SIGNED_QUANTITY)).order_by().values('net')
+    return dict(
+        Product.objects.filter(pk__in=list(product_ids)).annotate(
+            before=F('stock_quantity') - Coalesce(Subquery(since, output_field=IntegerField()), Value(0))
+        ).values_list('pk', 'before')
+    )
+
+
+def daily_net_movements(product_ids, after_date, until_date=None):
+    """
+    {product_id: {day: net quantity}} for movements after the end of
+    ``after_date``, up to the end of ``until_date`` if given
+    """
+    movements = StockMovement.objects.filter(
+        product_id__in=product_ids,
+        created_at__gte=_day_end(after_date)
+    )
+    if until_date is not None:
+        movements = movements.filter(created_at__lt=_day_end(until_date))
+    rows = movements.annotate(
+        day=TruncDate('created_at', tzinfo=timezone.get_current_timezone())
+    ).values('product_id', 'day').annotate(
+        net=Sum(SIGNED_QUANTITY)
+    ).order_by()
+
+    nets = {}
+    for row in rows:
+        nets.setdefault(row['product_id'], {})[row['day']] = row['net']
+    return nets
+
+
+def end_of_day_stock(products, from_date, to_date):
+    """
+    Closing stock per product and day, as ``{product_id: {date: quantity}}``.
+
+    Days from today onwards close at the product's current stock. Past days
+    come from stored snapshots where they exist; the rest are rebuilt from
+    the movement history.
+    """
+    today = timezone.localdate()
+    dates = [from_date + timedelta(days=n) for n in range((to_date - from_date).days + 1)]
+    past_dates = [day for day in dates if day < today]
+
+    closing = {product.pk: {} for product in products}
+    if past_dates:
+        for product_id, day, quantity in DailyStockSnapshot.objects.filter(
+            product_id__in=list(closing),
+            date__range=[past_dates[0], past_dates[-1]]
+        ).values_list('product_id', 'date', 'closing_stock'):
+            closing[product_id][day] = quantity
+
+    missing = {
+        product.pk: [day for day in past_dates if day not in closing[product.pk]]
+        for product in products
+    }
+    missing = {product_id: days for product_id, days in missing.items() if days}
+
+    if missing:
+        last_day = past_dates[-1]
+        earliest = min(days[0] for days in missing.values())
+        # Closed days' movements can't change; only the anchor is live
+        anchors = stock_before(_day_end(last_day), missing)
+        nets = daily_net_movements(list(missing), earliest, last_day)
+        for product_id, days in missing.items():
+            product_nets = nets.get(product_id, {})
+            balance = anchors[product_id]
+            needed = set(days)
+            for day in reversed(past_dates):
+                if day < days[0]:
+                    break
+                if day in needed:
+                    closing[product_id][day] = balance
+                balance -= product_nets.get(day, 0)
+
+    for product in products:
+        for day in dates:
+            if day >= today:
+                closing[product.pk][day] = product.stock_quantity
+    return closing
@@ -1,14 +1,29 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from io import StringIO
+from unittest import skipUnless
+from django.test import TestCase, TransactionTestCase
+from django.db import connection, transaction, OperationalError
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.core.management import CommandError, call_command
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from decimal import Decimal
-from datetime import date, datetime
-from .models import Category, Product, Batch, StockMovement, Supplier, Purchase, PriceHistory, SalesHistory
+from datetime import date, datetime, timedelta
+from .models import Category, Product, Batch, StockMovement, Supplier, Purchase, PriceHistory, SalesHistory, ProductHistory, DailyStockSnapshot, ExpirySweep, DailyBatchSnapshot, StockCheckpoint
+from .allocation import StockAllocation, InsufficientStock, StockConflict, restore_stock, sellable_batches
+from .expiry import sweep_expired
+from .snapshots import stock_before
+from .ledger import LedgerError, drift, rebaseline, run_checkpoints, stock_at, take_checkpoint
 from .serializers import CategorySerializer, ProductSerializer, BatchSerializer, StockMovementSerializer, PurchaseSerializer, PriceHistorySerializer, SalesHistorySerializer
 from suppliers.models import Supplier as SupplierModel
 from users.models import UserProfile
 from customers.models import Customer
+from reports.rollups import day_bounds
 from django.contrib.auth.models import User
 
 
@@ -55,6 +70,83 @@ class ProductModelTest(TestCase):
         self.assertTrue(product.is_low_stock)
 
 
+class ProductHistoryTrackingTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Electronics")
+        self.other_category = Category.objects.create(name="Accessories")
+        product = Product.objects.create(
+            sku="PROD001",
+            name="Laptop",
+            category=self.category,
+            cost_price=Decimal('500.00'),
+            selling_price=Decimal('600.00'),
+            stock_quantity=50
+        )
+        self.product = Product.objects.get(pk=product.pk)
+
+    def test_create_is_logged(self):
+        self.assertTrue(ProductHistory.objects.filter(product=self.product, change_type='create').exists())
+
+    def test_changes_are_diffed_without_a_select(self):
+        self.product.name = "Gaming Laptop"
+        self.product.selling_price = Decimal('650.00')
+        self.product.category = self.other_category
+        # One UPDATE, one category name lookup and one bulk INSERT; no re-fetch of the product
+        with self.assertNumQueries(3):
+            self.product.save()
+
+        changes = dict(
+            ProductHistory.objects.filter(product=self.product, change_type='update')
+            .values_list('field_changed', 'new_value')
+        )
+        self.assertEqual(changes, {
+            'name': 'Gaming Laptop',
+            'selling_price': '650.00',
+            'category': 'Accessories',
+        })
+
+    def test_unchanged_save_logs_nothing(self):
+        with self.assertNumQueries(1):
+            self.product.save()
+        self.assertFalse(ProductHistory.objects.filter(change_type='update').exists())
+
+    def test_snapshot_is_refreshed_after_save(self):
+        self.product.name = "Laptop Pro"
+        self.product.save()
+        self.product.name = "Laptop Max"
+        self.product.save()
+        history = ProductHistory.objects.filter(field_changed='name').order_by('id')
+        self.assertEqual(
+            [(h.old_value, h.new_value) for h in history],
+            [('Laptop', 'Laptop Pro'), ('Laptop Pro', 'Laptop Max')]
+        )
+
+    def test_stock_only_save_can_skip_history(self):
+        self.product.stock_quantity = 40
+        with self.assertNumQueries(1):
+            self.product.save(update_fields=['stock_quantity'], log_history=False)
+        self.assertFalse(ProductHistory.objects.filter(change_type='update').exists())
+
+    def test_update_fields_limits_the_diff(self):
+        self.product.name = "Renamed"
+        self.product.stock_quantity = 10
+        self.product.save(update_fields=['stock_quantity'])
+        self.assertEqual(
+            list(ProductHistory.objects.filter(change_type='update').values_list('field_changed', flat=True)),
+            ['stock_quantity']
+        )
+
+    def test_fields_left_out_of_update_fields_are_logged_later(self):
+        self.product.name = "Renamed"
+        self.product.stock_quantity = 10
+        self.product.save(update_fields=['stock_quantity'], log_history=False)
+        self.product.save()
+        self.assertEqual(
+            list(ProductHistory.objects.filter(change_type='update').values_list('field_changed', 'old_value')),
+            [('name', 'Laptop')]
+        )
+
+
 class BatchModelTest(TestCase):
     def setUp(self):
         self.category = Category.objects.create(name="Electronics")
@@ -253,6 +345,16 @@ class CategoryViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], 'Electronics')
 
+    def test_category_polls_get_304_until_a_change(self):
+        etag = self.client.get('/api/inventory/categories/')['ETag']
+        response = self.client.get('/api/inventory/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.description = 'Gadgets'
+            self.category.save()
+        response = self.client.get('/api/inventory/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 
 class ProductViewSetTest(APITestCase):
     def setUp(self):
@@ -274,6 +376,77 @@ class ProductViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_cursor_pagination_walks_catalogue(self):
+        for i in range(4):
+            Product.objects.create(
+                sku=f"EXTRA{i}", name=f"Extra {i}", category=self.category,
+                cost_price=Decimal('1.00'), selling_price=Decimal('2.00')
+            )
+        response = self.client.get('/api/inventory/products/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        seen = [product['id'] for product in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [product['id'] for product in response.data['results']]
+        self.assertEqual(seen, list(Product.objects.order_by('updated_at', 'id').values_list('id', flat=True)))
+
+    def test_sparse_fields(self):
+        response = self.client.get('/api/inventory/products/', {'fields': 'id,sku,selling_price,category_name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data[0],
+            {'id': self.product.id, 'sku': 'PROD001', 'selling_price': '600.00', 'category_name': 'Electronics'}
+        )
+
+    def test_list_query_count_does_not_grow(self):
+        for i in range(10):
+            category = Category.objects.create(name=f"Category {i}")
+            Product.objects.create(
+                sku=f"EXTRA{i}", name=f"Extra {i}", category=category,
+                cost_price=Decimal('1.00'), selling_price=Decimal('2.00')
+            )
+        # The ETag aggregate plus the list itself
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/inventory/products/')
+        self.assertEqual(len(response.data), 11)
+
+    def test_unchanged_catalogue_polls_get_304(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Edits, stock changes and category renames all change the ETag
+        Product.objects.filter(pk=self.product.pk).update(
+            stock_quantity=49, updated_at=self.product.updated_at + timedelta(seconds=1)
+        )
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['stock_quantity'], 49)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Computers'
+            self.category.save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data[0]['category_name'], 'Computers')
+
+    def test_since_returns_only_changed_products(self):
+        changed = Product.objects.create(
+            sku="PROD002", name="Mouse", category=self.category,
+            cost_price=Decimal('10.00'), selling_price=Decimal('15.00')
+        )
+        synced_at = timezone.now() - timedelta(minutes=5)
+        Product.objects.filter(pk=self.product.pk).update(updated_at=synced_at - timedelta(minutes=1))
+        response = self.client.get('/api/products/', {'since': synced_at.isoformat()})
+        self.assertEqual([product['id'] for product in response.data], [changed.id])
+        response = self.client.get('/api/products/', {'since': 'last week'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_create_product(self):
         url = '/api/inventory/products/'
         data = {
@@ -289,6 +462,15 @@ class ProductViewSetTest(APITestCase):
         self.assertEqual(Product.objects.count(), 2)
 
 
+    def test_editing_stock_records_an_adjustment(self):
+        response = self.client.patch(f'/api/inventory/products/{self.product.pk}/', {'stock_quantity': 45}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(StockMovement.objects.filter(product=self.product).values_list('movement_type', 'quantity')),
+            [('adjustment', -5)]
+        )
+
+
 class LowStockViewTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -433,6 +615,161 @@ class InventoryValuationViewTest(APITestCase):
         self.assertEqual(response.data['total_inventory_valuation'], 5000.00)
 
 
+class EndOfDayStockViewTest(APITestCase):
+    url = '/api/inventory/reports/end-of-day-stock/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name="Electronics")
+        self.today = timezone.localdate()
+
+    def make_product(self, sku, stock, movements):
+        """Product whose ``movements`` are (days_ago, movement_type, quantity) tuples"""
+        product = Product.objects.create(
+            sku=sku, name=f"Product {sku}", category=self.category,
+            cost_price=Decimal('10.00'), selling_price=Decimal('15.00'), stock_quantity=stock
+        )
+        for days_ago, movement_type, quantity in movements:
+            movement = StockMovement.objects.create(product=product, movement_type=movement_type, quantity=quantity)
+            created_at = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), datetime.min.time()))
+            StockMovement.objects.filter(pk=movement.pk).update(created_at=created_at + timedelta(hours=12))
+        return product
+
+    def fetch(self, days, **params):
+        return self.client.get(self.url, {
+            'from_date': (self.today - timedelta(days=days)).isoformat(),
+            'to_date': self.today.isoformat(),
+            **params
+        })
+
+    def test_closing_stock_walks_back_movements(self):
+        # 20 received three days ago, 5 sold two days ago, 3 sold today
+        product = self.make_product('P1', 12, [(3, 'in', 20), (2, 'out', -5), (0, 'out', -3)])
+        response = self.fetch(4, product_id=product.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        daily = [day['end_of_day_stock'] for day in response.data['products'][0]['daily_stock']]
+        self.assertEqual(daily, [0, 20, 15, 15, 12])
+
+    def test_reads_use_checkpoints_without_writing(self):
+        product = self.make_product('P1', 10, [(1, 'in', 4), (1, 'adjustment', -2)])
+        response = self.fetch(3)
+        daily = [day['end_of_day_stock'] for day in response.data['products'][0]['daily_stock']]
+        self.assertEqual(daily, [8, 8, 10, 10])
+        self.assertFalse(DailyStockSnapshot.objects.exists())
+
+        # Once the checkpoint job has stored the past days, requests read
+        # them, even if the history is gone
+        for days_ago in (3, 2, 1):
+            take_checkpoint(self.today - timedelta(days=days_ago))
+        StockMovement.objects.all().delete()
+        with self.assertNumQueries(2):
+            response = self.fetch(3)
+        daily = [day['end_of_day_stock'] for day in response.data['products'][0]['daily_stock']]
+        self.assertEqual(daily, [8, 8, 10, 10])
+
+    def test_anchor_is_read_in_one_statement(self):
+        product = self.make_product('P1', 12, [(3, 'in', 20), (2, 'out', -5), (0, 'out', -3)])
+        with self.assertNumQueries(1):
+            stock = stock_before(timezone.make_aware(datetime.combine(self.today, datetime.min.time())), [product.pk])
+        self.assertEqual(stock, {product.pk: 15})
+
+    def test_query_count_does_not_grow_with_products(self):
+        self.make_product('P1', 5, [(2, 'in', 5)])
+        with CaptureQueriesContext(connection) as few:
+            self.fetch(10)
+        DailyStockSnapshot.objects.all().delete()
+        for i in range(2, 12):
+            self.make_product(f'P{i}', 5, [(2, 'in', 5), (5, 'out', -1)])
+        with CaptureQueriesContext(connection) as many:
+            response = self.fetch(10)
+        self.assertEqual(len(response.data['products']), 11)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+
+class ProductTimelineViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name="Electronics")
+        self.today = timezone.localdate()
+        self.product = Product.objects.create(
+            sku='P1', name='Product 1', category=self.category,
+            cost_price=Decimal('10.00'), selling_price=Decimal('15.00'), stock_quantity=12
+        )
+        ProductHistory.objects.filter(product=self.product).delete()
+        self.url = f'/api/inventory/products/{self.product.id}/timeline/'
+
+    def at(self, days_ago, hour):
+        return timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), datetime.min.time())) + timedelta(hours=hour)
+
+    def movement(self, days_ago, hour, movement_type, quantity):
+        movement = StockMovement.objects.create(product=self.product, movement_type=movement_type, quantity=quantity)
+        StockMovement.objects.filter(pk=movement.pk).update(created_at=self.at(days_ago, hour))
+        return movement
+
+    def make_history(self):
+        # 20 received three days ago, 5 sold two days ago, 3 sold today
+        self.movement(3, 9, 'in', 20)
+        self.movement(2, 10, 'out', -5)
+        sale = SalesHistory.objects.create(
+            product=self.product, quantity=5, unit_price=Decimal('15.00'),
+            total_price=Decimal('75.00'), receipt_number='R1'
+        )
+        SalesHistory.objects.filter(pk=sale.pk).update(sale_date=self.at(2, 10))
+        self.movement(0, 1, 'out', -3)
+
+    def fetch(self, **params):
+        return self.client.get(self.url, {
+            'from_date': (self.today - timedelta(days=5)).isoformat(),
+            'to_date': self.today.isoformat(),
+            **params
+        })
+
+    def test_events_are_merged_newest_first_with_running_stock(self):
+        self.make_history()
+        response = self.fetch()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        events = response.data['events']
+        self.assertEqual([event['type'] for event in events], ['stock_movement', 'sale', 'stock_movement', 'stock_movement'])
+        # Sales are covered by their stock movements and not counted twice
+        self.assertEqual([event['stock_after'] for event in events], [12, 15, 15, 20])
+        self.assertIsNone(response.data['next_before'])
+
+    def test_pages_follow_the_before_cursor(self):
+        self.make_history()
+        seen = []
+        stocks = []
+        params = {'limit': 1}
+        while True:
+            response = self.fetch(**params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [event['id'] for event in response.data['events']]
+            stocks += [event['stock_after'] for event in response.data['events']]
+            if not response.data['next_before']:
+                break
+            params['before'] = response.data['next_before']
+        self.assertEqual(seen, [event['id'] for event in self.fetch().data['events']])
+        self.assertEqual(stocks, [12, 15, 15, 20])
+        # Paging is a read; closing stock is only stored by the checkpoint job
+        self.assertFalse(DailyStockSnapshot.objects.exists())
+
+    def test_query_count_does_not_grow_with_events(self):
+        self.make_history()
+        with CaptureQueriesContext(connection) as few:
+            self.fetch(limit=2)
+        for hour in range(2, 12):
+            self.movement(1, hour, 'adjustment', 1)
+        with CaptureQueriesContext(connection) as many:
+            response = self.fetch(limit=10)
+        self.assertEqual(len(response.data['events']), 10)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.fetch(before='yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class BatchViewSetTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -482,6 +819,16 @@ class BatchViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['batch_number'], 'BATCH001')
 
+    def test_receive_records_one_movement(self):
+        url = f'/api/inventory/batches/{self.batch.pk}/receive/'
+        response = self.client.post(url, {'actual_quantity': 100, 'notes': 'Sealed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 100)
+        movements = StockMovement.objects.filter(product=self.product)
+        self.assertEqual(list(movements.values_list('quantity', flat=True)), [100])
+        self.assertIn('Notes: Sealed', movements.get().reason)
+
 
 class StockMovementViewSetTest(APITestCase):
     def setUp(self):
@@ -510,7 +857,7 @@ class StockMovementViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
-    def test_create_stock_movement(self):
+    def test_movements_cannot_be_created(self):
         url = '/api/inventory/stock-movements/'
         data = {
             'product': self.product.pk,
@@ -519,8 +866,16 @@ class StockMovementViewSetTest(APITestCase):
             'reason': 'Sale'
         }
         response = self.client.post(url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(StockMovement.objects.count(), 2)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+    def test_movements_cannot_be_edited_or_deleted(self):
+        url = f'/api/inventory/stock-movements/{self.movement.pk}/'
+        response = self.client.patch(url, {'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertTrue(StockMovement.objects.filter(pk=self.movement.pk, quantity=50).exists())
 
 
 class PurchaseViewSetTest(APITestCase):
@@ -661,6 +1016,8 @@ class SalesHistoryViewSetTest(APITestCase):
 
 class SupplierPerformanceViewTest(APITestCase):
     def setUp(self):
+        from suppliers.models import PurchaseOrder, PurchaseOrderItem, Supplier as BatchSupplier
+
         self.user = User.objects.create_user(username='testuser', password='testpass')
         self.client.force_authenticate(user=self.user)
         category = Category.objects.create(name="Electronics")
@@ -680,8 +1037,345 @@ class SupplierPerformanceViewTest(APITestCase):
             total_price=Decimal('5000.00')
         )
 
+        today = timezone.localdate()
+        batch_supplier = BatchSupplier.objects.create(name="Tech Supplier", phone="1234567890")
+        BatchSupplier.objects.create(name="Idle Supplier", phone="1234567891")
+        for number, expected in enumerate([today, today - timedelta(days=5)]):
+            order = PurchaseOrder.objects.create(
+                supplier=batch_supplier, status='received', expected_delivery_date=expected
+            )
+            item = PurchaseOrderItem.objects.create(
+                purchase_order=order, product=product, quantity=10, unit_price=Decimal('500.00')
+            )
+            Batch.objects.create(
+                product=product, batch_number=f"PO{number}", quantity=10, cost_price=Decimal('500.00'),
+                expiry_date=today + timedelta(days=365) if number == 0 else today - timedelta(days=1),
+                purchase_date=today - timedelta(days=10), supplier=batch_supplier,
+                purchase_order_item=item, status='received', received_date=today
+            )
+
     def test_supplier_performance(self):
         url = '/api/inventory/reports/supplier/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreater(len(response.data), 0)
+
+        rows = {row['supplier']: row for row in response.data}
+        self.assertEqual(rows['Tech Supplier'], {
+            'supplier': 'Tech Supplier',
+            'total_batches': 2,
+            'total_quantity': 20,
+            'total_value': 10000.0,
+            'on_time_delivery_rate': 50.0,
+            'quality_score': 50.0,
+            'expired_batches': 1
+        })
+        self.assertEqual(rows['Idle Supplier']['quality_score'], 100)
+        self.assertEqual(rows['Idle Supplier']['on_time_delivery_rate'], 0)
+
+
+class StockAllocationTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            sku="GIN001",
+            name="Gin",
+            cost_price=Decimal('10.00'),
+            selling_price=Decimal('15.00'),
+            stock_quantity=12
+        )
+        self.later = Batch.objects.create(
+            product=self.product, batch_number="LATE", quantity=5,
+            expiry_date=date(2099, 6, 1), purchase_date=date(2024, 1, 1), status='received'
+        )
+        self.sooner = Batch.objects.create(
+            product=self.product, batch_number="SOON", quantity=4,
+            expiry_date=date(2099, 1, 1), purchase_date=date(2024, 2, 1), status='received'
+        )
+        self.undated = Batch.objects.create(
+            product=self.product, batch_number="NODATE", quantity=3,
+            purchase_date=date(2023, 1, 1), status='received'
+        )
+
+    def test_allocates_fifo_by_expiry(self):
+        allocation = StockAllocation.allocate([(self.product.pk, 7), (self.product.pk, 4)])
+        self.assertEqual(
+            [[(batch.batch_number, quantity) for batch, quantity in parts] for parts in allocation.parts],
+            [[('SOON', 4), ('LATE', 3)], [('LATE', 2), ('NODATE', 2)]]
+        )
+        allocation.apply()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 1)
+        self.assertEqual(
+            dict(Batch.objects.values_list('batch_number', 'quantity')),
+            {'SOON': 0, 'LATE': 0, 'NODATE': 1}
+        )
+
+    def test_insufficient_stock_raises(self):
+        with self.assertRaises(InsufficientStock):
+            StockAllocation.allocate([(self.product.pk, 13)])
+
+    def test_stale_allocation_is_refused(self):
+        allocation = StockAllocation.allocate([(self.product.pk, 4)])
+        Batch.objects.filter(pk=self.sooner.pk).update(quantity=1)
+        with self.assertRaises(StockConflict):
+            allocation.apply()
+
+    def test_restore_stock(self):
+        restore_stock({self.product.pk: 3}, {self.sooner.pk: 3})
+        self.product.refresh_from_db()
+        self.sooner.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 15)
+        self.assertEqual(self.sooner.quantity, 7)
+
+
+
+class ExpirySweepTest(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.products = [
+            Product.objects.create(
+                sku=f"EXP{n}", name=f"Tonic {n}", cost_price=Decimal('10.00'),
+                selling_price=Decimal('15.00'), stock_quantity=20
+            )
+            for n in range(3)
+        ]
+        for product in self.products:
+            for expiry, quantity in [(-10, 4), (-1, 3), (30, 13)]:
+                Batch.objects.create(
+                    product=product, batch_number=f"{product.sku}{expiry}", quantity=quantity,
+                    expiry_date=self.today + timedelta(days=expiry), purchase_date=date(2024, 1, 1),
+                    status='received'
+                )
+
+    def test_expires_batches_and_removes_stock(self):
+        sweep = sweep_expired()
+
+        self.assertIsNotNone(sweep.completed_at)
+        self.assertEqual((sweep.batches_expired, sweep.units_removed), (6, 21))
+        self.assertEqual(Batch.objects.filter(status='expired').count(), 6)
+        self.assertEqual(
+            set(Product.objects.values_list('stock_quantity', flat=True)), {13}
+        )
+        self.assertEqual(
+            StockMovement.objects.filter(movement_type='adjustment', reason__endswith='expired').aggregate(
+                total=Sum('quantity')
+            )['total'],
+            -21
+        )
+
+    def test_query_count_does_not_grow_with_chunk(self):
+        # The sweep record; one chunk of 8 statements (lock sweep,
+        # candidates, products, batches, two UPDATEs, the movement insert,
+        # the checkpoint); the final empty chunk; savepoints around each
+        with self.assertNumQueries(19):
+            sweep_expired(chunk_size=100)
+
+    def test_resumes_from_checkpoint(self):
+        sweep = sweep_expired(chunk_size=2, max_chunks=1)
+        self.assertIsNone(sweep.completed_at)
+        self.assertEqual(sweep.batches_expired, 2)
+        self.assertEqual(Batch.objects.filter(status='expired').count(), 2)
+
+        sweep = sweep_expired(chunk_size=2)
+        self.assertIsNotNone(sweep.completed_at)
+        self.assertEqual(sweep.batches_expired, 6)
+        self.assertEqual(ExpirySweep.objects.count(), 1)
+        self.assertEqual(StockMovement.objects.count(), 6)
+
+    def test_stock_does_not_go_negative(self):
+        Product.objects.filter(pk=self.products[0].pk).update(stock_quantity=5)
+        sweep_expired()
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 0)
+        self.assertEqual(
+            list(StockMovement.objects.filter(product=self.products[0]).values_list('quantity', flat=True)),
+            [-4, -1]
+        )
+
+    def test_command(self):
+        out = StringIO()
+        call_command('update_expired_batches', '--chunk-size', '4', stdout=out)
+        self.assertIn('Successfully updated 6 expired batches, removed 21 units', out.getvalue())
+        self.assertEqual(Batch.objects.filter(status='expired').count(), 6)
+        self.assertFalse(Batch.objects.filter(status='received', expiry_date__lt=self.today).exists())
+
+
+class StockLedgerTest(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        # 20 on hand three days ago, 5 sold two days ago, 3 sold just now
+        self.product = Product.objects.create(
+            sku="LEDGER1", name="Rum", cost_price=Decimal('10.00'),
+            selling_price=Decimal('15.00'), stock_quantity=12
+        )
+        self.batch = Batch.objects.create(
+            product=self.product, batch_number="RUM-1", quantity=12,
+            purchase_date=date(2024, 1, 1), status='received'
+        )
+        two_days_ago = day_bounds(self.today - timedelta(days=2))[0] + timedelta(hours=12)
+        sold = StockMovement.objects.create(product=self.product, movement_type='out', quantity=-5, reason='Sale')
+        StockMovement.objects.filter(pk=sold.pk).update(created_at=two_days_ago)
+        StockMovement.objects.create(product=self.product, movement_type='out', quantity=-3, reason='Sale')
+
+    def closing(self, days_ago):
+        return DailyStockSnapshot.objects.get(product=self.product, date=self.today - timedelta(days=days_ago)).closing_stock
+
+    def test_checkpoints_carry_the_ledger_forward(self):
+        take_checkpoint(self.today - timedelta(days=3))
+        self.assertEqual(self.closing(3), 20)
+
+        checkpoints = run_checkpoints()
+        self.assertEqual([c.date for c in checkpoints], [self.today - timedelta(days=2), self.today - timedelta(days=1)])
+        self.assertEqual((self.closing(2), self.closing(1)), (15, 15))
+        self.assertEqual(
+            DailyBatchSnapshot.objects.get(batch=self.batch, date=self.today - timedelta(days=1)).quantity, 12
+        )
+        self.assertEqual(run_checkpoints(), [])
+
+    def test_stock_at_is_snapshot_plus_movements(self):
+        run_checkpoints(until=self.today - timedelta(days=3))
+        run_checkpoints()
+        two_days_ago = day_bounds(self.today - timedelta(days=2))[0]
+        self.assertEqual(stock_at(two_days_ago + timedelta(hours=1), [self.product.pk]), {self.product.pk: 20})
+        self.assertEqual(stock_at(two_days_ago + timedelta(hours=13), [self.product.pk]), {self.product.pk: 15})
+        self.assertEqual(stock_at(timezone.now(), [self.product.pk]), {self.product.pk: 12})
+
+    def test_stock_at_without_checkpoint_works_back_from_current_stock(self):
+        moment = day_bounds(self.today - timedelta(days=2))[0]
+        self.assertEqual(stock_at(moment, [self.product.pk]), {self.product.pk: 20})
+
+    def test_drift(self):
+        with self.assertRaises(LedgerError):
+            drift()
+        run_checkpoints()
+        self.assertEqual(list(drift()), [])
+
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=30)
+        with self.assertNumQueries(2):
+            rows = list(drift())
+        self.assertEqual(
+            [(row['sku'], row['stock_quantity'], row['ledger_stock']) for row in rows], [('LEDGER1', 30, 12)]
+        )
+
+    def test_direct_stock_edit_stays_on_the_ledger(self):
+        run_checkpoints(until=self.today - timedelta(days=2))
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock_quantity = 50
+        product.save()
+        run_checkpoints()
+        # Edited today, after yesterday closed at 15
+        self.assertEqual(self.closing(1), 15)
+        self.assertEqual(list(drift()), [])
+        self.assertEqual(stock_at(timezone.now(), [self.product.pk]), {self.product.pk: 50})
+
+    def test_rebaseline(self):
+        run_checkpoints()
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=30)
+        self.assertEqual(rebaseline(), [self.product.pk])
+        # 30 now, less today's 3 sold
+        self.assertEqual(self.closing(1), 33)
+        self.assertEqual(list(drift()), [])
+        self.assertEqual(stock_at(timezone.now(), [self.product.pk]), {self.product.pk: 30})
+
+    def test_commands(self):
+        out = StringIO()
+        call_command('snapshot_stock', stdout=out)
+        self.assertTrue(StockCheckpoint.objects.filter(date=self.today - timedelta(days=1)).exists())
+        call_command('reconcile_stock', '--fail', stdout=out)
+        self.assertIn('Stock matches the ledger', out.getvalue())
+
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=11)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stock', '--fail', stdout=out)
+        self.assertIn('stock 11, ledger 12 (-1)', out.getvalue())
+
+        call_command('reconcile_stock', '--rebaseline', stdout=out)
+        self.assertIn('Rebaselined 1 products', out.getvalue())
+        call_command('reconcile_stock', '--fail', stdout=out)
+
+class StockAllocationConcurrencyTest(TransactionTestCase):
+    """Many tills selling the same SKU at once must never oversell or lose updates"""
+    threads = 8
+    sales_per_thread = 10
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            sku="BEER001",
+            name="Beer",
+            cost_price=Decimal('1.00'),
+            selling_price=Decimal('2.00'),
+            stock_quantity=60
+        )
+        for number in range(3):
+            Batch.objects.create(
+                product=self.product, batch_number=f"B{number}", quantity=20,
+                expiry_date=date(2099, 1, 1 + number), purchase_date=date(2024, 1, 1), status='received'
+            )
+
+    def _sell(self, results):
+        try:
+            for _ in range(self.sales_per_thread):
+                for attempt in range(500):
+                    try:
+                        with transaction.atomic():
+                            StockAllocation.allocate([(self.product.pk, 1)]).apply()
+                        results.append('sold')
+                        break
+                    except InsufficientStock:
+                        results.append('refused')
+                        break
+                    except (StockConflict, OperationalError):
+                        # Lost the race (or the SQLite write lock); try again
+                        time.sleep(random.uniform(0, min(0.02, 0.001 * (attempt + 1))))
+                else:
+                    results.append('gave_up')
+        finally:
+            connection.close()
+
+    def test_concurrent_sales_keep_stock_consistent(self):
+        results = []
+        workers = [threading.Thread(target=self._sell, args=(results,)) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.product.refresh_from_db()
+        batch_total = Batch.objects.filter(product=self.product).aggregate(total=Sum('quantity'))['total']
+        sold = results.count('sold')
+
+        self.assertNotIn('gave_up', results)
+        self.assertEqual(len(results), self.threads * self.sales_per_thread)
+        self.assertEqual(sold, 60)
+        self.assertEqual(self.product.stock_quantity, 0)
+        self.assertEqual(batch_total, 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+class InventoryIndexTest(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(f'USING INDEX {index}', queryset.explain())
+
+    def test_date_range_filters_use_indexes(self):
+        start, end = day_bounds(timezone.localdate())
+        self.assertUsesIndex(StockMovement.objects.filter(created_at__gte=start, created_at__lt=end), 'inventory_movement_date_idx')
+        self.assertUsesIndex(SalesHistory.objects.filter(sale_date__gte=start, sale_date__lt=end), 'inventory_sh_date_idx')
+
+    def test_timeline_sources_use_indexes(self):
+        start, _ = day_bounds(timezone.localdate())
+        self.assertUsesIndex(
+            StockMovement.objects.filter(product_id=1, created_at__gte=start).order_by('-created_at', '-pk'),
+            'inventory_movement_prod_idx'
+        )
+        self.assertUsesIndex(
+            SalesHistory.objects.filter(product_id=1, sale_date__gte=start).order_by('-sale_date', '-pk'),
+            'inventory_sh_product_date_idx'
+        )
+        self.assertUsesIndex(
+            ProductHistory.objects.filter(product_id=1, changed_at__gte=start).order_by('-changed_at', '-pk'),
+            'inventory_ph_product_date_idx'
+        )
+
+    def test_fifo_allocation_uses_sellable_batch_index(self):
+        self.assertUsesIndex(sellable_batches([1]).order_by('expiry_date', 'purchase_date'), 'inventory_batch_sellable_idx')
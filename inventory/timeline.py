@@ -0,0 +1,187 @@
+"""
+Product timeline: field changes, sales and stock movements, newest first.
+
+Each source is read with its own pre-sorted query (newest first, with the
+related rows it needs joined in) and limited to one page; the three
+cursors are merged lazily with ``heapq.merge``. Pages are addressed by a
+keyset cursor (``before=``), the key of the last event of the previous page.
+
+``stock_after`` is anchored on the product's end-of-day stock (see
+``inventory.snapshots``) for the page's starting day, so only that day's
+movements are replayed instead of the whole history since the event.
+"""
+
+import heapq
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ProductHistory, SalesHistory, StockMovement
+from .snapshots import SIGNED_QUANTITY, end_of_day_stock
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+# Tie-break for events with the same timestamp; higher ranks come first, so
+# a sale is listed before (after, in time) the stock movement it caused
+RANKS = {'ph': 0, 'sm': 1, 'sh': 2}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(event):
+    timestamp = event['timestamp'].astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return f"{timestamp},{event['id']}"
+
+
+def decode_cursor(value):
+    """``(timestamp, rank, id)`` from a ``before=`` cursor"""
+    try:
+        timestamp, event_id = value.split(',')
+        prefix, pk = event_id.split('_')
+        parsed = parse_datetime(timestamp)
+        if parsed is None or prefix not in RANKS:
+            raise ValueError
+        return parsed, RANKS[prefix], int(pk)
+    except ValueError:
+        raise InvalidCursor(f'Invalid cursor: {value}')
+
+
+def _older_than(field, rank, key):
+    """Rows of a source with the given rank whose key sorts before ``key``"""
+    timestamp, key_rank, key_id = key
+    if key_id is None or rank < key_rank:
+        same_instant = Q(**{field: timestamp}) if key_id is not None else Q(pk__in=[])
+    elif rank == key_rank:
+        same_instant = Q(**{field: timestamp, 'pk__lt': key_id})
+    else:
+        same_instant = Q(pk__in=[])
+    return Q(**{f'{field}__lt': timestamp}) | same_instant
+
+
+def _product_changes(rows):
+    for event in rows:
+        user = event.user.user if event.user else None
+        yield {
+            'id': f'ph_{event.id}',
+            'type': 'product_change',
+            'timestamp': event.changed_at,
+            'description': f'Product {event.field_changed} changed: {event.old_value} → {event.new_value}',
+            'details': {
+                'field': event.field_changed,
+                'old_value': event.old_value,
+                'new_value': event.new_value,
+                'change_type': event.change_type,
+                'user': user.username if user else 'System',
+                'notes': event.notes
+            }
+        }
+
+
+def _sales(rows):
+    for sale in rows:
+        yield {
+            'id': f'sh_{sale.id}',
+            'type': 'sale',
+            'timestamp': sale.sale_date,
+            'description': f'Sold {sale.quantity} units at {sale.unit_price} each (Receipt: {sale.receipt_number})',
+            'details': {
+                'quantity': sale.quantity,
+                'unit_price': float(sale.unit_price),
+                'total_price': float(sale.total_price),
+                'customer': sale.customer.name if sale.customer else 'N/A',
+                'receipt_number': sale.receipt_number,
+                'batch': sale.batch.batch_number if sale.batch else 'N/A'
+            }
+        }
+
+
+def _movements(rows):
+    for movement in rows:
+        user = movement.user.user if movement.user else None
+        yield {
+            'id': f'sm_{movement.id}',
+            'type': 'stock_movement',
+            'timestamp': movement.created_at,
+            'description': f'Stock {movement.movement_type}: {movement.quantity} units - {movement.reason}',
+            'details': {
+                'movement_type': movement.movement_type,
+                'quantity': movement.quantity,
+                'reason': movement.reason,
+                'user': user.username if user else 'System'
+            },
+            '_delta': movement.signed_quantity
+        }
+
+
+def _stock_before(product, key):
+    """Stock level once every movement sorting before ``key`` has happened"""
+    timestamp = key[0]
+    day = timezone.localdate(timestamp)
+    movements = StockMovement.objects.filter(product=product).exclude(
+        _older_than('created_at', RANKS['sm'], key)
+    )
+    if day >= timezone.localdate():
+        anchor = product.stock_quantity
+    else:
+        # Closing stock of the cursor's day, less that day's later movements
+        anchor = end_of_day_stock([product], day, day)[product.pk][day]
+        day_end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+        movements = movements.filter(created_at__lt=day_end)
+    later = movements.aggregate(total=Sum(SIGNED_QUANTITY))['total'] or 0
+    return anchor - later
+
+
+def product_timeline(product, from_date, to_date, before=None, limit=DEFAULT_LIMIT):
+    """
+    One page of the product's events between two local dates, newest first.
+
+    Returns ``(events, next_before)``; ``next_before`` is None on the last page.
+    """
+    start = timezone.make_aware(datetime.combine(from_date, time.min))
+    end = timezone.make_aware(datetime.combine(to_date + timedelta(days=1), time.min))
+    key = decode_cursor(before) if before else (end, None, None)
+    if key[0] > end:
+        key = (end, None, None)
+
+    sources = [
+        (ProductHistory.objects.select_related('user__user'), 'changed_at', 'ph', _product_changes),
+        (SalesHistory.objects.select_related('customer', 'batch'), 'sale_date', 'sh', _sales),
+        (StockMovement.objects.select_related('user__user').annotate(signed_quantity=SIGNED_QUANTITY),
+         'created_at', 'sm', _movements),
+    ]
+    streams = []
+    for queryset, field, prefix, to_events in sources:
+        rows = queryset.filter(
+            _older_than(field, RANKS[prefix], key),
+            product=product,
+            **{f'{field}__gte': start}
+        ).order_by(f'-{field}', '-pk')[:limit + 1]
+        streams.append(to_events(rows.iterator()))
+
+    merged = heapq.merge(
+        *streams,
+        key=lambda event: (event['timestamp'], RANKS[event['id'][:2]], int(event['id'][3:])),
+        reverse=True
+    )
+    events = []
+    for event in merged:
+        if len(events) == limit + 1:
+            break
+        events.append(event)
+
+    next_before = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_before = encode_cursor(events[-1])
+
+    stock = _stock_before(product, key)
+    for event in events:
+        event['stock_after'] = stock
+        stock -= event.pop('_delta', 0)
+
+    return events, next_before
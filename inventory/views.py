@@ -1,3 +1,5 @@
+import logging
+
 from rest_framework import viewsets, status
 from rest_framework.generics import ListAPIView
 from rest_framework.decorators import action
@@ -7,30 +9,62 @@ from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db import models
 from django.db.models import Sum, F
 from .models import Category, Product, Batch, StockMovement, Supplier, Purchase, PriceHistory, SalesHistory, ProductHistory
+from branches import versions
+from . import timeline
+from .conditional import ConditionalListMixin
+from .pagination import ProductCursorPagination
+from .snapshots import end_of_day_stock
+from reports.rollups import day_bounds
 from .serializers import CategorySerializer, ProductSerializer, BatchSerializer, StockMovementSerializer, SupplierSerializer, PurchaseSerializer, PriceHistorySerializer, SalesHistorySerializer, ProductHistorySerializer
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
 from datetime import datetime, date
 
-class CategoryViewSet(viewsets.ModelViewSet):
+logger = logging.getLogger(__name__)
+
+class CategoryViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
+    version_domains = [versions.CATALOGUE]
     serializer_class = CategorySerializer
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['name', 'description']
     ordering_fields = ['name']
     ordering = ['name']
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+class ProductViewSet(ConditionalListMixin, viewsets.ModelViewSet):
+    """
+    Products. ``?since=<ISO timestamp>`` lists only products changed after
+    it (stock movements and deactivations included); the Last-Modified
+    header of a full or delta response is the value to send next time.
+    """
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['category', 'is_active']
     search_fields = ['sku', 'name', 'description']
     ordering_fields = ['name', 'created_at', 'selling_price']
     ordering = ['name']
+    last_modified_field = 'updated_at'
+    # Rows include the category name
+    version_domains = [versions.CATALOGUE]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        since = self.request.query_params.get('since')
+        if since and self.action == 'list':
+            parsed = parse_datetime(since)
+            if parsed is None:
+                raise ValidationError({'since': 'Invalid timestamp. Use ISO 8601, e.g. 2025-01-31T08:00:00Z'})
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            queryset = queryset.filter(updated_at__gt=parsed)
+        return queryset
 
 class BatchViewSet(viewsets.ModelViewSet):
-    queryset = Batch.objects.all()
+    queryset = Batch.objects.select_related('product', 'supplier')
     serializer_class = BatchSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['product', 'supplier', 'status']
@@ -39,17 +73,12 @@ class BatchViewSet(viewsets.ModelViewSet):
     ordering = ['-purchase_date']
 
     def update(self, request, *args, **kwargs):
-        """Override update to add debugging"""
-        print(f"Batch update request data: {request.data}")
+        """Override update to log rejected batch edits"""
+        logger.debug("Batch update request data: %s", request.data)
         try:
-            response = super().update(request, *args, **kwargs)
-            print(f"Batch update successful: {response.data}")
-            return response
+            return super().update(request, *args, **kwargs)
         except Exception as e:
-            print(f"Batch update error: {str(e)}")
-            print(f"Error type: {type(e)}")
-            if hasattr(e, 'detail'):
-                print(f"Error detail: {e.detail}")
+            logger.info("Batch update failed: %r %s", e, getattr(e, 'detail', ''))
             raise
 
     @action(detail=True, methods=['post'])
@@ -81,15 +110,10 @@ class BatchViewSet(viewsets.ModelViewSet):
             batch.received_date = received_date
         batch.save()
 
-        # Create stock movement with actual received quantity
-        batch.receive_batch(actual_quantity)
-
-        # Create receiving log entry
-        from .models import StockMovement
-        StockMovement.objects.create(
-            product=batch.product,
-            movement_type='in',
-            quantity=actual_quantity,
+        # One stock movement for the units actually received; it carries the
+        # receiving notes, so the ledger counts the delivery once
+        batch.receive_batch(
+            actual_quantity,
             reason=f'Batch {batch.batch_number} received - {condition} condition. Notes: {notes}',
             user=request.user.userprofile if hasattr(request.user, 'userprofile') else None
         )
@@ -102,8 +126,9 @@ class BatchViewSet(viewsets.ModelViewSet):
             'condition': condition
         })
 
-class StockMovementViewSet(viewsets.ModelViewSet):
-    queryset = StockMovement.objects.all()
+class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
+    """The stock ledger; movements are written by the code that moves stock, never edited"""
+    queryset = StockMovement.objects.select_related('product', 'user__user')
     serializer_class = StockMovementSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['movement_type', 'product']
@@ -114,7 +139,7 @@ class StockMovementViewSet(viewsets.ModelViewSet):
 class LowStockView(ListAPIView):
     serializer_class = ProductSerializer
     def get_queryset(self):
-        return Product.objects.filter(stock_quantity__lte=models.F('low_stock_threshold'))
+        return Product.objects.select_related('category').filter(stock_quantity__lte=models.F('low_stock_threshold'))
 
 class SupplierViewSet(viewsets.ModelViewSet):
     queryset = Supplier.objects.all()
@@ -127,12 +152,12 @@ class SupplierViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
         supplier = self.get_object()
-        products = Product.objects.filter(purchase__supplier=supplier).distinct()
+        products = Product.objects.select_related('category').filter(purchase__supplier=supplier).distinct()
         serializer = ProductSerializer(products, many=True)
         return Response(serializer.data)
 
 class PurchaseViewSet(viewsets.ModelViewSet):
-    queryset = Purchase.objects.all()
+    queryset = Purchase.objects.select_related('product', 'supplier')
     serializer_class = PurchaseSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['supplier', 'product']
@@ -141,7 +166,7 @@ class PurchaseViewSet(viewsets.ModelViewSet):
     ordering = ['-purchase_date']
 
 class PriceHistoryViewSet(viewsets.ModelViewSet):
-    queryset = PriceHistory.objects.all()
+    queryset = PriceHistory.objects.select_related('product', 'supplier')
     serializer_class = PriceHistorySerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['supplier', 'product']
@@ -162,7 +187,7 @@ class PriceHistoryViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 class SalesHistoryViewSet(viewsets.ModelViewSet):
-    queryset = SalesHistory.objects.all()
+    queryset = SalesHistory.objects.select_related('product', 'customer')
     serializer_class = SalesHistorySerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['product', 'customer']
@@ -187,14 +212,16 @@ class SalesHistoryViewSet(viewsets.ModelViewSet):
         from_date = request.query_params.get('from')
         to_date = request.query_params.get('to')
         if from_date and to_date:
-            histories = self.queryset.filter(sale_date__date__range=[from_date, to_date])
+            start, _ = day_bounds(from_date)
+            _, end = day_bounds(to_date)
+            histories = self.queryset.filter(sale_date__gte=start, sale_date__lt=end)
         else:
             histories = self.queryset
         serializer = self.get_serializer(histories, many=True)
         return Response(serializer.data)
 
 class ProductHistoryViewSet(viewsets.ModelViewSet):
-    queryset = ProductHistory.objects.all()
+    queryset = ProductHistory.objects.select_related('product', 'user__user')
     serializer_class = ProductHistorySerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['product', 'field_changed', 'change_type', 'user']
@@ -230,7 +257,10 @@ class ProductTimelineView(ListAPIView):
     - Product field changes
     - Sales history
     - Stock movements
-    - End of day stock levels
+    - Stock level after each event
+
+    Events are newest first, ``limit`` per page; pass the response's
+    ``next_before`` back as ``before`` for the next page.
     """
     def get(self, request, product_id):
         try:
@@ -244,98 +274,30 @@ class ProductTimelineView(ListAPIView):
 
         if not from_date or not to_date:
             # Default to last 30 days
-            to_date = timezone.now().date()
+            to_date = timezone.localdate()
             from_date = to_date - timezone.timedelta(days=30)
+        else:
+            try:
+                from_date = datetime.strptime(from_date, '%Y-%m-%d').date()
+                to_date = datetime.strptime(to_date, '%Y-%m-%d').date()
+            except ValueError:
+                return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Collect all events
-        events = []
-
-        # 1. Product History (field changes)
-        product_history = ProductHistory.objects.filter(
-            product=product,
-            changed_at__date__range=[from_date, to_date]
-        ).order_by('changed_at')
-
-        for event in product_history:
-            events.append({
-                'id': f'ph_{event.id}',
-                'type': 'product_change',
-                'timestamp': event.changed_at,
-                'description': f'Product {event.field_changed} changed: {event.old_value} → {event.new_value}',
-                'details': {
-                    'field': event.field_changed,
-                    'old_value': event.old_value,
-                    'new_value': event.new_value,
-                    'change_type': event.change_type,
-                    'user': event.user.user.username if event.user and event.user.user else 'System',
-                    'notes': event.notes
-                }
-            })
-
-        # 2. Sales History
-        sales_history = SalesHistory.objects.filter(
-            product=product,
-            sale_date__date__range=[from_date, to_date]
-        ).order_by('sale_date')
-
-        for sale in sales_history:
-            events.append({
-                'id': f'sh_{sale.id}',
-                'type': 'sale',
-                'timestamp': sale.sale_date,
-                'description': f'Sold {sale.quantity} units at {sale.unit_price} each (Receipt: {sale.receipt_number})',
-                'details': {
-                    'quantity': sale.quantity,
-                    'unit_price': float(sale.unit_price),
-                    'total_price': float(sale.total_price),
-                    'customer': sale.customer.name if sale.customer else 'N/A',
-                    'receipt_number': sale.receipt_number,
-                    'batch': sale.batch.batch_number if sale.batch else 'N/A'
-                }
-            })
-
-        # 3. Stock Movements
-        stock_movements = StockMovement.objects.filter(
-            product=product,
-            created_at__date__range=[from_date, to_date]
-        ).order_by('created_at')
-
-        for movement in stock_movements:
-            events.append({
-                'id': f'sm_{movement.id}',
-                'type': 'stock_movement',
-                'timestamp': movement.created_at,
-                'description': f'Stock {movement.movement_type}: {movement.quantity} units - {movement.reason}',
-                'details': {
-                    'movement_type': movement.movement_type,
-                    'quantity': movement.quantity,
-                    'reason': movement.reason,
-                    'user': movement.user.user.username if movement.user and movement.user.user else 'System'
-                }
-            })
+        try:
+            limit = min(int(request.query_params.get('limit', timeline.DEFAULT_LIMIT)), timeline.MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Sort all events by timestamp
-        events.sort(key=lambda x: x['timestamp'], reverse=True)
-
-        # Calculate running stock levels
-        current_stock = product.stock_quantity
-        for event in reversed(events):  # Process from oldest to newest
-            if event['type'] == 'stock_movement':
-                if event['details']['movement_type'] == 'in':
-                    current_stock -= event['details']['quantity']
-                elif event['details']['movement_type'] == 'out':
-                    current_stock += event['details']['quantity']
-                elif event['details']['movement_type'] == 'adjustment':
-                    current_stock -= event['details']['quantity']
-                event['stock_after'] = current_stock
-            elif event['type'] == 'sale':
-                current_stock += event['details']['quantity']
-                event['stock_after'] = current_stock
-            else:
-                event['stock_after'] = current_stock
-
-        # Reverse back to newest first
-        events.reverse()
+        try:
+            events, next_before = timeline.product_timeline(
+                product, from_date, to_date,
+                before=request.query_params.get('before'),
+                limit=limit
+            )
+        except timeline.InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             'product': {
@@ -349,7 +311,8 @@ class ProductTimelineView(ListAPIView):
                 'to_date': to_date
             },
             'events': events,
-            'total_events': len(events)
+            'total_events': len(events),
+            'next_before': next_before
         })
 
 # End of Day Stock Report
@@ -371,15 +334,6 @@ class EndOfDayStockView(ListAPIView):
         except ValueError:
             return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Generate date range
-        dates = []
-        current_date = from_date
-        while current_date <= to_date:
-            dates.append(current_date)
-            current_date += timezone.timedelta(days=1)
-
-        report_data = []
-
         if product_id:
             # Single product report
             try:
@@ -389,51 +343,25 @@ class EndOfDayStockView(ListAPIView):
                 return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
         else:
             # All products report
-            products = Product.objects.all()
+            products = list(Product.objects.all())
+
+        closing = end_of_day_stock(products, from_date, to_date)
 
+        report_data = []
         for product in products:
-            product_data = {
+            report_data.append({
                 'product_id': product.id,
                 'product_name': product.name,
                 'product_sku': product.sku,
-                'daily_stock': []
-            }
-
-            current_stock = product.stock_quantity
-
-            for report_date in reversed(dates):  # Work backwards from today
-                # Get all movements after this date
-                future_movements = StockMovement.objects.filter(
-                    product=product,
-                    created_at__date__gt=report_date
-                )
-
-                future_sales = SalesHistory.objects.filter(
-                    product=product,
-                    sale_date__date__gt=report_date
-                )
-
-                # Calculate stock at end of this day
-                day_end_stock = current_stock
-                for movement in future_movements:
-                    if movement.movement_type == 'in':
-                        day_end_stock -= movement.quantity
-                    elif movement.movement_type == 'out':
-                        day_end_stock += movement.quantity
-                    elif movement.movement_type == 'adjustment':
-                        day_end_stock -= movement.quantity
-
-                for sale in future_sales:
-                    day_end_stock += sale.quantity
-
-                product_data['daily_stock'].append({
-                    'date': report_date,
-                    'end_of_day_stock': max(0, day_end_stock),  # Ensure non-negative
-                    'current_stock': current_stock
-                })
-
-            product_data['daily_stock'].reverse()  # Back to chronological order
-            report_data.append(product_data)
+                'daily_stock': [
+                    {
+                        'date': report_date,
+                        'end_of_day_stock': max(0, quantity),  # Ensure non-negative
+                        'current_stock': product.stock_quantity
+                    }
+                    for report_date, quantity in sorted(closing[product.id].items())
+                ]
+            })
 
         return Response({
             'report_type': 'end_of_day_stock',
@@ -455,16 +383,51 @@ class PurchaseReportView(ListAPIView):
 
 class SupplierPerformanceView(ListAPIView):
     def get(self, request):
-        suppliers = Supplier.objects.all()
+        from suppliers.models import PurchaseOrder, Supplier as BatchSupplier
+
+        # Batches and purchase orders belong to suppliers.Supplier, not to
+        # the Supplier that Purchase rows use
+        today = timezone.localdate()
+        received = Q(batch__status='received')
+        suppliers = BatchSupplier.objects.annotate(
+            total_batches=models.Count('batch', filter=received),
+            total_quantity=Sum('batch__quantity', filter=received),
+            total_value=Sum(F('batch__quantity') * F('batch__cost_price'), filter=received),
+            expired_batches=models.Count('batch', filter=received & Q(batch__expiry_date__lt=today)),
+        ).order_by('pk')
+
+        orders = dict(
+            PurchaseOrder.objects.values('supplier').annotate(count=models.Count('pk')).order_by().values_list(
+                'supplier', 'count'
+            )
+        )
+        # An order is on time when the last of its batches from the supplier
+        # was received by the expected delivery date
+        on_time = {}
+        for supplier_id in PurchaseOrder.objects.filter(
+            status='received', expected_delivery_date__isnull=False
+        ).annotate(
+            last_received=models.Max(
+                'items__batches__received_date',
+                filter=Q(items__batches__supplier=F('supplier'))
+            )
+        ).filter(
+            last_received__lte=F('expected_delivery_date')
+        ).values_list('supplier', flat=True):
+            on_time[supplier_id] = on_time.get(supplier_id, 0) + 1
+
         data = []
         for supplier in suppliers:
-            purchases = Purchase.objects.filter(supplier=supplier)
-            total_purchases = purchases.count()
-            total_value = purchases.aggregate(total=Sum(F('quantity') * F('unit_price')))['total'] or 0
+            total_batches = supplier.total_batches
+            expired_batches = supplier.expired_batches
             data.append({
                 'supplier': supplier.name,
-                'total_purchases': total_purchases,
-                'total_value': total_value,
+                'total_batches': total_batches,
+                'total_quantity': supplier.total_quantity or 0,
+                'total_value': float(supplier.total_value or 0),
+                'on_time_delivery_rate': on_time.get(supplier.pk, 0) / max(1, orders.get(supplier.pk, 0)) * 100,
+                'quality_score': (total_batches - expired_batches) / total_batches * 100 if total_batches else 100,
+                'expired_batches': expired_batches
             })
         return Response(data)
 
@@ -490,7 +453,7 @@ class ExpiringBatchesView(ListAPIView):
         from django.utils import timezone
         today = timezone.now().date()
         # Batches expiring within 30 days
-        return Batch.objects.filter(
+        return Batch.objects.select_related('product', 'supplier').filter(
             expiry_date__gte=today,
             expiry_date__lte=today + timezone.timedelta(days=30),
             status='received',
@@ -518,7 +481,7 @@ class ExpiredBatchesView(ListAPIView):
     """Get batches that have expired"""
     def get_queryset(self):
         from django.utils import timezone
-        return Batch.objects.filter(
+        return Batch.objects.select_related('product', 'supplier').filter(
             expiry_date__lt=timezone.now().date(),
             status='received',
             quantity__gt=0
@@ -540,62 +503,9 @@ class ExpiredBatchesView(ListAPIView):
             })
         return Response(data)
 
-# Supplier performance analytics
-class SupplierPerformanceView(ListAPIView):
-    def get(self, request):
-        from django.db.models import Sum, Count, Avg
-        from django.utils import timezone
-        from decimal import Decimal
-
-        suppliers = Supplier.objects.all()
-        data = []
-
-        for supplier in suppliers:
-            # Get all batches from this supplier
-            batches = Batch.objects.filter(supplier=supplier, status='received')
-
-            # Calculate metrics
-            total_batches = batches.count()
-            total_quantity = batches.aggregate(Sum('quantity'))['quantity__sum'] or 0
-            total_value = sum(batch.quantity * batch.cost_price for batch in batches)
-
-            # On-time delivery (batches received on or before expected date)
-            on_time_deliveries = 0
-            if hasattr(supplier, 'purchaseorder_set'):
-                orders = supplier.purchaseorder_set.all()
-                for order in orders:
-                    if order.status == 'received':
-                        expected_date = order.expected_delivery_date
-                        if expected_date:
-                            # Check if any batch from this order was received on time
-                            order_batches = Batch.objects.filter(
-                                supplier=supplier,
-                                purchase_order_item__purchase_order=order
-                            )
-                            if order_batches.exists():
-                                received_dates = [b.received_date for b in order_batches if b.received_date]
-                                if received_dates and max(received_dates) <= expected_date:
-                                    on_time_deliveries += 1
-
-            # Quality metrics (expired batches as percentage)
-            expired_batches = batches.filter(expiry_date__lt=timezone.now().date()).count()
-            quality_score = ((total_batches - expired_batches) / total_batches * 100) if total_batches > 0 else 100
-
-            data.append({
-                'supplier': supplier.name,
-                'total_batches': total_batches,
-                'total_quantity': total_quantity,
-                'total_value': float(total_value),
-                'on_time_delivery_rate': (on_time_deliveries / max(1, orders.count())) * 100 if hasattr(supplier, 'purchaseorder_set') else 0,
-                'quality_score': quality_score,
-                'expired_batches': expired_batches
-            })
-
-        return Response(data)
-
 # Product recall functionality
 class ProductRecallViewSet(viewsets.ModelViewSet):
-    queryset = Batch.objects.all()
+    queryset = Batch.objects.select_related('product', 'supplier')
     serializer_class = BatchSerializer
 
     @action(detail=True, methods=['post'])
@@ -612,7 +522,7 @@ class ProductRecallViewSet(viewsets.ModelViewSet):
 
         # Remove from product stock
         batch.product.stock_quantity -= batch.quantity
-        batch.product.save()
+        batch.product.save(log_history=False)
 
         # Create stock movement record
         StockMovement.objects.create(
@@ -637,13 +547,16 @@ class ProfitAnalysisView(ListAPIView):
 
         if not start_date or not end_date:
             # Default to current month
-            today = timezone.now().date()
+            today = timezone.localdate()
             start_date = today.replace(day=1)
             end_date = today
 
+        start, _ = day_bounds(start_date)
+        _, end = day_bounds(end_date)
+
         # Get sales history with profit data
         sales = SalesHistory.objects.filter(
-            sale_date__date__range=[start_date, end_date]
+            sale_date__gte=start, sale_date__lt=end
         )
 
         total_sales = sales.aggregate(
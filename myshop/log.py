@@ -0,0 +1,34 @@
+"""
+Non-blocking log output.
+
+Application code logs through ``QueueListenerHandler``, which formats the
+record's message on the calling thread (as ``QueueHandler.prepare`` does)
+and puts it on an in-memory queue; a ``QueueListener`` thread applies the
+real handlers' formatters and does the (blocking) writes. Request threads
+never wait on stdout or a log file.
+
+The handler wraps a ``QueueHandler`` rather than subclassing it: from
+Python 3.12 ``dictConfig`` configures ``QueueHandler`` subclasses itself
+and rejects the ``handlers`` list below. Point ``handlers`` at the real
+handlers with ``cfg://handlers.<name>`` (see ``LOGGING`` in settings).
+"""
+
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+class QueueListenerHandler(logging.Handler):
+    def __init__(self, handlers, respect_handler_level=True):
+        super().__init__()
+        self.queue = queue.SimpleQueue()
+        self.enqueue = QueueHandler(self.queue)
+        # dictConfig hands over a ConvertingList; indexing resolves cfg:// references
+        handlers = [handlers[i] for i in range(len(handlers))]
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=respect_handler_level)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def emit(self, record):
+        self.enqueue.emit(record)
@@ -0,0 +1,168 @@
+"""
+Per-request cost: SQL query count, database time, render time and size.
+
+Render time is how long ``response.render()`` takes for a lazily rendered
+response (every DRF ``Response``): encoding the data the view prepared with
+the negotiated renderer, plus any post-render callbacks. Serializers do
+their work when the view reads ``serializer.data``, which counts towards the
+total and, for lazy querysets, the database time. Responses that aren't
+rendered lazily (file downloads, plain ``HttpResponse``) have no render time.
+
+``MetricsMiddleware`` times every query the request runs through
+``connection.execute_wrapper``, reports the totals to the client in a
+``Server-Timing`` header and keeps a rolling window of samples per route
+(``METRICS_WINDOW``, default 500) that ``/api/metrics/`` summarises as
+percentiles for staff users. Requests that run more than
+``METRICS_QUERY_BUDGET`` queries are logged and counted, which is how N+1
+regressions show up.
+
+Samples are kept in process memory: with several worker processes each one
+reports its own traffic.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+METRICS_WINDOW = getattr(settings, 'METRICS_WINDOW', 500)
+METRICS_QUERY_BUDGET = getattr(settings, 'METRICS_QUERY_BUDGET', 50)
+
+_samples = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+_over_budget = defaultdict(int)
+_lock = threading.Lock()
+
+
+class QueryTimer:
+    """An ``execute_wrapper`` that counts queries and adds up their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if not match:
+        return f'{request.method} <unmatched>'
+    # Router routes are regexes; drop their anchors
+    return f"{request.method} /{match.route.replace('^', '').replace('$', '')}"
+
+
+def record(route, sample):
+    with _lock:
+        _samples[route].append(sample)
+        if sample['queries'] > METRICS_QUERY_BUDGET:
+            _over_budget[route] += 1
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _over_budget.clear()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def summary():
+    """Rolling percentiles per route, slowest p95 first"""
+    with _lock:
+        snapshot = {route: list(samples) for route, samples in _samples.items()}
+        over_budget = dict(_over_budget)
+
+    routes = []
+    for route, samples in snapshot.items():
+        stats = {'route': route, 'requests': len(samples), 'over_query_budget': over_budget.get(route, 0)}
+        for field in ('total_ms', 'db_ms', 'render_ms', 'queries', 'bytes'):
+            values = sorted(sample[field] for sample in samples if sample[field] is not None)
+            stats[field] = {
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+                'max': values[-1] if values else None,
+            }
+        routes.append(stats)
+    routes.sort(key=lambda stats: stats['total_ms']['p95'] or 0, reverse=True)
+    return {'window': METRICS_WINDOW, 'query_budget': METRICS_QUERY_BUDGET, 'routes': routes}
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        request._metrics_render = None
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        render = request._metrics_render
+        size = None if response.streaming else len(response.content)
+        route = route_name(request)
+        sample = {
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(timer.duration * 1000, 2),
+            'render_ms': round(render * 1000, 2) if render is not None else None,
+            'queries': timer.count,
+            'bytes': size,
+        }
+        record(route, sample)
+
+        timings = [
+            f'db;dur={sample["db_ms"]};desc="{timer.count} queries"',
+            f'total;dur={sample["total_ms"]}',
+        ]
+        if render is not None:
+            timings.insert(1, f'render;dur={sample["render_ms"]}')
+        response['Server-Timing'] = ', '.join(timings)
+
+        if timer.count > METRICS_QUERY_BUDGET:
+            response['X-Query-Budget-Exceeded'] = str(timer.count)
+            logger.warning(
+                "%s ran %d queries (budget %d) in %.1f ms",
+                route, timer.count, METRICS_QUERY_BUDGET, sample['total_ms']
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # This middleware comes first, so its hook runs last, just before
+        # Django would render the response; render it here to time exactly
+        # that (Django skips responses that are already rendered)
+        start = time.perf_counter()
+        response.render()
+        request._metrics_render = time.perf_counter() - start
+        return response
+
+
+class MetricsView(APIView):
+    """Rolling per-route request cost, for staff"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(summary())
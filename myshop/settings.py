@@ -5,6 +5,7 @@ Prepared for deployment on Vercel.
 """
 
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 import dj_database_url
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    'myshop.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -139,14 +141,86 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
-# ✅ Cache (using local memory cache)
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+# ✅ Cache: shared Redis when REDIS_URL is set, otherwise per-process local memory
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "myshop",
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                # A Redis outage degrades to cache misses instead of errors
+                "IGNORE_EXCEPTIONS": True,
+            },
+        }
     }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds a cached report response is kept (it is replaced sooner when data changes)
+REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 300))
+
+# Rendered product price list PDFs (see reports/pricelist.py); the default is
+# under the system temp dir so read-only deploys still have somewhere to write
+PRICE_LIST_CACHE_DIR = Path(os.environ.get('PRICE_LIST_CACHE_DIR') or Path(tempfile.gettempdir()) / 'price_lists')
+
+# Request metrics (see myshop/metrics.py): samples kept per route, and the
+# query count above which a request is flagged
+METRICS_WINDOW = int(os.environ.get('METRICS_WINDOW', 500))
+METRICS_QUERY_BUDGET = int(os.environ.get('METRICS_QUERY_BUDGET', 50))
+
+# Logging: app loggers are named after their module (logging.getLogger(__name__)),
+# records go through a queue and are written by a background thread, and
+# debug detail is only produced when LOG_LEVEL asks for it
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            'format': 'ts=%(asctime)s level=%(levelname)s logger=%(name)s thread=%(threadName)s msg="%(message)s"',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+        'queue': {
+            'class': 'myshop.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        **{
+            app: {'level': LOG_LEVEL}
+            for app in [
+                'branches', 'chits', 'customers', 'inventory', 'payments', 'preorders',
+                'repairs', 'reports', 'sales', 'shifts', 'suppliers', 'users', 'myshop',
+            ]
+        },
+    },
 }
 
-SESSION_ENGINE = "django.contrib.sessions.backends.cache"
+# Sessions are read through the cache but stored in the database, so they
+# survive restarts and are shared between worker processes
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 SESSION_CACHE_ALIAS = "default"
 
 # ✅ CORS settings
@@ -162,6 +236,10 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Let tills read the validators for conditional polling, and the
+# per-request cost reported by myshop.metrics
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified', 'Server-Timing', 'X-Query-Budget-Exceeded']
+
 # ✅ CSRF trusted origins
 CSRF_TRUSTED_ORIGINS = [
     "https://*.vercel.app",
@@ -0,0 +1,358 @@
+"""
+Test helpers for the cost of API routes.
+
+``seed_dataset`` bulk-loads a shop-sized dataset (thousands of products,
+batches and sale lines) in a few dozen queries, and ``get_routes`` lists
+every GET endpoint registered in ``myshop.urls`` and the app routers with
+its path arguments filled in from that dataset. ``QueryBudgetMixin`` gives
+test cases ``assertWithinBudget``, which fails on query count or wall time
+for a GET, or for a POST such as a checkout.
+
+With this many rows, a serializer or view that queries per row blows its
+budget by hundreds of queries, so N+1 regressions fail the suite instead of
+reaching the tills.
+"""
+
+import re
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+
+from branches.models import Branch
+from chits.models import Chit
+from customers.models import Customer, LoyaltyTransaction
+from inventory import models as inventory
+from payments.models import InstallmentPlan, Payment, PaymentLog
+from preorders.models import Preorder
+from repairs.models import Repair, RepairPart
+from reports.models import Report
+from sales.models import Cart, CartItem, Invoice, InvoiceItem, Return, Sale, SaleItem
+from shifts.models import Shift
+from suppliers import models as suppliers
+from users.models import UserProfile
+from .metrics import QueryTimer
+
+DEFAULT_QUERY_BUDGET = 5
+DEFAULT_TIME_BUDGET = 5.0  # seconds
+
+
+def seed_dataset(products=2000, batches_per_product=2, sales=500, lines_per_sale=3):
+    """
+    Bulk-create a realistic dataset and return the objects tests need.
+
+    Returns a dict with the staff ``user`` and ``profile`` (who has an open
+    shift), and one saved instance per model that routes look up by id.
+    """
+    today = timezone.localdate()
+    branch = Branch.objects.create(name='Main', location='Rongo', address='Main street', phone='0700000000')
+    user = User.objects.create_user(username='budget-admin', password='testpass', is_staff=True, is_superuser=True)
+    profile, _ = UserProfile.objects.get_or_create(user=user, defaults={'role': 'admin'})
+    shift = Shift.objects.create(cashier=profile, opening_balance=Decimal('1000.00'))
+    Shift.objects.bulk_create([
+        Shift(cashier=profile, opening_balance=Decimal('1000.00'), status='closed', end_time=timezone.now())
+        for _ in range(20)
+    ])
+
+    categories = inventory.Category.objects.bulk_create([
+        inventory.Category(name=f'Category {n}') for n in range(20)
+    ])
+    supplier_rows = suppliers.Supplier.objects.bulk_create([
+        suppliers.Supplier(name=f'Supplier {n}', phone=f'07100000{n:02d}') for n in range(10)
+    ])
+    inventory_suppliers = inventory.Supplier.objects.bulk_create([
+        inventory.Supplier(name=f'Supplier {n}', phone=f'07200000{n:02d}') for n in range(10)
+    ])
+    customers = Customer.objects.bulk_create([
+        Customer(name=f'Customer {n}', phone=f'0711{n:06d}') for n in range(200)
+    ])
+
+    product_rows = inventory.Product.objects.bulk_create([
+        inventory.Product(
+            sku=f'SKU{n:05d}',
+            name=f'Product {n}',
+            category=categories[n % len(categories)],
+            cost_price=Decimal('50.00'),
+            selling_price=Decimal('80.00'),
+            wholesale_price=Decimal('70.00'),
+            stock_quantity=100 * batches_per_product,
+            low_stock_threshold=10 if n % 50 else 500,
+        )
+        for n in range(products)
+    ])
+    batches = inventory.Batch.objects.bulk_create([
+        inventory.Batch(
+            product=product,
+            batch_number=f'{product.sku}-B{b}',
+            quantity=100,
+            cost_price=Decimal('50.00'),
+            expiry_date=today + timedelta(days=-5 if b == 0 and n % 20 == 0 else 30 * (b + 1)),
+            purchase_date=today - timedelta(days=60 - b),
+            supplier=supplier_rows[n % len(supplier_rows)],
+            status='received',
+            received_date=today - timedelta(days=60 - b),
+        )
+        for n, product in enumerate(product_rows)
+        for b in range(batches_per_product)
+    ])
+    inventory.ProductHistory.objects.bulk_create([
+        inventory.ProductHistory(product=product, field_changed='product', change_type='create', user=profile)
+        for product in product_rows
+    ])
+    inventory.Purchase.objects.bulk_create([
+        inventory.Purchase(
+            product=product, supplier=inventory_suppliers[n % len(inventory_suppliers)],
+            quantity=100, unit_price=Decimal('50.00'), total_price=Decimal('5000.00'), batch_number=f'{product.sku}-B0'
+        )
+        for n, product in enumerate(product_rows[:500])
+    ])
+    inventory.PriceHistory.objects.bulk_create([
+        inventory.PriceHistory(
+            supplier=inventory_suppliers[n % len(inventory_suppliers)], product=product, price=Decimal('50.00')
+        )
+        for n, product in enumerate(product_rows[:500])
+    ])
+    suppliers.SupplierPriceHistory.objects.bulk_create([
+        suppliers.SupplierPriceHistory(
+            supplier=supplier_rows[n % len(supplier_rows)], product=product, price=Decimal('50.00')
+        )
+        for n, product in enumerate(product_rows[:500])
+    ])
+
+    # Till traffic concentrates on the best sellers
+    best_sellers = min(products, 300)
+
+    def line_product(n, line):
+        return (n * lines_per_sale + line) % best_sellers
+
+    carts = Cart.objects.bulk_create([
+        Cart(cashier=profile, customer=customers[n % len(customers)] if n % 3 == 0 else None, status='closed')
+        for n in range(sales + 20)
+    ])
+    Cart.objects.filter(pk__in=[cart.pk for cart in carts[sales:]]).update(status='held')
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product_rows[line_product(n, line)], quantity=1,
+                 unit_price=Decimal('80.00'))
+        for n, cart in enumerate(carts)
+        for line in range(lines_per_sale)
+    ])
+    total = Decimal('80.00') * lines_per_sale
+    sale_rows = Sale.objects.bulk_create([
+        Sale(
+            cart=cart, customer=cart.customer, shift=shift, total_amount=total, final_amount=total,
+            receipt_number=f'SEED-{n:06d}'
+        )
+        for n, cart in enumerate(carts[:sales])
+    ])
+    SaleItem.objects.bulk_create([
+        SaleItem(sale=sale, product=product_rows[line_product(n, line)], quantity=1,
+                 unit_price=Decimal('80.00'))
+        for n, sale in enumerate(sale_rows)
+        for line in range(lines_per_sale)
+    ])
+    inventory.SalesHistory.objects.bulk_create([
+        inventory.SalesHistory(
+            product=product_rows[line_product(n, line)],
+            batch=batches[line_product(n, line) * batches_per_product],
+            customer=sale.customer, quantity=1, unit_price=Decimal('80.00'), cost_price=Decimal('50.00'),
+            total_price=Decimal('80.00'), profit=Decimal('30.00'), receipt_number=sale.receipt_number
+        )
+        for n, sale in enumerate(sale_rows)
+        for line in range(lines_per_sale)
+    ])
+    inventory.StockMovement.objects.bulk_create([
+        inventory.StockMovement(
+            product=product_rows[line_product(n, line)], movement_type='out', quantity=-1,
+            reason=f'Sale {sale.receipt_number}', user=profile
+        )
+        for n, sale in enumerate(sale_rows)
+        for line in range(lines_per_sale)
+    ])
+    payments = Payment.objects.bulk_create([
+        Payment(sale=sale, customer=sale.customer, payment_type='cash' if n % 2 else 'mpesa', amount=total,
+                status='completed')
+        for n, sale in enumerate(sale_rows)
+    ])
+    PaymentLog.objects.bulk_create([PaymentLog(payment=payment, log_message='Completed') for payment in payments[:100]])
+    InstallmentPlan.objects.bulk_create([
+        InstallmentPlan(sale=sale, total_amount=total, number_of_installments=3, installment_amount=total / 3,
+                        remaining_balance=total, due_date=today + timedelta(days=30))
+        for sale in sale_rows[:20]
+    ])
+    Return.objects.bulk_create([
+        Return(sale=sale, reason='Damaged', total_refund_amount=Decimal('80.00'), processed_by=profile)
+        for sale in sale_rows[:20]
+    ])
+    invoices = Invoice.objects.bulk_create([
+        Invoice(invoice_number=f'SEED-INV-{n:04d}', sale=sale, customer=customers[n], due_date=today,
+                subtotal=total, total_amount=total, created_by=profile)
+        for n, sale in enumerate(sale_rows[:50])
+    ])
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, product=product_rows[line], description=f'Line {line}', quantity=1,
+                    unit_price=Decimal('80.00'))
+        for invoice in invoices
+        for line in range(lines_per_sale)
+    ])
+
+    orders = suppliers.PurchaseOrder.objects.bulk_create([
+        suppliers.PurchaseOrder(supplier=supplier_rows[n % len(supplier_rows)], order_number=f'SEED-PO-{n:04d}',
+                                status='ordered')
+        for n in range(20)
+    ])
+    suppliers.PurchaseOrderItem.objects.bulk_create([
+        suppliers.PurchaseOrderItem(purchase_order=order, product=product_rows[n * 5 + line], quantity=50,
+                                    unit_price=Decimal('50.00'))
+        for n, order in enumerate(orders)
+        for line in range(5)
+    ])
+
+    LoyaltyTransaction.objects.bulk_create([
+        LoyaltyTransaction(customer=customer, transaction_type='earned', points=10, reason='Purchase')
+        for customer in customers
+    ])
+    Chit.objects.bulk_create([
+        Chit(customer=customers[n], amount=Decimal('200.00')) for n in range(50)
+    ])
+    repairs = Repair.objects.bulk_create([
+        Repair(customer=customers[n], device_model='Model', device_type='Phone', issue_description='Screen',
+               technician=profile)
+        for n in range(20)
+    ])
+    RepairPart.objects.bulk_create([
+        RepairPart(repair=repair, product=product_rows[n], quantity=1, unit_cost=Decimal('50.00'))
+        for n, repair in enumerate(repairs)
+    ])
+    Preorder.objects.bulk_create([
+        Preorder(customer=customers[n], product=product_rows[n], quantity=1, deposit_amount=Decimal('20.00'),
+                 outstanding_balance=Decimal('60.00'))
+        for n in range(50)
+    ])
+    Report.objects.bulk_create([
+        Report(report_type='sales', title=f'Report {n}', date_from=today, date_to=today, generated_by=profile,
+               data={}, total_records=0)
+        for n in range(10)
+    ])
+
+    return {
+        'user': user,
+        'profile': profile,
+        'branch': branch,
+        'shift': shift,
+        'product': product_rows[0],
+        'customer': customers[0],
+        'sale': sale_rows[0],
+        'supplier': inventory_suppliers[0],
+        'repair': repairs[0],
+        'purchase_order': orders[0],
+    }
+
+
+# Path arguments that aren't a view's own ``pk``, and the seeded object they name
+PATH_ARGUMENTS = {
+    'product_id': 'product',
+    'customer_id': 'customer',
+    'customer_pk': 'customer',
+    'sale_id': 'sale',
+    'supplier_id': 'supplier',
+    'repair_pk': 'repair',
+}
+
+
+def _walk(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _walk(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            yield prefix + str(pattern.pattern), pattern.callback
+
+
+def _answers_get(callback):
+    actions = getattr(callback, 'actions', None)
+    if actions is not None:
+        return 'get' in actions
+    view_class = getattr(callback, 'view_class', None) or getattr(callback, 'cls', None)
+    return view_class is not None and hasattr(view_class, 'get')
+
+
+def _view_name(callback):
+    view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+    name = view_class.__name__ if view_class else callback.__name__
+    actions = getattr(callback, 'actions', None)
+    return f"{name}.{actions['get']}" if actions else name
+
+
+def _path_value(name, callback, seeded):
+    if name in PATH_ARGUMENTS:
+        return seeded[PATH_ARGUMENTS[name]].pk
+    if name != 'pk':
+        return None
+    view_class = getattr(callback, 'cls', None)
+    queryset = getattr(view_class, 'queryset', None)
+    serializer_class = getattr(view_class, 'serializer_class', None)
+    if queryset is not None:
+        model = queryset.model
+    elif serializer_class is not None and hasattr(serializer_class, 'Meta'):
+        model = serializer_class.Meta.model
+    else:
+        return None
+    return model._default_manager.order_by('pk').values_list('pk', flat=True).first()
+
+
+def get_routes(seeded):
+    """
+    ``(view name, url)`` for every GET route outside the admin, with path
+    arguments pointing at seeded rows. Format-suffix variants and the DRF
+    API root pages are left out.
+    """
+    routes = []
+    for route, callback in _walk(get_resolver().url_patterns):
+        if route.startswith('admin/') or 'format' in route or not _answers_get(callback):
+            continue
+        if _view_name(callback) == 'APIRootView':
+            continue
+        arguments = re.findall(r'<(?:\w+:)?(\w+)>|\(\?P<(\w+)>', route)
+        values = {}
+        for names in arguments:
+            name = names[0] or names[1]
+            values[name] = _path_value(name, callback, seeded)
+        if None in values.values():
+            raise LookupError(f'No seeded value for the path arguments of {route}')
+        url = re.sub(r'\(\?P<(\w+)>[^)]*\)', lambda m: str(values[m.group(1)]), route)
+        url = re.sub(r'<(?:\w+:)?(\w+)>', lambda m: str(values[m.group(1)]), url)
+        routes.append((_view_name(callback), '/' + url.replace('^', '').replace('$', '')))
+    return routes
+
+
+class QueryBudgetMixin:
+    def assertWithinBudget(self, url, max_queries=DEFAULT_QUERY_BUDGET, max_seconds=DEFAULT_TIME_BUDGET,
+                           method='get', data=None, **params):
+        """
+        Request ``url`` and fail if it errors, runs too many queries or takes
+        too long. GETs send ``params`` as the query string; other methods
+        send ``data`` as JSON and must succeed.
+        """
+        # Counted with an execute wrapper: connection.queries stops growing
+        # once it holds 9000 entries, which a seeded suite soon reaches
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            start = time.perf_counter()
+            if method == 'get':
+                response = self.client.get(url, params)
+            else:
+                response = getattr(self.client, method)(url, data, format='json')
+            elapsed = time.perf_counter() - start
+        if method == 'get':
+            self.assertLess(response.status_code, 500, f'{url} failed')
+        else:
+            self.assertLess(response.status_code, 300, f'{method.upper()} {url} failed: {response.data}')
+        self.assertLessEqual(
+            timer.count, max_queries,
+            f'{url} ran {timer.count} queries (budget {max_queries})'
+        )
+        self.assertLessEqual(elapsed, max_seconds, f'{url} took {elapsed:.2f}s (budget {max_seconds}s)')
+        return response
@@ -0,0 +1,175 @@
+import io
+import logging.config
+import re
+import sys
+import time
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from inventory.models import Category, Product
+from . import metrics
+from .log import QueueListenerHandler
+from .testing import DEFAULT_QUERY_BUDGET, QueryBudgetMixin, get_routes, seed_dataset
+
+
+class MetricsMiddlewareTest(APITestCase):
+    def setUp(self):
+        metrics.reset()
+        self.staff = User.objects.create_user(username='admin', password='testpass', is_staff=True)
+        category = Category.objects.create(name='Spirits')
+        for n in range(3):
+            Product.objects.create(
+                sku=f'SKU{n}', name=f'Product {n}', category=category,
+                cost_price=Decimal('50.00'), selling_price=Decimal('80.00'), stock_quantity=10
+            )
+
+    def test_responses_carry_server_timing(self):
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('render;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        self.assertNotIn('X-Query-Budget-Exceeded', response)
+
+    def test_render_time_is_the_time_spent_rendering(self):
+        self.client.force_authenticate(user=self.staff)
+        render = JSONRenderer.render
+
+        def slow_render(*args, **kwargs):
+            time.sleep(0.05)
+            return render(*args, **kwargs)
+
+        with mock.patch.object(JSONRenderer, 'render', slow_render):
+            response = self.client.get('/api/products/', HTTP_ACCEPT='application/json')
+        render_ms = float(re.search(r'render;dur=([\d.]+)', response['Server-Timing']).group(1))
+        total_ms = float(re.search(r'total;dur=([\d.]+)', response['Server-Timing']).group(1))
+        self.assertGreaterEqual(render_ms, 50)
+        self.assertLess(render_ms, total_ms)
+
+    def test_responses_that_are_not_rendered_have_no_render_time(self):
+        request = RequestFactory().get('/plain/')
+        response = metrics.MetricsMiddleware(lambda request: HttpResponse(b'ok'))(request)
+        self.assertNotIn('render;', response['Server-Timing'])
+
+    def test_metrics_endpoint_reports_per_route_percentiles(self):
+        self.client.force_authenticate(user=self.staff)
+        for _ in range(3):
+            self.client.get('/api/products/')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        routes = {stats['route']: stats for stats in response.data['routes']}
+        products = routes['GET /api/products/']
+        self.assertEqual(products['requests'], 3)
+        self.assertGreater(products['queries']['p50'], 0)
+        self.assertGreater(products['bytes']['max'], 0)
+        self.assertLessEqual(products['total_ms']['p50'], products['total_ms']['p99'])
+
+    def test_metrics_are_staff_only(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='cashier', password='testpass'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_requests_over_the_query_budget_are_flagged(self):
+        self.client.force_authenticate(user=self.staff)
+        budget = metrics.METRICS_QUERY_BUDGET
+        metrics.METRICS_QUERY_BUDGET = 0
+        try:
+            with self.assertLogs('myshop.metrics', 'WARNING'):
+                response = self.client.get('/api/products/')
+        finally:
+            metrics.METRICS_QUERY_BUDGET = budget
+        self.assertIn('X-Query-Budget-Exceeded', response)
+        routes = {stats['route']: stats for stats in metrics.summary()['routes']}
+        self.assertEqual(routes['GET /api/products/']['over_query_budget'], 1)
+
+
+class LoggingConfigTest(SimpleTestCase):
+    def test_settings_configure_the_queue_handler(self):
+        logging.config.dictConfig(settings.LOGGING)
+        handler = logging.getLogger().handlers[0]
+        self.assertIsInstance(handler, QueueListenerHandler)
+
+        console = handler.listener.handlers[0]
+        stream = io.StringIO()
+        console.setStream(stream)
+        self.addCleanup(console.setStream, sys.stderr)
+        logging.getLogger('myshop').warning('stock %s', 5)
+        # Stopping the listener waits for the queue to drain
+        handler.listener.stop()
+        handler.listener.start()
+        self.assertIn('logger=myshop', stream.getvalue())
+        self.assertIn('msg="stock 5"', stream.getvalue())
+
+
+class RouteQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """Every GET route, and the till's write routes, stay within their query and time budgets on a shop-sized dataset"""
+
+    # Routes that need more than the default budget, by view name
+    QUERY_BUDGETS = {
+        'SalesSummaryView': 15,
+        'ProductTimelineView': 6,
+        'InventorySummaryView': 6,
+    }
+    # Write routes. Checkout and receiving cost the same however many lines
+    # they carry (the day's first sale also creates its receipt counter);
+    # sync pays SYNC_BUDGET_PER_SALE for each sale on top of SYNC_BUDGET
+    CHECKOUT_BUDGET = 30
+    RECEIVE_BUDGET = 12
+    SYNC_BUDGET = 10
+    SYNC_BUDGET_PER_SALE = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = seed_dataset()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.seeded['user'])
+
+    def sale_payload(self, lines=5):
+        items = [
+            {'product': pk, 'quantity': 1, 'unit_price': '80.00'}
+            for pk in Product.objects.order_by('pk').values_list('pk', flat=True)[:lines]
+        ]
+        return {'items': items, 'payment_method': 'cash', 'total_amount': 80.0 * lines}
+
+    def test_every_get_route_is_within_budget(self):
+        routes = get_routes(self.seeded)
+        self.assertGreater(len(routes), 50)
+        for view, url in routes:
+            with self.subTest(view=view, url=url):
+                self.assertWithinBudget(url, max_queries=self.QUERY_BUDGETS.get(view, DEFAULT_QUERY_BUDGET))
+
+    def test_checkout_is_within_budget(self):
+        for lines in (1, 20):
+            with self.subTest(lines=lines):
+                self.assertWithinBudget(
+                    '/api/sales/', max_queries=self.CHECKOUT_BUDGET, method='post', data=self.sale_payload(lines)
+                )
+
+    def test_sync_is_within_budget(self):
+        sales = [{**self.sale_payload(), 'client_uuid': str(uuid.uuid4())} for _ in range(5)]
+        response = self.assertWithinBudget(
+            '/api/sales/sync/', max_queries=self.SYNC_BUDGET + self.SYNC_BUDGET_PER_SALE * len(sales),
+            method='post', data={'sales': sales}
+        )
+        self.assertEqual(response.data['created'], len(sales))
+
+    def test_receive_is_within_budget(self):
+        order = self.seeded['purchase_order']
+        lines = [{'item_id': pk, 'quantity': 10} for pk in order.items.values_list('pk', flat=True)]
+        self.assertWithinBudget(
+            f'/api/purchase-orders/{order.pk}/receive/', max_queries=self.RECEIVE_BUDGET, method='post',
+            data={'lines': lines}
+        )
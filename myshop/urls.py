@@ -24,6 +24,7 @@ from repairs.views import RepairViewSet
 from preorders.views import PreorderViewSet
 from shifts.views import ShiftViewSet
 from branches.views import BranchViewSet
+from myshop.metrics import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -53,4 +54,5 @@ urlpatterns = [
     path('api/inventory/', include('inventory.urls')),
     path('api/', include('suppliers.urls')),
     path('api/integrations/', include('integrations.urls')),
+    path('api/metrics/', MetricsView.as_view()),
 ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0005_remove_customer_branch_and_more'),
+        ('payments', '0011_remove_payment_branch'),
+        ('sales', '0013_remove_cart_branch_remove_invoice_branch_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at'], name='payments_payment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['sale', 'status'], name='payments_payment_sale_idx'),
+        ),
+    ]
@@ -25,7 +25,13 @@ class Payment(models.Model):
         ('refunded', 'Refunded'),
     ], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='payments_payment_date_idx'),
+            models.Index(fields=['sale', 'status'], name='payments_payment_sale_idx'),
+        ]
+
     def __str__(self):
         return f"{self.payment_type} - {self.amount} for Sale {self.sale.receipt_number}"
 
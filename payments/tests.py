@@ -1,3 +1,35 @@
+from unittest import skipUnless
+from django.db import connection
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import Payment
+from reports.rollups import day_bounds
 
-# Create your tests here.
+
+@skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+class PaymentIndexTest(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(f'USING INDEX {index}', queryset.explain())
+
+    def test_lookups_use_indexes(self):
+        start, end = day_bounds(timezone.localdate())
+        self.assertUsesIndex(
+            Payment.objects.filter(created_at__gte=start, created_at__lt=end, status='completed'),
+            'payments_payment_date_idx'
+        )
+        self.assertUsesIndex(Payment.objects.filter(sale_id=1, status='completed'), 'payments_payment_sale_idx')
+
+
+class PaymentCreateLoggingTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='cashier', password='testpass'))
+
+    def test_rejections_are_logged_not_printed(self):
+        with self.assertLogs('payments.views', 'INFO') as logs:
+            response = self.client.post('/api/payments/', {'amount': '10', 'payment_type': 'cheque', 'sale': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertIn("'cheque'", logs.output[0])
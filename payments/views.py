@@ -1,10 +1,14 @@
+import logging
+
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from .models import Payment, PaymentLog, InstallmentPlan
 from .serializers import PaymentSerializer, PaymentLogSerializer, InstallmentPlanSerializer
 
+logger = logging.getLogger(__name__)
+
 class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related('sale')
     serializer_class = PaymentSerializer
 
     def create(self, request, *args, **kwargs):
@@ -12,22 +16,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
         Custom create method to handle payment creation with proper validation
         """
         try:
-            print(f"Creating payment with data: {request.data}")
-
-            # Debug: Print all request data
-            print(f"Full request data: {dict(request.data)}")
-            print(f"Request data types: {[(k, type(v)) for k, v in request.data.items()]}")
+            logger.debug("Creating payment with data: %s", request.data)
 
             # Validate amount
             amount = request.data.get('amount')
-            print(f"Amount received: {amount} (type: {type(amount)})")
             if amount is not None:
                 try:
                     float_amount = float(amount)
                     request.data['amount'] = float_amount
-                    print(f"Converted amount to: {float_amount}")
                 except (ValueError, TypeError) as e:
-                    print(f"Error converting amount: {str(e)}")
+                    logger.info("Rejected payment amount %r: %s", amount, e)
                     return Response(
                         {'error': f'Invalid amount format: {amount}'},
                         status=status.HTTP_400_BAD_REQUEST
@@ -36,7 +34,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
             # Ensure payment_type is valid
             payment_type = request.data.get('payment_type', '')
             valid_types = [choice[0] for choice in Payment.PAYMENT_TYPES]
-            print(f"Payment type received: '{payment_type}' (type: {type(payment_type)}), valid types: {valid_types}")
 
             # Handle case-insensitive matching
             payment_type_lower = str(payment_type).lower()
@@ -49,7 +46,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
             normalized_type = type_mapping.get(payment_type_lower, payment_type)
 
             if normalized_type not in valid_types:
-                print(f"Invalid payment type: {payment_type}, normalized: {normalized_type}")
+                logger.info("Rejected payment type %r", payment_type)
                 return Response(
                     {'error': f'Invalid payment_type "{payment_type}". Valid methods: cash, mpesa, split'},
                     status=status.HTTP_400_BAD_REQUEST
@@ -57,14 +54,12 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
             # Update the request data with normalized type
             request.data['payment_type'] = normalized_type
-            print(f"Normalized payment type to: {normalized_type}")
 
             # Validate sale exists (if provided)
             sale_id = request.data.get('sale')
             customer_id = request.data.get('customer_id') or request.data.get('customer')
 
-            print(f"Validating sale ID: {sale_id} (type: {type(sale_id)})")
-            print(f"Customer ID: {customer_id} (type: {type(customer_id)})")
+            logger.debug("Validating sale %r, customer %r", sale_id, customer_id)
 
             # Either sale or customer must be provided
             if not sale_id and not customer_id:
@@ -82,15 +77,14 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     else:
                         sale_id_int = sale_id
                     sale = Sale.objects.get(id=sale_id_int)
-                    print(f"Sale found: {sale.id} - {sale.receipt_number}")
                 except (Sale.DoesNotExist, ValueError, TypeError) as e:
-                    print(f"Error validating sale: {str(e)}")
+                    logger.info("Rejected payment for sale %r: %s", sale_id, e)
                     return Response(
                         {'error': f'Sale with id {sale_id} not found or invalid'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 except Exception as e:
-                    print(f"Unexpected error validating sale: {str(e)}")
+                    logger.exception("Unexpected error validating sale %r", sale_id)
                     return Response(
                         {'error': f'Error validating sale: {str(e)}'},
                         status=status.HTTP_400_BAD_REQUEST
@@ -105,18 +99,14 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     else:
                         customer_id_int = customer_id
                     customer = Customer.objects.get(id=customer_id_int)
-                    print(f"Customer found: {customer.id} - {customer.name}")
                     request.data['customer'] = customer_id_int
                 except Exception as e:
-                    print(f"Error validating customer: {str(e)}")
+                    logger.info("Rejected payment for customer %r: %s", customer_id, e)
                     return Response(
                         {'error': f'Customer with id {customer_id} not found or invalid'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-            # Debug: Print final request data before creating
-            print(f"Final request data before creation: {dict(request.data)}")
-
             # Final validation - ensure all data is in correct format
             try:
                 # Test that we can create the payment object
@@ -135,8 +125,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 if request.data.get('payment_type') == 'split' and request.data.get('split_data'):
                     test_data['split_data'] = request.data['split_data']
 
-                print(f"Test payment data: {test_data}")
-
                 # Try to validate the data format
                 if request.data.get('sale') is not None and not isinstance(request.data['sale'], int):
                     raise ValueError(f"Sale ID must be integer, got {type(request.data['sale'])}")
@@ -144,7 +132,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     raise ValueError(f"Amount must be numeric, got {type(test_data['amount'])}")
 
             except Exception as e:
-                print(f"Data validation error: {str(e)}")
+                logger.info("Rejected payment data: %s", e)
                 return Response(
                     {'error': f'Invalid payment data format: {str(e)}'},
                     status=status.HTTP_400_BAD_REQUEST
@@ -154,7 +142,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
             required_fields = ['payment_type', 'amount']
             for field in required_fields:
                 value = request.data.get(field)
-                print(f"Field {field}: {value} (type: {type(value)})")
                 if value is None or value == '':
                     return Response(
                         {'error': f'Missing or empty required field: {field}'},
@@ -192,9 +179,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 payment = Payment(**payment_data)
                 # Validate the model
                 payment.full_clean()
-                print("Payment object validation passed")
             except Exception as validation_error:
-                print(f"Payment validation error: {str(validation_error)}")
+                logger.info("Payment failed model validation: %s", validation_error)
                 return Response(
                     {'error': f'Payment validation failed: {str(validation_error)}'},
                     status=status.HTTP_400_BAD_REQUEST
@@ -205,11 +191,9 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 try:
                     from sales.models import Sale
                     sale_id = request.data['sale']
-                    print(f"Final sale check - ID: {sale_id}, type: {type(sale_id)}")
                     sale = Sale.objects.get(id=sale_id)
-                    print(f"Final sale check passed: {sale.receipt_number}")
                 except Exception as e:
-                    print(f"Final sale validation failed: {str(e)}")
+                    logger.info("Rejected payment for sale %r: %s", sale_id, e)
                     return Response(
                         {'error': f'Cannot access sale: {str(e)}'},
                         status=status.HTTP_400_BAD_REQUEST
@@ -223,18 +207,17 @@ class PaymentViewSet(viewsets.ModelViewSet):
             return response
 
         except Exception as e:
-            print(f"Error creating payment: {str(e)}")
+            logger.exception("Error creating payment")
             import traceback
-            traceback.print_exc()
             return Response(
                 {'error': f'Error creating payment: {str(e)}', 'details': str(e), 'traceback': traceback.format_exc()},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
 class PaymentLogViewSet(viewsets.ModelViewSet):
-    queryset = PaymentLog.objects.all()
+    queryset = PaymentLog.objects.select_related('payment')
     serializer_class = PaymentLogSerializer
 
 class InstallmentPlanViewSet(viewsets.ModelViewSet):
-    queryset = InstallmentPlan.objects.all()
+    queryset = InstallmentPlan.objects.select_related('sale')
     serializer_class = InstallmentPlanSerializer
@@ -3,9 +3,9 @@ from .models import Preorder, PreorderPayment
 from .serializers import PreorderSerializer, PreorderPaymentSerializer
 
 class PreorderViewSet(viewsets.ModelViewSet):
-    queryset = Preorder.objects.all()
+    queryset = Preorder.objects.select_related('customer', 'product')
     serializer_class = PreorderSerializer
 
 class PreorderPaymentViewSet(viewsets.ModelViewSet):
-    queryset = PreorderPayment.objects.all()
+    queryset = PreorderPayment.objects.select_related('preorder__product')
     serializer_class = PreorderPaymentSerializer
@@ -3,11 +3,11 @@ from .models import Repair, RepairPart
 from .serializers import RepairSerializer, RepairPartSerializer
 
 class RepairViewSet(viewsets.ModelViewSet):
-    queryset = Repair.objects.all()
+    queryset = Repair.objects.select_related('customer', 'technician__user')
     serializer_class = RepairSerializer
 
 class RepairPartViewSet(viewsets.ModelViewSet):
-    queryset = RepairPart.objects.all()
+    queryset = RepairPart.objects.select_related('product')
     serializer_class = RepairPartSerializer
 
 class RepairPartsView(generics.ListCreateAPIView):
@@ -15,7 +15,7 @@ class RepairPartsView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         repair_pk = self.kwargs['repair_pk']
-        return RepairPart.objects.filter(repair_id=repair_pk)
+        return RepairPart.objects.filter(repair_id=repair_pk).select_related('product')
 
     def perform_create(self, serializer):
         repair_pk = self.kwargs['repair_pk']
@@ -0,0 +1,72 @@
+"""
+Response caching for the report views.
+
+Responses are stored in the default cache (Redis in production, see
+``CACHES`` in settings) under a key made of the view, the branch, the query
+parameters and the versions of the data domains the report reads
+(``branches.versions``). A committed write to any of those domains makes
+older entries unreachable at once; ``REPORT_CACHE_TTL`` only bounds how long
+unreachable entries linger.
+"""
+
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from branches.middleware import BranchContextMiddleware
+from branches.versions import version_stamp
+
+REPORT_CACHE_TTL = getattr(settings, 'REPORT_CACHE_TTL', 300)
+
+
+def cache_key(view_name, request, domains, per_user=False):
+    branch = BranchContextMiddleware.get_current_branch()
+    params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+    parts = [
+        view_name,
+        branch.pk if branch else '-',
+        request.user.pk if per_user else '-',
+        # Responses without explicit dates describe "today"
+        timezone.localdate().isoformat(),
+        repr(params),
+    ]
+    digest = hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+    return f'reports:response:{version_stamp(domains, branch)}:{digest}'
+
+
+def cached_report(*domains, per_user=False):
+    """
+    Cache a report view's successful ``Response`` data until one of the
+    data ``domains`` it reads changes.
+
+    Use ``per_user=True`` for views whose output depends on who is asking.
+    Cacheable responses carry an ETag derived from the cache key, so a poll
+    with a matching ``If-None-Match`` gets a 304 without the cache being read.
+    Streaming and error responses are passed through untouched.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = cache_key(f'{type(self).__name__}.{method.__name__}:{kwargs!r}', request, domains, per_user)
+            etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                data = cache.get(key)
+                if data is not None:
+                    response = Response(data)
+                else:
+                    response = method(self, request, *args, **kwargs)
+                    if not (isinstance(response, Response) and response.status_code == status.HTTP_200_OK):
+                        return response
+                    cache.set(key, response.data, REPORT_CACHE_TTL)
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
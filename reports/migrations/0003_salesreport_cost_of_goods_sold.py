@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_alter_inventoryanalytics_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesreport',
+            name='cost_of_goods_sold',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+    ]
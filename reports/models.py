@@ -34,6 +34,7 @@ class SalesReport(models.Model):
     card_sales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     mpesa_sales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     transaction_count = models.PositiveIntegerField(default=0)
+    cost_of_goods_sold = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     gross_profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     net_profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     average_transaction = models.DecimalField(max_digits=10, decimal_places=2, default=0)
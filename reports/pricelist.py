@@ -0,0 +1,371 @@
+"""
+Cached product price list PDFs.
+
+Rendering the catalogue with ReportLab is slow, so finished PDFs are kept on
+disk, one per ``price_type``, under the catalogue's data version
+(``branches.versions``). Saving or deleting a product or category moves it
+on; sales move stock with ``F()`` updates that leave it alone, so the cache
+survives trading hours. A request for an unchanged catalogue costs a cache
+lookup plus a file read.
+
+On a miss the product rows are read on the request thread and the PDF is
+built by a background worker; concurrent requests for the same fingerprint
+wait on the same render instead of starting their own.
+
+The cache lives in ``PRICE_LIST_CACHE_DIR`` (a directory under the system
+temp dir by default). If it can't be written, as on a read-only deploy, each
+render is served straight from memory and not cached.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+
+from branches.versions import CATALOGUE, version_stamp
+from inventory.models import Product
+
+logger = logging.getLogger(__name__)
+
+PRICE_TYPES = ['retail', 'wholesale', 'both']
+
+_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'PRICE_LIST_RENDER_WORKERS', 2))
+# cache file path -> Future of the render writing it
+_renders = {}
+_renders_lock = threading.Lock()
+
+
+def _cache_dir():
+    return Path(getattr(settings, 'PRICE_LIST_CACHE_DIR', Path(tempfile.gettempdir()) / 'price_lists'))
+
+
+def fingerprint():
+    """Catalogue version; the catalogue isn't branch-scoped, so every branch shares it"""
+    return version_stamp([CATALOGUE], branch=False)
+
+
+def cache_path(price_type, version):
+    digest = hashlib.sha1(version.encode()).hexdigest()[:16]
+    return _cache_dir() / f'{price_type}-{digest}.pdf'
+
+
+def _products_by_category():
+    """Active products grouped by category name"""
+    products_by_category = defaultdict(list)
+    rows = Product.objects.filter(is_active=True).order_by('category__name', 'name').values(
+        'category__name', 'name', 'sku', 'selling_price', 'wholesale_price'
+    )
+    for row in rows:
+        products_by_category[row['category__name'] or 'Uncategorized'].append(row)
+    return products_by_category
+
+
+def _store(path, pdf_data):
+    """Write atomically, then drop older renders of the same price type"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(pdf_data)
+        os.replace(tmp_path, path)
+    except OSError:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    price_type = path.name.split('-', 1)[0]
+    for old in path.parent.glob(f'{price_type}-*.pdf'):
+        if old != path:
+            old.unlink(missing_ok=True)
+
+
+def _render_and_store(path, price_type, products_by_category, as_of):
+    """Render and cache the PDF; returns the PDF itself if it couldn't be cached"""
+    try:
+        pdf_data = render_price_list(price_type, products_by_category, as_of)
+        try:
+            _store(path, pdf_data)
+        except OSError as e:
+            logger.warning("Could not cache the price list in %s, serving it uncached: %s", path.parent, e)
+            return pdf_data
+        return None
+    finally:
+        with _renders_lock:
+            _renders.pop(path, None)
+
+
+def _ensure_rendered(price_type, timeout):
+    """``(path, None)`` once the current render is cached, else ``(path, PDF bytes)``"""
+    version = fingerprint()
+    path = cache_path(price_type, version)
+    if path.exists():
+        return path, None
+    with _renders_lock:
+        future = _renders.get(path)
+    if future is None:
+        # Read outside the lock, which every price list request takes; if
+        # another request starts the same render meanwhile, join that one
+        products_by_category = _products_by_category()
+        # The rows stand for this version until it moves on
+        as_of = timezone.now()
+        with _renders_lock:
+            future = _renders.get(path)
+            if future is None:
+                future = _renders[path] = _executor.submit(
+                    _render_and_store, path, price_type, products_by_category, as_of
+                )
+    return path, future.result(timeout=timeout)
+
+
+def open_price_list(price_type, timeout=None):
+    """
+    Open the cached PDF for the current catalogue, rendering it first if needed.
+
+    Raises ``concurrent.futures.TimeoutError`` if a render takes longer than
+    ``timeout`` seconds; the render carries on and is cached for the next request.
+    """
+    for attempt in range(3):
+        path, pdf_data = _ensure_rendered(price_type, timeout)
+        if pdf_data is not None:
+            return BytesIO(pdf_data)
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            # Replaced by a render for a newer catalogue in the meantime
+            continue
+    raise FileNotFoundError(path)
+
+
+def render_price_list(price_type, products_by_category, as_of=None):
+    """
+    Build the price list PDF; ``products_by_category`` maps category names to
+    product rows and ``as_of`` is when they were read
+    """
+    # Create PDF buffer
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=30, rightMargin=30, topMargin=20, bottomMargin=30)
+    elements = []
+
+    # Styles
+    styles = getSampleStyleSheet()
+
+    # Company Header Styles
+    company_name_style = ParagraphStyle(
+        'CompanyName',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=5,
+        alignment=1,
+        textColor=colors.HexColor('#2c3e50'),
+        fontName='Helvetica-Bold'
+    )
+
+    receipt_style = ParagraphStyle(
+        'ReceiptStyle',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=5,
+        alignment=1,
+        textColor=colors.HexColor('#e74c3c'),
+        fontName='Helvetica-Bold'
+    )
+
+    business_info_style = ParagraphStyle(
+        'BusinessInfo',
+        parent=styles['Normal'],
+        fontSize=12,
+        alignment=1,
+        textColor=colors.HexColor('#34495e'),
+        fontName='Helvetica-Bold'
+    )
+
+    contact_style = ParagraphStyle(
+        'ContactStyle',
+        parent=styles['Normal'],
+        fontSize=10,
+        alignment=1,
+        textColor=colors.HexColor('#7f8c8d')
+    )
+
+    # Company Header - Keep logo only
+    try:
+        # Try to load logo from staticfiles directory
+        logo_path = os.path.join(settings.BASE_DIR, 'staticfiles', 'images', 'logo.png')
+        if os.path.exists(logo_path):
+            logo = Image(logo_path, width=60, height=60)
+            logo.hAlign = 'CENTER'
+            elements.append(logo)
+            elements.append(Spacer(1, 10))
+    except Exception as e:
+        logger.warning("Could not load price list logo: %s", e)  # continue without it
+
+    # Company information - Removed as requested
+    # elements.append(Paragraph("MWAMBA", company_name_style))
+    # elements.append(Paragraph("RECEIPT", receipt_style))
+    # elements.append(Paragraph("MWAMBA LIQUOR STORES", business_info_style))
+    # elements.append(Paragraph("RONGO", business_info_style))
+    # elements.append(Spacer(1, 5))
+    # elements.append(Paragraph("Tel: +254 745 119 135", contact_style))
+    # elements.append(Paragraph("Paybill: 522533", contact_style))
+    # elements.append(Paragraph("Account: 8015580", contact_style))
+
+    elements.append(Spacer(1, 20))
+
+    # Document title
+    title_style = ParagraphStyle(
+        'DocumentTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        spaceAfter=15,
+        alignment=1,
+        textColor=colors.HexColor('#2c3e50'),
+        fontName='Helvetica-Bold'
+    )
+    elements.append(Paragraph("PRODUCT PRICE LIST", title_style))
+
+    # Date and summary
+    date_style = ParagraphStyle(
+        'DateStyle',
+        parent=styles['Normal'],
+        fontSize=9,
+        spaceAfter=20,
+        alignment=1,
+        textColor=colors.HexColor('#7f8c8d')
+    )
+    total_products = sum(len(rows) for rows in products_by_category.values())
+    total_categories = len(products_by_category)
+    # Stamped with when the rows were read rather than "generated now": the
+    # PDF is served from the cache until the catalogue changes
+    summary_text = f"Total Products: {total_products} | Categories: {total_categories}"
+    if as_of is not None:
+        summary_text = f"Prices as of: {timezone.localtime(as_of).strftime('%Y-%m-%d %H:%M:%S')} | {summary_text}"
+    elements.append(Paragraph(summary_text, date_style))
+
+    # Prepare comprehensive table data (Excel-like)
+    table_data = []
+
+    # Header row
+    header_row = ['Category', 'Product Name', 'SKU']
+    if price_type in ['retail', 'both']:
+        header_row.append('Retail Price')
+    if price_type in ['wholesale', 'both']:
+        header_row.append('Wholesale Price')
+    table_data.append(header_row)
+
+    # Add data rows grouped by category
+    current_category = None
+    for category_name, category_products in sorted(products_by_category.items()):
+        # Add category separator row (merged cells)
+        if current_category is not None:
+            # Add empty row for spacing
+            empty_row = [''] * len(header_row)
+            table_data.append(empty_row)
+
+        # Add category header row
+        category_header = [f'CATEGORY: {category_name.upper()}'] + [''] * (len(header_row) - 1)
+        table_data.append(category_header)
+
+        # Add product rows for this category
+        for product in category_products:
+            row = [
+                '',  # Empty category column for products
+                product['name'],
+                product['sku'] or 'N/A'
+            ]
+
+            if price_type in ['retail', 'both']:
+                row.append(f"Ksh {product['selling_price']:.2f}" if product['selling_price'] else 'N/A')
+            if price_type in ['wholesale', 'both']:
+                row.append(f"Ksh {product['wholesale_price']:.2f}" if product['wholesale_price'] else 'N/A')
+
+            table_data.append(row)
+
+        current_category = category_name
+
+    # Create the comprehensive table
+    table = Table(table_data, colWidths=[70, 130, 130] + ([70] * (len(header_row) - 3)))
+
+    # Table style - Excel-like
+    table_style = TableStyle([
+        # Header styling
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#34495e')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+        ('TOPPADDING', (0, 0), (-1, 0), 8),
+
+        # Category header rows
+        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#ecf0f1')),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor('#2c3e50')),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
+        ('SPAN', (0, 1), (-1, 1)),  # Merge category header cells
+
+        # Data rows
+        ('FONTNAME', (0, 2), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 2), (-1, -1), 8),
+        ('ALIGN', (0, 2), (-1, -1), 'LEFT'),
+        ('ALIGN', (3, 2), (-1, -1), 'RIGHT'),  # Right align price columns
+
+        # Grid lines
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#bdc3c7')),
+
+    ])
+
+    # Apply alternating colors for all data rows
+    row_idx = 2  # Start after header and first category
+    while row_idx < len(table_data):
+        if table_data[row_idx][0] == '':  # Data row (not category header)
+            if (row_idx - 2) % 2 == 1:  # Alternate starting from row 3
+                table_style.add('BACKGROUND', (0, row_idx), (-1, row_idx), colors.HexColor('#f8f9fa'))
+        row_idx += 1
+
+    # Special styling for category headers
+    category_rows = []
+    for i, row in enumerate(table_data):
+        if len(row) > 0 and str(row[0]).startswith('CATEGORY:'):
+            category_rows.append(i)
+
+    for row_idx in category_rows:
+        table_style.add('BACKGROUND', (0, row_idx), (-1, row_idx), colors.HexColor('#95a5a6'))
+        table_style.add('TEXTCOLOR', (0, row_idx), (-1, row_idx), colors.white)
+        table_style.add('FONTNAME', (0, row_idx), (-1, row_idx), 'Helvetica-Bold')
+        table_style.add('FONTSIZE', (0, row_idx), (-1, row_idx), 9)
+
+    table.setStyle(table_style)
+
+    # Add table to elements
+    elements.append(table)
+
+    # Footer - Removed as requested
+    # footer_style = ParagraphStyle(
+    #     'FooterStyle',
+    #     parent=styles['Normal'],
+    #     fontSize=8,
+    #     spaceBefore=15,
+    #     alignment=1,
+    #     textColor=colors.HexColor('#95a5a6')
+    # )
+    # footer_text = "Thank you for your business | MWAMBA LIQUOR STORES"
+    # elements.append(Paragraph(footer_text, footer_style))
+
+    # Build PDF
+    doc.build(elements)
+
+    # Get PDF data
+    pdf_data = buffer.getvalue()
+    buffer.close()
+    return pdf_data
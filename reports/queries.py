@@ -0,0 +1,81 @@
+"""
+Grouped queries shared by the inventory and customer reports.
+
+Per-product and per-customer figures are computed in the database as
+annotations: correlated subqueries for the day's sold and received
+quantities (so the two reverse relations can't multiply each other's rows)
+and plain grouped aggregates for customer totals. Every builder runs one
+query no matter how large the catalogue or customer list is.
+"""
+
+from django.db.models import IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .rollups import day_bounds
+
+
+def _per_product_sum(queryset, field):
+    """Correlated ``SUM(field)`` of ``queryset`` for the outer product, 0 when empty"""
+    total = queryset.filter(
+        product=OuterRef('pk')
+    ).order_by().values('product').annotate(total=Sum(field)).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def products_with_daily_movement(date=None):
+    """Products with ``sold_today`` and ``received_today`` annotated for a local day"""
+    from inventory.models import Product, StockMovement
+    from sales.models import SaleItem
+
+    if date is None:
+        date = timezone.localdate()
+    start, end = day_bounds(date)
+
+    return Product.objects.select_related('category').annotate(
+        sold_today=_per_product_sum(
+            SaleItem.objects.filter(sale__sale_date__gte=start, sale__sale_date__lt=end),
+            'quantity'
+        ),
+        received_today=_per_product_sum(
+            StockMovement.objects.filter(movement_type='in', created_at__gte=start, created_at__lt=end),
+            'quantity'
+        ),
+    )
+
+
+def inventory_rows(date=None, price_field='cost_price'):
+    """Inventory report rows; stock is valued at ``price_field``"""
+    return [
+        {
+            'product': product.name,
+            'category': product.category.name if product.category else 'Uncategorized',
+            'stock_level': product.stock_quantity,
+            'sold_today': product.sold_today,
+            'received_today': product.received_today,
+            'value': float(product.stock_quantity * getattr(product, price_field)),
+        }
+        for product in products_with_daily_movement(date)
+    ]
+
+
+def customer_rows():
+    """Customer report rows, biggest spenders first"""
+    from customers.models import Customer
+
+    customers = Customer.objects.annotate(
+        total_purchases=Sum('sale__final_amount'),
+        last_purchase_date=Max('sale__sale_date'),
+    )
+
+    result = [
+        {
+            'name': customer.name,
+            'phone': customer.phone,
+            'total_purchases': float(customer.total_purchases or 0),
+            'last_visit': customer.last_purchase_date.strftime('%Y-%m-%d') if customer.last_purchase_date else None,
+            'loyalty_points': customer.loyalty_points,
+        }
+        for customer in customers
+    ]
+    return sorted(result, key=lambda x: x['total_purchases'], reverse=True)
@@ -0,0 +1,194 @@
+"""
+Daily sales rollups.
+
+``SalesReport`` (one row per day) and ``ProductSalesHistory`` (one row per
+product per day) are updated as sales are completed and voided, so dashboards
+and range reports read a few rollup rows instead of scanning every sale.
+Amounts are added with ``F()`` expressions so concurrent tills never overwrite
+each other's totals.
+
+Cost of goods comes from ``SalesHistory.cost_price`` (the batch cost at the
+time of sale), falling back to the product's cost price for stock sold
+without batch tracking. Days are local calendar days (``TIME_ZONE``).
+"""
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import ProductSalesHistory, SalesReport
+
+ZERO = Decimal('0')
+
+# Payment.payment_type -> SalesReport column
+PAYMENT_COLUMNS = {
+    'cash': 'cash_sales',
+    'card': 'card_sales',
+    'mpesa': 'mpesa_sales',
+    'mobile': 'mpesa_sales',
+}
+
+SALES_REPORT_SUMS = [
+    'total_sales', 'cash_sales', 'card_sales', 'mpesa_sales',
+    'cost_of_goods_sold', 'gross_profit', 'net_profit',
+]
+PRODUCT_SUMS = ['revenue', 'cost_of_goods', 'gross_profit', 'net_profit']
+
+
+def _d(value):
+    return Decimal(str(value or 0))
+
+
+def day_bounds(day):
+    """Aware [start, end) datetimes for a local calendar day (a date or YYYY-MM-DD)"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _payment_totals(payments):
+    """Sum ``(payment_type, amount, split_data)`` triples into SalesReport columns"""
+    totals = {}
+    for payment_type, amount, split_data in payments:
+        if payment_type == 'split' and split_data:
+            # Legacy single split payment record
+            parts = split_data.items()
+        else:
+            parts = [(payment_type, amount)]
+        for method, part_amount in parts:
+            column = PAYMENT_COLUMNS.get(method)
+            if column:
+                totals[column] = totals.get(column, ZERO) + _d(part_amount)
+    return totals
+
+
+def _product_lines(lines):
+    """Group ``(product_id, quantity, revenue, unit_cost)`` lines by product"""
+    products = {}
+    for product_id, quantity, revenue, unit_cost in lines:
+        entry = products.setdefault(product_id, {'quantity_sold': 0, 'revenue': ZERO, 'cost_of_goods': ZERO})
+        entry['quantity_sold'] += int(quantity)
+        entry['revenue'] += _d(revenue)
+        entry['cost_of_goods'] += _d(unit_cost) * int(quantity)
+    for entry in products.values():
+        # No operating expenses are tracked per product, so net equals gross
+        entry['gross_profit'] = entry['net_profit'] = entry['revenue'] - entry['cost_of_goods']
+    return products
+
+
+def _apply(day, sale_total, payment_totals, products, sign):
+    """Add (sign=1) or subtract (sign=-1) one sale's figures from the day's rollups"""
+    cost = sum((entry['cost_of_goods'] for entry in products.values()), ZERO)
+    gross = sum((entry['gross_profit'] for entry in products.values()), ZERO)
+    deltas = dict(payment_totals)
+    deltas.update(total_sales=sale_total, cost_of_goods_sold=cost, gross_profit=gross, net_profit=gross)
+
+    if sign > 0:
+        SalesReport.objects.bulk_create([SalesReport(date=day)], ignore_conflicts=True)
+        ProductSalesHistory.objects.bulk_create(
+            [ProductSalesHistory(product_id=product_id, date=day) for product_id in products],
+            ignore_conflicts=True
+        )
+
+    # Voids only touch rows that exist (sales from before rollups were kept
+    # may have none) and counts never drop below zero
+    new_count = Greatest(F('transaction_count') + sign, Value(0))
+    new_total = F('total_sales') + sign * deltas['total_sales']
+    updates = {field: F(field) + sign * value for field, value in deltas.items()}
+    updates['transaction_count'] = new_count
+    updates['average_transaction'] = Case(
+        When(transaction_count__lte=-sign, then=Value(ZERO)),
+        default=new_total / (F('transaction_count') + sign),
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    )
+    SalesReport.objects.filter(date=day).update(**updates)
+
+    if not products:
+        return
+    updates = {}
+    for field in ['quantity_sold'] + PRODUCT_SUMS:
+        output_field = IntegerField() if field == 'quantity_sold' else DecimalField(max_digits=12, decimal_places=2)
+        delta = Case(
+            *[When(product_id=product_id, then=Value(sign * entry[field])) for product_id, entry in products.items()],
+            output_field=output_field
+        )
+        updates[field] = F(field) + delta
+    updates['quantity_sold'] = Greatest(updates['quantity_sold'], Value(0))
+    ProductSalesHistory.objects.filter(date=day, product_id__in=list(products)).update(**updates)
+
+
+def record_sale(sale, history, payments):
+    """
+    Add a just-completed sale to its day's rollups.
+
+    ``history`` are the sale's SalesHistory rows and ``payments`` its Payment
+    rows, as built by the checkout; nothing is read back from the database.
+    """
+    lines = [
+        (record.product_id, record.quantity, record.total_price,
+         record.cost_price if record.cost_price is not None else record.product.cost_price)
+        for record in history
+    ]
+    payment_totals = _payment_totals(
+        (payment.payment_type, payment.amount, payment.split_data)
+        for payment in payments if payment.status == 'completed'
+    )
+    _apply(timezone.localdate(sale.sale_date), _d(sale.final_amount), payment_totals, _product_lines(lines), 1)
+
+
+def _history_lines(queryset):
+    return queryset.values_list(
+        'product_id', 'quantity', 'total_price', Coalesce('cost_price', 'product__cost_price')
+    )
+
+
+def record_void(sale):
+    """Take a voided sale back out of its day's rollups"""
+    from inventory.models import SalesHistory
+
+    lines = _history_lines(SalesHistory.objects.filter(receipt_number=sale.receipt_number))
+    payment_totals = _payment_totals(
+        sale.payment_set.filter(status='completed').values_list('payment_type', 'amount', 'split_data')
+    )
+    _apply(timezone.localdate(sale.sale_date), _d(sale.final_amount), payment_totals, _product_lines(lines), -1)
+
+
+def rebuild_day(day):
+    """Recompute one day's rollups from the raw sales (used for backfills)"""
+    from inventory.models import SalesHistory
+    from payments.models import Payment
+    from sales.models import Sale
+
+    start, end = day_bounds(day)
+    sales = Sale.objects.filter(sale_date__gte=start, sale_date__lt=end, voided=False)
+    summary = sales.aggregate(total=Sum('final_amount'), count=Count('id'))
+    payment_totals = _payment_totals(
+        Payment.objects.filter(sale__in=sales, status='completed').values_list('payment_type', 'amount', 'split_data')
+    )
+    products = _product_lines(
+        _history_lines(SalesHistory.objects.filter(receipt_number__in=sales.values('receipt_number')))
+    )
+
+    total = _d(summary['total'])
+    count = summary['count']
+    values = {column: payment_totals.get(column, ZERO) for column in ['cash_sales', 'card_sales', 'mpesa_sales']}
+    gross = sum((entry['gross_profit'] for entry in products.values()), ZERO)
+    values.update(
+        total_sales=total,
+        transaction_count=count,
+        cost_of_goods_sold=sum((entry['cost_of_goods'] for entry in products.values()), ZERO),
+        gross_profit=gross,
+        net_profit=gross,
+        average_transaction=(total / count) if count else ZERO,
+    )
+    SalesReport.objects.update_or_create(date=day, defaults=values)
+
+    ProductSalesHistory.objects.filter(date=day).delete()
+    ProductSalesHistory.objects.bulk_create([
+        ProductSalesHistory(product_id=product_id, date=day, **entry)
+        for product_id, entry in products.items()
+    ])
@@ -1,3 +1,438 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from customers.models import Customer
+from inventory.models import Batch, Category, Product, StockMovement
+from sales.models import Cart, Sale, SaleItem
+from shifts.models import Shift
+from users.models import UserProfile
+from . import pricelist
+from .models import ProductSalesHistory, SalesReport
+from .rollups import rebuild_day
+
+
+class SalesRollupTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cashier', password='testpass')
+        self.profile = UserProfile.objects.create(user=self.user, role='cashier')
+        self.client.force_authenticate(user=self.user)
+        self.shift = Shift.objects.create(cashier=self.profile, opening_balance=Decimal('0.00'))
+        category = Category.objects.create(name='Spirits')
+        self.batched = Product.objects.create(
+            sku='WHISKY', name='Whisky', category=category,
+            cost_price=Decimal('50.00'), selling_price=Decimal('80.00'), stock_quantity=10
+        )
+        for offset, cost in [(0, '40.00'), (5, '45.00')]:
+            Batch.objects.create(
+                product=self.batched, batch_number=f'B{offset}', quantity=5, cost_price=Decimal(cost),
+                expiry_date=date.today() + timedelta(days=30 + offset),
+                purchase_date=date.today(), status='received'
+            )
+        self.unbatched = Product.objects.create(
+            sku='GIN', name='Gin', category=category,
+            cost_price=Decimal('30.00'), selling_price=Decimal('60.00'), stock_quantity=10
+        )
+
+    def sell(self, product, quantity, unit_price, payment_method='cash', **extra):
+        payload = {
+            'items': [{'product': product.id, 'quantity': quantity, 'unit_price': unit_price}],
+            'payment_method': payment_method,
+            'total_amount': float(Decimal(unit_price) * quantity),
+        }
+        payload.update(extra)
+        response = self.client.post('/api/sales/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Sale.objects.get(receipt_number=payload.get('receipt_number', response.data['receipt_number']))
+
+    def test_checkout_updates_rollups_with_batch_costs(self):
+        self.sell(self.batched, 7, '80.00', receipt_number='R1')
+        self.sell(self.unbatched, 2, '60.00', payment_method='mpesa', receipt_number='R2')
+
+        report = SalesReport.objects.get(date=timezone.localdate())
+        self.assertEqual(report.transaction_count, 2)
+        self.assertEqual(report.total_sales, Decimal('680.00'))
+        self.assertEqual(report.cash_sales, Decimal('560.00'))
+        self.assertEqual(report.mpesa_sales, Decimal('120.00'))
+        # 5 x 40 + 2 x 45 from batches, 2 x 30 from the product's cost price
+        self.assertEqual(report.cost_of_goods_sold, Decimal('350.00'))
+        self.assertEqual(report.gross_profit, Decimal('330.00'))
+        self.assertEqual(report.average_transaction, Decimal('340.00'))
+
+        whisky = ProductSalesHistory.objects.get(product=self.batched, date=timezone.localdate())
+        self.assertEqual(whisky.quantity_sold, 7)
+        self.assertEqual(whisky.revenue, Decimal('560.00'))
+        self.assertEqual(whisky.cost_of_goods, Decimal('290.00'))
+
+    def test_void_takes_sale_out_of_rollups(self):
+        self.sell(self.batched, 2, '80.00', receipt_number='R1')
+        sale = self.sell(self.unbatched, 3, '60.00', receipt_number='R2')
+
+        response = self.client.post(f'/api/sales/{sale.id}/void_sale/', {'reason': 'Wrong item'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+
+        report = SalesReport.objects.get(date=timezone.localdate())
+        self.assertEqual(report.transaction_count, 1)
+        self.assertEqual(report.total_sales, Decimal('160.00'))
+        self.assertEqual(report.cash_sales, Decimal('160.00'))
+        self.assertEqual(report.gross_profit, Decimal('80.00'))
+        gin = ProductSalesHistory.objects.get(product=self.unbatched, date=timezone.localdate())
+        self.assertEqual(gin.quantity_sold, 0)
+        self.assertEqual(gin.revenue, Decimal('0.00'))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.sell(self.batched, 6, '80.00', receipt_number='R1')
+        sale = self.sell(self.unbatched, 1, '60.00', payment_method='mpesa', receipt_number='R2')
+        self.client.post(f'/api/sales/{sale.id}/void_sale/', {'reason': 'Test'}, format='json')
+        self.sell(self.unbatched, 4, '60.00', receipt_number='R3')
+
+        fields = ['total_sales', 'cash_sales', 'mpesa_sales', 'transaction_count',
+                  'cost_of_goods_sold', 'gross_profit', 'average_transaction']
+        incremental = SalesReport.objects.values(*fields).get()
+        products = set(ProductSalesHistory.objects.filter(quantity_sold__gt=0).values_list(
+            'product_id', 'quantity_sold', 'revenue', 'cost_of_goods'))
+
+        rebuild_day(timezone.localdate())
+        self.assertEqual(SalesReport.objects.values(*fields).get(), incremental)
+        self.assertEqual(set(ProductSalesHistory.objects.values_list(
+            'product_id', 'quantity_sold', 'revenue', 'cost_of_goods')), products)
+
+    def test_today_summary_reads_rollups(self):
+        self.sell(self.batched, 3, '80.00', receipt_number='R1')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/reports/sales-summary/', {'today_summary': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['sales_today'], 240.0)
+        self.assertEqual(response.data['transactions_today'], 1)
+        self.assertEqual(response.data['profit_today'], 240.0 - 3 * 40.0)
+        self.assertEqual(response.data['top_products_today'][0]['quantity_sold'], 3)
+        self.assertFalse(any('sales_sale' in query['sql'] for query in ctx.captured_queries))
+
+    def test_sales_trend_range_reads_rollups(self):
+        today = timezone.localdate()
+        SalesReport.objects.create(date=today - timedelta(days=40), total_sales=Decimal('999.00'), transaction_count=9)
+        SalesReport.objects.create(date=today - timedelta(days=2), total_sales=Decimal('100.00'), transaction_count=1,
+                                   gross_profit=Decimal('20.00'), cost_of_goods_sold=Decimal('80.00'))
+
+        response = self.client.get('/api/reports/sales-summary/', {
+            'date_from': (today - timedelta(days=7)).isoformat(),
+            'date_to': today.isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['total_sales'], 100.0)
+        self.assertEqual(response.data[0]['cost_of_goods_sold'], 80.0)
+
+
+class DetailedTransactionsTest(APITestCase):
+    url = '/api/reports/sales-summary/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='testpass')
+        self.profile = UserProfile.objects.create(user=self.user, role='manager')
+        self.client.force_authenticate(user=self.user)
+        self.shift = Shift.objects.create(cashier=self.profile, opening_balance=Decimal('0.00'))
+        category = Category.objects.create(name='Spirits')
+        self.products = [
+            Product.objects.create(
+                sku=f'P{i}', name=f'Product {i}', category=category,
+                cost_price=Decimal('50.00'), selling_price=Decimal('80.00'), stock_quantity=100
+            )
+            for i in range(3)
+        ]
+
+    def make_sales(self, count):
+        for _ in range(count):
+            cart = Cart.objects.create(cashier=self.profile, status='closed')
+            sale = Sale.objects.create(
+                cart=cart, shift=self.shift, total_amount=Decimal('240.00'), final_amount=Decimal('240.00'),
+                receipt_number=f'R{Sale.objects.count() + 1}'
+            )
+            SaleItem.objects.bulk_create([
+                SaleItem(sale=sale, product=product, quantity=1, unit_price=Decimal('80.00'))
+                for product in self.products
+            ])
+
+    def fetch(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'detailed_transactions': 'true', **params})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            body = b''.join(response.streaming_content)
+        return json.loads(body), len(ctx.captured_queries)
+
+    def test_streams_transactions_with_items_and_payments(self):
+        self.make_sales(2)
+        rows, _ = self.fetch(shift_id=self.shift.id)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(rows[0]['items']), 3)
+        self.assertEqual(rows[0]['payments'][0]['payment_type'], 'cash')
+        self.assertEqual(rows[0]['items'][0]['total_price'], 80.0)
+
+    def test_query_count_does_not_grow_with_sales(self):
+        self.make_sales(2)
+        _, small = self.fetch()
+        self.make_sales(20)
+        rows, large = self.fetch()
+        self.assertEqual(len(rows), 22)
+        self.assertEqual(small, large)
+
+    def test_range_rejects_bad_dates(self):
+        response = self.client.get(self.url, {'detailed_transactions': 'true', 'date_from': 'x', 'date_to': 'y'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReportQueryCountTest(APITestCase):
+    """The inventory and customer report builders must not run queries per row"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='testpass')
+        self.profile = UserProfile.objects.create(user=self.user, role='manager')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(name='Spirits')
+        self.added = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.added += 1
+            n = self.added
+            product = Product.objects.create(
+                sku=f'P{n}', name=f'Product {n}', category=self.category if n % 2 else None,
+                cost_price=Decimal('10.00'), selling_price=Decimal('15.00'), stock_quantity=n
+            )
+            StockMovement.objects.create(product=product, movement_type='in', quantity=n)
+            StockMovement.objects.create(product=product, movement_type='in', quantity=1)
+            customer = Customer.objects.create(name=f'Customer {n}', phone=f'07000000{n:02d}')
+            cart = Cart.objects.create(cashier=self.profile, customer=customer, status='closed')
+            sale = Sale.objects.create(
+                cart=cart, customer=customer, total_amount=Decimal('15.00') * n,
+                final_amount=Decimal('15.00') * n, receipt_number=f'R{n}'
+            )
+            SaleItem.objects.create(sale=sale, product=product, quantity=n, unit_price=Decimal('15.00'))
+
+    def count_queries(self, method, url):
+        # Measure the report itself, not a cached response
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, {'report': 'detailed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries), response.data
+
+    def assert_constant(self, method, url):
+        self.add_rows(2)
+        few, _ = self.count_queries(method, url)
+        self.add_rows(25)
+        many, data = self.count_queries(method, url)
+        self.assertEqual(few, many)
+        return data
+
+    def test_inventory_report(self):
+        data = self.assert_constant('post', '/api/reports/reports/generate_inventory_report/')
+        self.assertEqual(len(data), 27)
+        row = next(row for row in data if row['product'] == 'Product 7')
+        self.assertEqual(row['sold_today'], 7)
+        self.assertEqual(row['received_today'], 8)
+        self.assertEqual(row['value'], 70.0)
+
+    def test_inventory_summary_report(self):
+        data = self.assert_constant('get', '/api/reports/inventory-summary/')
+        row = next(row for row in data if row['product'] == 'Product 4')
+        self.assertEqual(row['category'], 'Uncategorized')
+        self.assertEqual(row['value'], 60.0)
+
+    def test_customer_reports(self):
+        data = self.assert_constant('post', '/api/reports/reports/generate_customer_report/')
+        self.assertEqual(data[0]['name'], 'Customer 27')
+        self.assertEqual(data[0]['total_purchases'], 405.0)
+        self.assertIsNotNone(data[-1]['last_visit'])
+
+        _, summary = self.count_queries('get', '/api/reports/customer-summary/')
+        self.assertEqual(summary, data)
+
+
+class ProductPriceListPDFTest(APITestCase):
+    url = '/api/reports/product-price-list-pdf/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='manager', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.category = category = Category.objects.create(name='Spirits')
+        self.product = Product.objects.create(
+            sku='P1', name='Gin', category=category,
+            cost_price=Decimal('10.00'), selling_price=Decimal('15.00'), stock_quantity=5
+        )
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = Path(cache_dir.name)
+        settings_override = override_settings(PRICE_LIST_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def fetch(self, price_type='retail'):
+        response = self.client.get(self.url, {'price_type': price_type})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content)
+
+    def test_warm_request_only_checks_the_fingerprint(self):
+        pdf = self.fetch()
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.fetch(), pdf)
+
+    def test_catalogue_changes_replace_the_cached_render(self):
+        self.fetch()
+        self.fetch('wholesale')
+        first = {path.name for path in self.cache_dir.iterdir()}
+        self.product.selling_price = Decimal('16.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.fetch()
+        second = {path.name for path in self.cache_dir.iterdir()}
+        retail = [name for name in second if name.startswith('retail-')]
+        self.assertEqual(len(retail), 1)
+        self.assertNotIn(retail[0], first)
+        # Other price types are left for their own next request
+        self.assertEqual({name for name in second if name.startswith('wholesale-')},
+                         {name for name in first if name.startswith('wholesale-')})
+
+    def test_sales_keep_the_cached_render(self):
+        # Also lets setUp's catalogue writes bump, as they would have on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = UserProfile.objects.create(user=self.user, role='cashier')
+            Shift.objects.create(cashier=profile, opening_balance=Decimal('0.00'))
+            Batch.objects.create(
+                product=self.product, batch_number='GIN-1', quantity=5, purchase_date=date(2024, 1, 1),
+                status='received'
+            )
+        self.fetch()
+        first = {path.name for path in self.cache_dir.iterdir()}
+        payload = {
+            'items': [{'product': self.product.pk, 'quantity': 1, 'unit_price': '15.00'}],
+            'payment_method': 'cash', 'total_amount': 15.0,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/sales/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        with self.assertNumQueries(0):
+            self.fetch()
+        self.assertEqual({path.name for path in self.cache_dir.iterdir()}, first)
+
+    def test_category_rename_replaces_the_cached_render(self):
+        self.fetch()
+        first = {path.name for path in self.cache_dir.iterdir()}
+        self.category.name = 'Gins'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.fetch()
+        self.assertNotEqual({path.name for path in self.cache_dir.iterdir()}, first)
+
+    def test_cached_render_is_stamped_with_when_its_rows_were_read(self):
+        rows = pricelist._products_by_category()
+        as_of = timezone.now()
+        stamp = timezone.localtime(as_of).strftime('%Y-%m-%d %H:%M:%S')
+        with mock.patch.object(pricelist, 'Paragraph', wraps=pricelist.Paragraph) as paragraph:
+            pricelist.render_price_list('retail', rows, as_of)
+        texts = [call.args[0] for call in paragraph.call_args_list]
+        self.assertIn(f'Prices as of: {stamp} | Total Products: 1 | Categories: 1', texts)
+        self.assertFalse(any('Generated on' in text for text in texts))
+
+    def test_unwritable_cache_dir_serves_the_render_uncached(self):
+        blocker = self.cache_dir / 'not-a-directory'
+        blocker.write_bytes(b'')
+        with override_settings(PRICE_LIST_CACHE_DIR=blocker / 'price_lists'), \
+                self.assertLogs('reports.pricelist', 'WARNING'):
+            pdf = self.fetch()
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual([path.name for path in self.cache_dir.iterdir()], ['not-a-directory'])
+
+    def test_rows_are_read_without_holding_the_render_lock(self):
+        held = []
+
+        def products_by_category():
+            held.append(pricelist._renders_lock.locked())
+            return rows
+
+        rows = pricelist._products_by_category()
+        with mock.patch.object(pricelist, '_products_by_category', products_by_category):
+            self.fetch()
+        self.assertEqual(held, [False])
+
+    def test_invalid_price_type(self):
+        response = self.client.get(self.url, {'price_type': 'trade'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReportCacheTest(APITestCase):
+    url = '/api/reports/inventory-summary/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='manager', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(
+            sku='P1', name='Gin', category=Category.objects.create(name='Spirits'),
+            cost_price=Decimal('10.00'), selling_price=Decimal('15.00'), stock_quantity=5
+        )
+
+    def test_repeat_requests_are_served_from_the_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        # Different parameters are cached separately
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'report': 'detailed'})
+        self.assertGreater(len(queries.captured_queries), 0)
+
+    def test_stock_movements_expire_cached_reports(self):
+        self.assertEqual(self.client.get(self.url).data['total_items'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(stock_quantity=8)
+            StockMovement.objects.create(product=self.product, movement_type='in', quantity=3)
+        self.assertEqual(self.client.get(self.url).data['total_items'], 8)
+
+    def test_polls_with_a_current_etag_get_304(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            StockMovement.objects.create(product=self.product, movement_type='in', quantity=3)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_holding_an_order_expires_the_cached_sales_summary(self):
+        profile = UserProfile.objects.create(user=self.user, role='cashier')
+        Shift.objects.create(cashier=profile, opening_balance=Decimal('0.00'))
+        self.assertEqual(self.client.get('/api/reports/sales-summary/').data['held_orders'], [])
+
+        payload = {
+            'items': [{'product': self.product.pk, 'quantity': 1, 'unit_price': '15.00'}],
+            'payment_method': 'cash', 'total_amount': 15.0, 'hold_order': True,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/sales/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(len(self.client.get('/api/reports/sales-summary/').data['held_orders']), 1)
+
+    def test_user_specific_reports_are_not_shared(self):
+        other = User.objects.create_user(username='cashier', password='testpass')
+        UserProfile.objects.create(user=other, role='cashier')
+        self.client.get('/api/reports/sales-summary/')
+        self.client.force_authenticate(user=other)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/reports/sales-summary/')
+        self.assertGreater(len(queries.captured_queries), 0)
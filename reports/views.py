@@ -1,27 +1,27 @@
 from rest_framework import viewsets, status, generics
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Sum, Count, Avg, F, Q
+from django.db.models import Sum, Count, Avg, F, Q, Prefetch
 from django.db.models.functions import TruncDate, ExtractHour
 from django.utils import timezone
 from datetime import timedelta, datetime
 from decimal import Decimal
-from django.http import HttpResponse
+from concurrent.futures import TimeoutError as FutureTimeout
+from django.http import FileResponse, StreamingHttpResponse
 from django.conf import settings
 from django.templatetags.static import static
 import os
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from io import BytesIO
+import json
 from inventory.models import Product
 from .models import (
     Report, SalesReport, ProductSalesHistory, CustomerAnalytics,
     InventoryAnalytics, ShiftAnalytics, ProfitLossReport
 )
+from branches import versions
+from . import pricelist
+from .caching import cached_report
+from .queries import customer_rows, inventory_rows
+from .rollups import day_bounds
 from .serializers import (
     ReportSerializer, SalesReportSerializer, ProductSalesHistorySerializer,
     CustomerAnalyticsSerializer, InventoryAnalyticsSerializer,
@@ -31,7 +31,7 @@ from .serializers import (
 )
 
 class ReportViewSet(viewsets.ModelViewSet):
-    queryset = Report.objects.all()
+    queryset = Report.objects.select_related('generated_by__user')
     serializer_class = ReportSerializer
 
     @action(detail=False, methods=['post'])
@@ -98,55 +98,25 @@ class ReportViewSet(viewsets.ModelViewSet):
         return Response(pl_data, status=status.HTTP_200_OK)
 
     def _get_sales_data(self, date_from, date_to):
-        """Get sales data for the specified date range"""
-        from sales.models import Sale, Payment
-        from django.db.models import Case, When, DecimalField
-
-        sales = Sale.objects.filter(
-            sale_date__date__range=[date_from, date_to],
-            voided=False
-        ).annotate(
-            date=TruncDate('sale_date')
-        ).values('date').annotate(
-            total_sales=Sum('final_amount'),
-            transaction_count=Count('id')
+        """Get sales data for the specified date range from the daily rollups"""
+        reports = SalesReport.objects.filter(
+            date__range=[date_from, date_to],
+            transaction_count__gt=0
         ).order_by('date')
 
-        # Get payment method breakdown per day
-        payments_per_day = Payment.objects.filter(
-            sale__sale_date__date__range=[date_from, date_to],
-            sale__voided=False,
-            status='completed'
-        ).annotate(
-            date=TruncDate('sale__sale_date')
-        ).values('date', 'payment_type').annotate(
-            amount=Sum('amount')
-        ).order_by('date')
-
-        # Group payments by date
-        payments_by_date = {}
-        for payment in payments_per_day:
-            date_key = payment['date'].strftime('%Y-%m-%d')
-            if date_key not in payments_by_date:
-                payments_by_date[date_key] = {}
-            payments_by_date[date_key][payment['payment_type']] = float(payment['amount'])
-
-        result = []
-        for sale in sales:
-            date_str = sale['date'].strftime('%Y-%m-%d')
-            day_payments = payments_by_date.get(date_str, {})
-            result.append({
-                'date': date_str,
-                'total_sales': float(sale['total_sales']),
-                'cash_sales': float(day_payments.get('cash', 0)),
-                'card_sales': float(day_payments.get('card', 0)),
-                'mobile_sales': float(day_payments.get('mpesa', 0)),  # Frontend expects 'mobile_sales'
-                'transactions': sale['transaction_count'],  # Frontend expects 'transactions'
-                'gross_profit': float(sale['total_sales'] * Decimal('0.25')),  # Estimated 25% margin
-                'net_profit': float(sale['total_sales'] * Decimal('0.20'))  # Estimated 20% net profit
-            })
-
-        return result
+        return [
+            {
+                'date': report.date.strftime('%Y-%m-%d'),
+                'total_sales': float(report.total_sales),
+                'cash_sales': float(report.cash_sales),
+                'card_sales': float(report.card_sales),
+                'mobile_sales': float(report.mpesa_sales),  # Frontend expects 'mobile_sales'
+                'transactions': report.transaction_count,  # Frontend expects 'transactions'
+                'gross_profit': float(report.gross_profit),
+                'net_profit': float(report.net_profit)
+            }
+            for report in reports
+        ]
 
     def _get_daily_sales_summary(self, date=None):
         """Get comprehensive daily sales summary"""
@@ -154,11 +124,12 @@ class ReportViewSet(viewsets.ModelViewSet):
         from django.db.models import Sum, Count
 
         if date is None:
-            date = timezone.now().date()
+            date = timezone.localdate()
+        start, end = day_bounds(date)
 
         # Total sales for the day
         total_sales = Sale.objects.filter(
-            sale_date__date=date
+            sale_date__gte=start, sale_date__lt=end
         ).aggregate(
             total_amount=Sum('final_amount'),
             transaction_count=Count('id')
@@ -166,7 +137,7 @@ class ReportViewSet(viewsets.ModelViewSet):
 
         # Payment method breakdown
         payments = Payment.objects.filter(
-            sale__sale_date__date=date,
+            sale__sale_date__gte=start, sale__sale_date__lt=end,
             status='completed'
         ).values('payment_type').annotate(
             amount=Sum('amount'),
@@ -182,7 +153,7 @@ class ReportViewSet(viewsets.ModelViewSet):
 
         # Top products sold today
         top_products = SaleItem.objects.filter(
-            sale__sale_date__date=date
+            sale__sale_date__gte=start, sale__sale_date__lt=end
         ).values(
             'product__name',
             'product__sku'
@@ -193,7 +164,7 @@ class ReportViewSet(viewsets.ModelViewSet):
 
         # Hourly sales breakdown
         hourly_sales = Sale.objects.filter(
-            sale_date__date=date
+            sale_date__gte=start, sale_date__lt=end
         ).annotate(
             hour=ExtractHour('sale_date')
         ).values('hour').annotate(
@@ -228,86 +199,23 @@ class ReportViewSet(viewsets.ModelViewSet):
 
     def _get_inventory_data(self, date=None):
         """Get current inventory data"""
-        from inventory.models import Product, StockMovement
-        from sales.models import SaleItem
-        from django.db.models import Sum
-
-        products = Product.objects.all().select_related('category')
-
-        # Default to today if no date provided
-        if date is None:
-            date = timezone.now().date()
-
-        result = []
-        for product in products:
-            # Calculate stock status
-            if product.stock_quantity == 0:
-                status = 'out_of_stock'
-            elif product.stock_quantity <= (product.low_stock_threshold or 10):
-                status = 'low_stock'
-            elif product.stock_quantity > (product.low_stock_threshold or 10) * 3:
-                status = 'overstock'
-            else:
-                status = 'in_stock'
-
-            # Calculate stock sold today
-            sold_today = SaleItem.objects.filter(
-                product=product,
-                sale__sale_date__date=date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            # Calculate stock received today
-            received_today = StockMovement.objects.filter(
-                product=product,
-                movement_type='in',
-                created_at__date=date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            result.append({
-                'product': product.name,
-                'category': product.category.name if product.category else 'Uncategorized',
-                'stock_level': product.stock_quantity,
-                'sold_today': sold_today,
-                'received_today': received_today,
-                'value': float(product.stock_quantity * product.cost_price),
-            })
-
-        return result
+        return inventory_rows(date, price_field='cost_price')
 
     def _get_customer_data(self):
         """Get customer analytics data"""
-        from customers.models import Customer
-        from sales.models import Sale
-
-        customers = Customer.objects.all()
-
-        result = []
-        for customer in customers:
-            customer_sales = Sale.objects.filter(customer=customer)
-            total_purchases = customer_sales.aggregate(total=Sum('final_amount'))['total'] or 0
-            order_count = customer_sales.count()
-
-            last_purchase = customer_sales.order_by('-sale_date').first()
-            last_purchase_date = last_purchase.sale_date if last_purchase else None
-
-            result.append({
-                'name': customer.name,
-                'phone': customer.phone,
-                'total_purchases': float(total_purchases),
-                'last_visit': last_purchase_date.strftime('%Y-%m-%d') if last_purchase_date else None,
-                'loyalty_points': customer.loyalty_points,
-            })
-
-        return sorted(result, key=lambda x: x['total_purchases'], reverse=True)
+        return customer_rows()
 
     def _calculate_profit_loss(self, date_from, date_to):
         """Calculate profit & loss for the period using the same logic as product performance"""
         from sales.models import SaleItem
         from django.db.models import Sum
 
+        start, _ = day_bounds(date_from)
+        _, end = day_bounds(date_to)
+
         # Calculate total revenue and cost of goods sold from SaleItem data (exclude voided sales)
         sales_data = SaleItem.objects.filter(
-            sale__sale_date__date__range=[date_from, date_to],
+            sale__sale_date__gte=start, sale__sale_date__lt=end,
             sale__voided=False
         ).aggregate(
             total_revenue=Sum(F('unit_price') * F('quantity')),
@@ -336,6 +244,13 @@ class ReportViewSet(viewsets.ModelViewSet):
             'profit_margin_percentage': profit_margin
         }
 
+# Sales read (and prefetched for) per round trip by the detailed transactions export
+DETAILED_TRANSACTIONS_CHUNK_SIZE = 500
+
+# Seconds a price list request waits for a render before asking the client to retry
+PRICE_LIST_RENDER_TIMEOUT = getattr(settings, 'PRICE_LIST_RENDER_TIMEOUT', 30)
+
+
 class SalesSummaryView(generics.GenericAPIView):
     """Get sales summary for dashboard and reports"""
 
@@ -443,7 +358,7 @@ class SalesSummaryView(generics.GenericAPIView):
                     'created_at': sale.sale_date.isoformat(),
                     'payment_method': self._determine_payment_method(sale),
                     'sale_type': sale.sale_type,
-                    'mpesa_number': sale.payment_set.filter(payment_type='mpesa', status='completed').first().mpesa_number if sale.payment_set.filter(payment_type='mpesa', status='completed').exists() else None,
+                    'mpesa_number': self._mpesa_number(sale),
                     'items': [
                         {
                             'product_name': item.product.name,
@@ -502,6 +417,100 @@ class SalesSummaryView(generics.GenericAPIView):
 
         return result
 
+    def _get_sale_chit_details(self, sale_id):
+        """Get detailed chit information for a specific sale"""
+        from sales.models import Sale, SaleItem
+        from payments.models import Payment
+
+        try:
+            # Get the sale with related data
+            sale = Sale.objects.select_related('customer', 'shift__cashier__user').prefetch_related(
+                'saleitem_set__product__category', 'payment_set'
+            ).get(id=sale_id, voided=False)
+
+            # Get sale items with product details
+            items = []
+            for item in sale.saleitem_set.all():
+                items.append({
+                    'id': item.id,
+                    'product_name': item.product.name,
+                    'product_sku': item.product.sku,
+                    'category': item.product.category.name if item.product.category else 'Uncategorized',
+                    'quantity': item.quantity,
+                    'unit_price': float(item.unit_price),
+                    'discount': float(item.discount),
+                    'line_total': float((item.unit_price * item.quantity) - item.discount),
+                    'cost_price': float(item.product.cost_price) if item.product.cost_price else 0,
+                    'profit': float(((item.unit_price - item.product.cost_price) * item.quantity) - item.discount) if item.product.cost_price else 0
+                })
+
+            # Get payment details
+            payments = []
+            payment_breakdown = {}
+            for payment in sale.payment_set.filter(status='completed'):
+                payments.append({
+                    'id': payment.id,
+                    'payment_type': payment.payment_type,
+                    'amount': float(payment.amount),
+                    'reference_number': payment.reference_number,
+                    'created_at': payment.created_at.isoformat(),
+                    'status': payment.status
+                })
+                # Aggregate payment amounts by type
+                payment_breakdown[payment.payment_type] = payment_breakdown.get(payment.payment_type, 0) + float(payment.amount)
+
+            # Calculate totals
+            subtotal = sum(item['line_total'] for item in items)
+            total_discount = sum(item['discount'] * item['quantity'] for item in items)
+            total_cost = sum(item['cost_price'] * item['quantity'] for item in items)
+            total_profit = sum(item['profit'] for item in items)
+
+            chit_data = {
+                'sale_id': sale.id,
+                'receipt_number': sale.receipt_number,
+                'sale_date': sale.sale_date.isoformat(),
+                'sale_type': sale.sale_type,
+                'customer': {
+                    'id': sale.customer.id if sale.customer else None,
+                    'name': sale.customer.name if sale.customer else 'Walk-in',
+                    'phone': sale.customer.phone if sale.customer else None
+                },
+                'cashier': {
+                    'id': sale.shift.cashier.id if sale.shift and sale.shift.cashier else None,
+                    'name': sale.shift.cashier.user.get_full_name() if sale.shift and sale.shift.cashier else 'Unknown',
+                    'username': sale.shift.cashier.user.username if sale.shift and sale.shift.cashier else 'Unknown'
+                } if sale.shift else None,
+                'shift': {
+                    'id': sale.shift.id if sale.shift else None,
+                    'start_time': sale.shift.start_time.isoformat() if sale.shift else None,
+                    'status': sale.shift.status if sale.shift else None
+                } if sale.shift else None,
+                'items': items,
+                'payments': payments,
+                'payment_breakdown': payment_breakdown,
+                'summary': {
+                    'item_count': len(items),
+                    'total_quantity': sum(item['quantity'] for item in items),
+                    'subtotal': subtotal,
+                    'tax_amount': float(sale.tax_amount),
+                    'discount_amount': float(sale.discount_amount),
+                    'final_amount': float(sale.final_amount),
+                    'total_cost': total_cost,
+                    'total_profit': total_profit,
+                    'profit_margin': (total_profit / subtotal * 100) if subtotal > 0 else 0
+                },
+                'status': 'completed',
+                'voided': sale.voided
+            }
+
+            return chit_data
+
+        except Sale.DoesNotExist:
+            return {'error': 'Sale not found or has been voided'}
+        except Exception as e:
+            return {'error': f'Error retrieving chit details: {str(e)}'}
+
+    @cached_report(versions.SALES, versions.SHIFT, per_user=True)
     def get(self, request, sale_id=None):
         # Check if this is a request for a specific sale chit
         if sale_id:
@@ -517,13 +526,21 @@ class SalesSummaryView(generics.GenericAPIView):
             if shift_id:
                 detailed_transactions = self._get_detailed_transactions_for_shift(shift_id)
             elif date_from and date_to:
+                try:
+                    date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+                    date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+                except ValueError:
+                    return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
                 detailed_transactions = self._get_detailed_transactions_for_range(date_from, date_to)
             else:
                 # Default to today
-                today = timezone.now().date()
+                today = timezone.localdate()
                 detailed_transactions = self._get_detailed_transactions_for_date(today)
 
-            return Response(detailed_transactions)
+            return StreamingHttpResponse(
+                self._stream_json_array(detailed_transactions),
+                content_type='application/json'
+            )
 
         # Check if chit details for a specific sale are requested (legacy support)
         sale_id_param = request.query_params.get('sale_id')
@@ -643,9 +660,102 @@ class SalesSummaryView(generics.GenericAPIView):
             serializer = SalesSummarySerializer(data)
             return Response(serializer.data)
 
+    def _get_detailed_transactions_for_date(self, date):
+        """Detailed transactions and items sold for a specific date"""
+        return self._get_detailed_transactions_for_range(date, date)
+
+    def _get_detailed_transactions_for_range(self, date_from, date_to):
+        """Detailed transactions and items sold for a date range"""
+        from sales.models import Sale
+
+        start, _ = day_bounds(date_from)
+        _, end = day_bounds(date_to)
+        sales = Sale.objects.filter(sale_date__gte=start, sale_date__lt=end, voided=False)
+        return self._iter_detailed_transactions(sales)
+
+    def _get_detailed_transactions_for_shift(self, shift_id):
+        """Detailed transactions and items sold for a specific shift"""
+        from sales.models import Sale
+
+        sales = Sale.objects.filter(shift_id=shift_id, voided=False)
+        return self._iter_detailed_transactions(sales)
+
+    def _iter_detailed_transactions(self, sales):
+        """
+        Yield one transaction dict per non-voided sale.
+
+        Sales are read in chunks of DETAILED_TRANSACTIONS_CHUNK_SIZE; each chunk
+        prefetches its completed payments and its items with their products,
+        so every chunk costs the same three queries however many sales there are.
+        """
+        from sales.models import SaleItem
+        from payments.models import Payment
+
+        sales = sales.select_related('customer').prefetch_related(
+            Prefetch('payment_set', queryset=Payment.objects.filter(status='completed'), to_attr='completed_payments'),
+            Prefetch('saleitem_set', queryset=SaleItem.objects.select_related('product'), to_attr='items'),
+        ).order_by('-sale_date')
+
+        for sale in sales.iterator(chunk_size=DETAILED_TRANSACTIONS_CHUNK_SIZE):
+            yield {
+                'transaction_id': sale.id,
+                'receipt_number': sale.receipt_number,
+                'sale_date': sale.sale_date.isoformat(),
+                'customer': sale.customer.name if sale.customer else 'Walk-in',
+                'sale_type': sale.sale_type,
+                'total_amount': float(sale.final_amount),
+                'tax_amount': float(sale.tax_amount),
+                'discount_amount': float(sale.discount_amount),
+                'final_amount': float(sale.final_amount),
+                'payments': [
+                    {
+                        'payment_type': payment.payment_type,
+                        'amount': float(payment.amount),
+                        'reference_number': payment.reference_number,
+                        'created_at': payment.created_at.isoformat()
+                    }
+                    for payment in sale.completed_payments
+                ],
+                'items': [
+                    {
+                        'product_name': item.product.name,
+                        'product_sku': item.product.sku,
+                        'quantity': item.quantity,
+                        'unit_price': float(item.unit_price),
+                        'discount': float(item.discount),
+                        'total_price': float(item.unit_price * item.quantity - item.discount)
+                    }
+                    for item in sale.items
+                ]
+            }
+
+    def _stream_json_array(self, rows):
+        """Encode an iterable of dicts as a JSON array, one element at a time"""
+        yield '['
+        for index, row in enumerate(rows):
+            yield (',' if index else '') + json.dumps(row)
+        yield ']'
+
+    def _payments(self, sale, **fields):
+        """
+        The sale's payments matching ``fields``, in pk order.
+
+        Filters ``payment_set.all()`` in Python so that sales loaded with
+        ``prefetch_related('payment_set')`` don't query once per sale.
+        """
+        return sorted(
+            (payment for payment in sale.payment_set.all()
+             if all(getattr(payment, name) == value for name, value in fields.items())),
+            key=lambda payment: payment.pk
+        )
+
+    def _mpesa_number(self, sale):
+        payments = self._payments(sale, payment_type='mpesa', status='completed')
+        return payments[0].mpesa_number if payments else None
+
     def _determine_payment_method(self, sale):
         """Determine payment method based on payment records"""
-        payments = list(sale.payment_set.filter(status='completed'))
+        payments = self._payments(sale, status='completed')
         if not payments:
             return 'N/A'
 
@@ -670,7 +780,7 @@ class SalesSummaryView(generics.GenericAPIView):
     def _get_split_data_for_sale(self, sale):
         """Get split data for a sale, reconstructing from payment records if needed"""
         # For split payments, reconstruct split_data from payment records
-        payments = list(sale.payment_set.filter(status='completed'))
+        payments = self._payments(sale, status='completed')
         if len(payments) > 1:
             split_data = {}
             for payment in payments:
@@ -678,7 +788,7 @@ class SalesSummaryView(generics.GenericAPIView):
             return split_data
 
         # Fallback to old logic for legacy split payments
-        split_payment = sale.payment_set.filter(payment_type='split').first()
+        split_payment = next(iter(self._payments(sale, payment_type='split')), None)
         if split_payment and split_payment.split_data:
             # Only return if it's truly split (both amounts > 0)
             split_data = {k: v for k, v in split_payment.split_data.items() if float(v) > 0}
@@ -687,34 +797,24 @@ class SalesSummaryView(generics.GenericAPIView):
         return None
 
     def _get_today_sales(self):
-        from sales.models import Sale
-        today = timezone.now().date()
-        today_sales = Sale.objects.filter(
-            sale_date__date=today
-        ).aggregate(total=Sum('final_amount'))['total'] or Decimal('0')
-        return float(today_sales)
+        today = timezone.localdate()
+        report = SalesReport.objects.filter(date=today).only('total_sales').first()
+        return float(report.total_sales) if report else 0.0
 
     def _get_total_sales(self):
-        from sales.models import Sale
-        total_sales = Sale.objects.aggregate(total=Sum('final_amount'))['total'] or Decimal('0')
+        total_sales = SalesReport.objects.aggregate(total=Sum('total_sales'))['total'] or Decimal('0')
         return float(total_sales)
 
     def _get_sales_trend_data(self, start_date, end_date):
-        from sales.models import Sale
-        from django.db.models.functions import TruncDate
-
-        sales_trend = Sale.objects.filter(
-            sale_date__date__range=[start_date, end_date]
-        ).annotate(
-            date=TruncDate('sale_date')
-        ).values('date').annotate(
-            amount=Sum('final_amount')
-        ).order_by('date')
+        sales_trend = SalesReport.objects.filter(
+            date__range=[start_date, end_date],
+            transaction_count__gt=0
+        ).values('date', 'total_sales').order_by('date')
 
         result = [
             {
                 'date': item['date'].strftime('%Y-%m-%d'),
-                'amount': float(item['amount'] or 0)
+                'amount': float(item['total_sales'])
             }
             for item in sales_trend
         ]
@@ -725,8 +825,9 @@ class SalesSummaryView(generics.GenericAPIView):
     def _get_payment_methods_data(self, date):
         from payments.models import Payment
 
+        start, end = day_bounds(date)
         payments = Payment.objects.filter(
-            created_at__date=date,
+            created_at__gte=start, created_at__lt=end,
             status='completed'
         )
 
@@ -755,17 +856,14 @@ class SalesSummaryView(generics.GenericAPIView):
         ]
 
     def _get_top_products(self, start_date, end_date):
-        from sales.models import SaleItem
-        from django.db.models import Sum
-
-        top_products = SaleItem.objects.filter(
-            sale__sale_date__date__range=[start_date, end_date]
+        top_products = ProductSalesHistory.objects.filter(
+            date__range=[start_date, end_date]
         ).values(
             'product__name'
         ).annotate(
-            sold=Sum('quantity'),
-            revenue=Sum(F('unit_price') * F('quantity'))
-        ).order_by('-sold')[:5]
+            sold=Sum('quantity_sold'),
+            revenue=Sum('revenue')
+        ).filter(sold__gt=0).order_by('-sold')[:5]
 
         return [
             {
@@ -778,20 +876,17 @@ class SalesSummaryView(generics.GenericAPIView):
 
     def _get_products_sold_today(self, date=None):
         """Get products sold on a specific date"""
-        from sales.models import SaleItem
-        from django.db.models import Sum
-
         if date is None:
-            date = timezone.now().date()
+            date = timezone.localdate()
 
-        products_sold = SaleItem.objects.filter(
-            sale__sale_date__date=date
+        products_sold = ProductSalesHistory.objects.filter(
+            date=date,
+            quantity_sold__gt=0
         ).values(
             'product__name',
-            'product__sku'
-        ).annotate(
-            quantity_sold=Sum('quantity'),
-            revenue=Sum(F('unit_price') * F('quantity'))
+            'product__sku',
+            'quantity_sold',
+            'revenue'
         ).order_by('-quantity_sold')
 
         return [
@@ -806,19 +901,13 @@ class SalesSummaryView(generics.GenericAPIView):
 
     def _get_today_summary(self):
         """Get comprehensive today's business summary"""
-        today = timezone.now().date()
+        today = timezone.localdate()
 
-        # Today's sales summary
-        today_sales = self._get_today_sales()
-
-        # Today's transactions count
-        from sales.models import Sale
-        today_transactions = Sale.objects.filter(
-            sale_date__date=today
-        ).count()
-
-        # Today's profit (estimated)
-        today_profit = float(today_sales) * 0.20  # 20% estimated profit margin
+        # Today's sales, transactions and profit from the daily rollup
+        report = SalesReport.objects.filter(date=today).first() or SalesReport(date=today)
+        today_sales = report.total_sales
+        today_transactions = report.transaction_count
+        today_profit = report.gross_profit
 
         # Products sold today
         products_today = self._get_products_sold_today(today)
@@ -830,8 +919,9 @@ class SalesSummaryView(generics.GenericAPIView):
 
         # Today's stock movements
         from inventory.models import StockMovement
+        start, end = day_bounds(today)
         stock_received_today = StockMovement.objects.filter(
-            created_at__date=today,
+            created_at__gte=start, created_at__lt=end,
             movement_type='in'
         ).aggregate(total=Sum('quantity'))['total'] or 0
 
@@ -870,70 +960,26 @@ class SalesSummaryView(generics.GenericAPIView):
         ]
 
     def _get_sales_data_for_range(self, date_from, date_to):
-        """Get sales data for the specified date range (for reports)"""
-        from sales.models import Sale, SaleItem
-        from payments.models import Payment
-
-        sales = Sale.objects.filter(
-            sale_date__date__range=[date_from, date_to],
-            voided=False
-        ).annotate(
-            date=TruncDate('sale_date')
-        ).values('date').annotate(
-            total_sales=Sum('final_amount'),
-            transaction_count=Count('id')
+        """Get sales data for the specified date range (for reports) from the daily rollups"""
+        reports = SalesReport.objects.filter(
+            date__range=[date_from, date_to],
+            transaction_count__gt=0
         ).order_by('date')
 
-        # Get payment method breakdown per day
-        payments_per_day = Payment.objects.filter(
-            sale__sale_date__date__range=[date_from, date_to],
-            sale__voided=False,
-            status='completed'
-        ).annotate(
-            date=TruncDate('sale__sale_date')
-        ).values('date', 'payment_type').annotate(
-            amount=Sum('amount')
-        ).order_by('date')
-
-        # Group payments by date
-        payments_by_date = {}
-        for payment in payments_per_day:
-            date_key = payment['date'].strftime('%Y-%m-%d')
-            if date_key not in payments_by_date:
-                payments_by_date[date_key] = {}
-            payments_by_date[date_key][payment['payment_type']] = float(payment['amount'])
-
         result = []
-        for sale in sales:
-            date_str = sale['date'].strftime('%Y-%m-%d')
-            day_payments = payments_by_date.get(date_str, {})
-            # Calculate actual gross profit for the day
-            sales_items_for_day = SaleItem.objects.filter(
-                sale__sale_date__date=sale['date'],
-                sale__voided=False
-            ).select_related('product')
-
-            day_gross_profit = 0
-            day_cost_of_goods_sold = 0
-            for item in sales_items_for_day:
-                if item.product and item.product.cost_price:
-                    profit_per_item = (item.unit_price - item.product.cost_price) * item.quantity
-                    day_gross_profit += float(profit_per_item)
-                    day_cost_of_goods_sold += float(item.product.cost_price * item.quantity)
-
-            # Net profit (estimated as gross profit minus 5% operating costs)
-            day_net_profit = day_gross_profit * 0.95
-
+        for report in reports:
+            day_gross_profit = float(report.gross_profit)
             result.append({
-                'date': date_str,
-                'total_sales': float(sale['total_sales']),
-                'cash_sales': float(day_payments.get('cash', 0)),
-                'card_sales': float(day_payments.get('card', 0)),
-                'mobile_sales': float(day_payments.get('mpesa', 0)),
-                'transactions': sale['transaction_count'],
+                'date': report.date.strftime('%Y-%m-%d'),
+                'total_sales': float(report.total_sales),
+                'cash_sales': float(report.cash_sales),
+                'card_sales': float(report.card_sales),
+                'mobile_sales': float(report.mpesa_sales),
+                'transactions': report.transaction_count,
                 'gross_profit': day_gross_profit,
-                'net_profit': day_net_profit,
-                'cost_of_goods_sold': day_cost_of_goods_sold
+                # Net profit (estimated as gross profit minus 5% operating costs)
+                'net_profit': day_gross_profit * 0.95,
+                'cost_of_goods_sold': float(report.cost_of_goods_sold)
             })
 
         return result
@@ -946,244 +992,21 @@ class ProductPriceListPDFView(generics.GenericAPIView):
         price_type = request.query_params.get('price_type', 'both')
 
         # Validate price_type
-        if price_type not in ['retail', 'wholesale', 'both']:
+        if price_type not in pricelist.PRICE_TYPES:
             return Response({'error': 'Invalid price_type. Must be retail, wholesale, or both'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get all active products with categories, ordered by category then name
-        products = Product.objects.filter(is_active=True).select_related('category').order_by('category__name', 'name')
-
-        # Group products by category
-        from collections import defaultdict
-        products_by_category = defaultdict(list)
-
-        for product in products:
-            category_name = product.category.name if product.category else 'Uncategorized'
-            products_by_category[category_name].append(product)
-
-        # Create PDF buffer
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=30, rightMargin=30, topMargin=20, bottomMargin=30)
-        elements = []
-
-        # Styles
-        styles = getSampleStyleSheet()
-
-        # Company Header Styles
-        company_name_style = ParagraphStyle(
-            'CompanyName',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=5,
-            alignment=1,
-            textColor=colors.HexColor('#2c3e50'),
-            fontName='Helvetica-Bold'
-        )
-
-        receipt_style = ParagraphStyle(
-            'ReceiptStyle',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=5,
-            alignment=1,
-            textColor=colors.HexColor('#e74c3c'),
-            fontName='Helvetica-Bold'
-        )
-
-        business_info_style = ParagraphStyle(
-            'BusinessInfo',
-            parent=styles['Normal'],
-            fontSize=12,
-            alignment=1,
-            textColor=colors.HexColor('#34495e'),
-            fontName='Helvetica-Bold'
-        )
-
-        contact_style = ParagraphStyle(
-            'ContactStyle',
-            parent=styles['Normal'],
-            fontSize=10,
-            alignment=1,
-            textColor=colors.HexColor('#7f8c8d')
-        )
-
-        # Company Header - Keep logo only
         try:
-            # Try to load logo from staticfiles directory
-            logo_path = os.path.join(settings.BASE_DIR, 'staticfiles', 'images', 'logo.png')
-            if os.path.exists(logo_path):
-                logo = Image(logo_path, width=60, height=60)
-                logo.hAlign = 'CENTER'
-                elements.append(logo)
-                elements.append(Spacer(1, 10))
-        except Exception as e:
-            print(f"Logo loading error: {e}")
-            pass  # Logo not found, continue without it
-
-        # Company information - Removed as requested
-        # elements.append(Paragraph("MWAMBA", company_name_style))
-        # elements.append(Paragraph("RECEIPT", receipt_style))
-        # elements.append(Paragraph("MWAMBA LIQUOR STORES", business_info_style))
-        # elements.append(Paragraph("RONGO", business_info_style))
-        # elements.append(Spacer(1, 5))
-        # elements.append(Paragraph("Tel: +254 745 119 135", contact_style))
-        # elements.append(Paragraph("Paybill: 522533", contact_style))
-        # elements.append(Paragraph("Account: 8015580", contact_style))
-
-        elements.append(Spacer(1, 20))
-
-        # Document title
-        title_style = ParagraphStyle(
-            'DocumentTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=15,
-            alignment=1,
-            textColor=colors.HexColor('#2c3e50'),
-            fontName='Helvetica-Bold'
-        )
-        elements.append(Paragraph("PRODUCT PRICE LIST", title_style))
-
-        # Date and summary
-        date_style = ParagraphStyle(
-            'DateStyle',
-            parent=styles['Normal'],
-            fontSize=9,
-            spaceAfter=20,
-            alignment=1,
-            textColor=colors.HexColor('#7f8c8d')
-        )
-        total_products = products.count()
-        total_categories = len(products_by_category)
-        summary_text = f"Generated on: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')} | Total Products: {total_products} | Categories: {total_categories}"
-        elements.append(Paragraph(summary_text, date_style))
-
-        # Prepare comprehensive table data (Excel-like)
-        table_data = []
-
-        # Header row
-        header_row = ['Category', 'Product Name', 'SKU']
-        if price_type in ['retail', 'both']:
-            header_row.append('Retail Price')
-        if price_type in ['wholesale', 'both']:
-            header_row.append('Wholesale Price')
-        table_data.append(header_row)
-
-        # Add data rows grouped by category
-        current_category = None
-        for category_name, category_products in sorted(products_by_category.items()):
-            # Add category separator row (merged cells)
-            if current_category is not None:
-                # Add empty row for spacing
-                empty_row = [''] * len(header_row)
-                table_data.append(empty_row)
-
-            # Add category header row
-            category_header = [f'CATEGORY: {category_name.upper()}'] + [''] * (len(header_row) - 1)
-            table_data.append(category_header)
-
-            # Add product rows for this category
-            for product in category_products:
-                row = [
-                    '',  # Empty category column for products
-                    product.name,
-                    product.sku or 'N/A'
-                ]
+            pdf_file = pricelist.open_price_list(price_type, timeout=PRICE_LIST_RENDER_TIMEOUT)
+        except FutureTimeout:
+            response = Response(
+                {'error': 'The price list is still being generated, please try again shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = '5'
+            return response
 
-                if price_type in ['retail', 'both']:
-                    row.append(f"Ksh {product.selling_price:.2f}" if product.selling_price else 'N/A')
-                if price_type in ['wholesale', 'both']:
-                    row.append(f"Ksh {product.wholesale_price:.2f}" if product.wholesale_price else 'N/A')
-
-                table_data.append(row)
-
-            current_category = category_name
-
-        # Create the comprehensive table
-        table = Table(table_data, colWidths=[70, 130, 130] + ([70] * (len(header_row) - 3)))
-
-        # Table style - Excel-like
-        table_style = TableStyle([
-            # Header styling
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#34495e')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('TOPPADDING', (0, 0), (-1, 0), 8),
-
-            # Category header rows
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#ecf0f1')),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor('#2c3e50')),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
-            ('SPAN', (0, 1), (-1, 1)),  # Merge category header cells
-
-            # Data rows
-            ('FONTNAME', (0, 2), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 2), (-1, -1), 8),
-            ('ALIGN', (0, 2), (-1, -1), 'LEFT'),
-            ('ALIGN', (3, 2), (-1, -1), 'RIGHT'),  # Right align price columns
-
-            # Grid lines
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#bdc3c7')),
-
-            # Alternating row colors for data
-            ('BACKGROUND', (0, 3), (-1, 3), colors.HexColor('#f8f9fa')),
-            ('BACKGROUND', (0, 5), (-1, 5), colors.HexColor('#f8f9fa')),
-        ])
-
-        # Apply alternating colors for all data rows
-        row_idx = 2  # Start after header and first category
-        while row_idx < len(table_data):
-            if table_data[row_idx][0] == '':  # Data row (not category header)
-                if (row_idx - 2) % 2 == 1:  # Alternate starting from row 3
-                    table_style.add('BACKGROUND', (0, row_idx), (-1, row_idx), colors.HexColor('#f8f9fa'))
-            row_idx += 1
-
-        # Special styling for category headers
-        category_rows = []
-        for i, row in enumerate(table_data):
-            if len(row) > 0 and str(row[0]).startswith('CATEGORY:'):
-                category_rows.append(i)
-
-        for row_idx in category_rows:
-            table_style.add('BACKGROUND', (0, row_idx), (-1, row_idx), colors.HexColor('#95a5a6'))
-            table_style.add('TEXTCOLOR', (0, row_idx), (-1, row_idx), colors.white)
-            table_style.add('FONTNAME', (0, row_idx), (-1, row_idx), 'Helvetica-Bold')
-            table_style.add('FONTSIZE', (0, row_idx), (-1, row_idx), 9)
-
-        table.setStyle(table_style)
-
-        # Add table to elements
-        elements.append(table)
-
-        # Footer - Removed as requested
-        # footer_style = ParagraphStyle(
-        #     'FooterStyle',
-        #     parent=styles['Normal'],
-        #     fontSize=8,
-        #     spaceBefore=15,
-        #     alignment=1,
-        #     textColor=colors.HexColor('#95a5a6')
-        # )
-        # footer_text = "Thank you for your business | MWAMBA LIQUOR STORES"
-        # elements.append(Paragraph(footer_text, footer_style))
-
-        # Build PDF
-        doc.build(elements)
-
-        # Get PDF data
-        pdf_data = buffer.getvalue()
-        buffer.close()
-
-        # Create response
-        response = HttpResponse(pdf_data, content_type='application/pdf')
         filename = f"product_price_list_{price_type}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-        return response
+        return FileResponse(pdf_file, as_attachment=True, filename=filename, content_type='application/pdf')
 
     def _get_today_all_sales(self, date):
         """Get all sales data for today"""
@@ -1191,9 +1014,11 @@ class ProductPriceListPDFView(generics.GenericAPIView):
         from payments.models import Payment
         from inventory.models import SalesHistory
 
+        start, end = day_bounds(date)
+
         # Get all sales for today (exclude voided sales)
         sales = Sale.objects.filter(
-            sale_date__date=date,
+            sale_date__gte=start, sale_date__lt=end,
             voided=False
         ).annotate(
             date=TruncDate('sale_date')
@@ -1204,7 +1029,7 @@ class ProductPriceListPDFView(generics.GenericAPIView):
 
         # Get payment method breakdown for today
         payments = Payment.objects.filter(
-            sale__sale_date__date=date,
+            sale__sale_date__gte=start, sale__sale_date__lt=end,
             sale__voided=False,
             status='completed'
         ).select_related('sale')
@@ -1227,7 +1052,7 @@ class ProductPriceListPDFView(generics.GenericAPIView):
         # Calculate actual gross profit for today
         # Gross profit = sum((selling_price - cost_price) * quantity) for all items sold today
         sales_items = SaleItem.objects.filter(
-            sale__sale_date__date=date,
+            sale__sale_date__gte=start, sale__sale_date__lt=end,
             sale__voided=False
         ).select_related('product')
 
@@ -1249,7 +1074,7 @@ class ProductPriceListPDFView(generics.GenericAPIView):
 
         # Get all sales for today with payment info (exclude voided)
         all_sales = Sale.objects.filter(
-            sale_date__date=date,
+            sale_date__gte=start, sale_date__lt=end,
             voided=False
         ).select_related('customer').prefetch_related('payment_set', 'saleitem_set__product').order_by('-sale_date')
 
@@ -1293,10 +1118,13 @@ class ProductPriceListPDFView(generics.GenericAPIView):
         from sales.models import SaleItem, Sale
         from django.db.models import Sum, Case, When, DecimalField
 
+        start, _ = day_bounds(date_from)
+        _, end = day_bounds(date_to)
+
         # Get all products sold in the date range with their performance metrics
         # Separate retail and wholesale sales (exclude voided sales)
         product_performance = SaleItem.objects.filter(
-            sale__sale_date__date__range=[date_from, date_to],
+            sale__sale_date__gte=start, sale__sale_date__lt=end,
             sale__voided=False
         ).select_related('product', 'sale').values(
             'product__name',
@@ -1434,6 +1262,7 @@ class ProductPriceListPDFView(generics.GenericAPIView):
 class InventorySummaryView(generics.GenericAPIView):
     """Get inventory summary for dashboard and reports"""
 
+    @cached_report(versions.STOCK, versions.CATALOGUE)
     def get(self, request):
         # Check if detailed report data is requested
         if request.query_params.get('report') == 'detailed':
@@ -1516,45 +1345,12 @@ class InventorySummaryView(generics.GenericAPIView):
 
     def _get_inventory_report_data(self, date=None):
         """Get detailed inventory data for reports"""
-        from inventory.models import Product, StockMovement
-        from sales.models import SaleItem
-        from django.db.models import Sum
-
-        products = Product.objects.all().select_related('category')
-
-        # Default to today if no date provided
-        if date is None:
-            date = timezone.now().date()
-
-        result = []
-        for product in products:
-            # Calculate stock sold today
-            sold_today = SaleItem.objects.filter(
-                product=product,
-                sale__sale_date__date=date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            # Calculate stock received today
-            received_today = StockMovement.objects.filter(
-                product=product,
-                movement_type='in',
-                created_at__date=date
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            result.append({
-                'product': product.name,
-                'category': product.category.name if product.category else 'Uncategorized',
-                'stock_level': product.stock_quantity,
-                'sold_today': sold_today,
-                'received_today': received_today,
-                'value': float(product.stock_quantity * product.selling_price),
-            })
-
-        return result
+        return inventory_rows(date, price_field='selling_price')
 
 class CustomerSummaryView(generics.GenericAPIView):
     """Get customer summary for dashboard and reports"""
 
+    @cached_report(versions.CUSTOMER, versions.SALES)
     def get(self, request):
         # Check if detailed report data is requested
         if request.query_params.get('report') == 'detailed':
@@ -1568,13 +1364,14 @@ class CustomerSummaryView(generics.GenericAPIView):
 
             total_customers = Customer.objects.count()
             # Count customers who have made purchases in the last 30 days
-            thirty_days_ago = timezone.now().date() - timedelta(days=30)
+            today_start, today_end = day_bounds(timezone.localdate())
+            thirty_days_ago = today_start - timedelta(days=30)
             active_customers = Customer.objects.filter(
-                sale__sale_date__date__gte=thirty_days_ago
+                sale__sale_date__gte=thirty_days_ago
             ).distinct().count()
 
             new_customers_today = Customer.objects.filter(
-                created_at__date=timezone.now().date()
+                created_at__gte=today_start, created_at__lt=today_end
             ).count()
 
             # Top customers by purchase value
@@ -1602,33 +1399,12 @@ class CustomerSummaryView(generics.GenericAPIView):
 
     def _get_customer_report_data(self):
         """Get detailed customer data for reports"""
-        from customers.models import Customer
-        from sales.models import Sale
-
-        customers = Customer.objects.all()
-
-        result = []
-        for customer in customers:
-            customer_sales = Sale.objects.filter(customer=customer)
-            total_purchases = customer_sales.aggregate(total=Sum('final_amount'))['total'] or 0
-            order_count = customer_sales.count()
-
-            last_purchase = customer_sales.order_by('-sale_date').first()
-            last_purchase_date = last_purchase.sale_date if last_purchase else None
-
-            result.append({
-                'name': customer.name,
-                'phone': customer.phone,
-                'total_purchases': float(total_purchases),
-                'last_visit': last_purchase_date.strftime('%Y-%m-%d') if last_purchase_date else None,
-                'loyalty_points': customer.loyalty_points,
-            })
-
-        return sorted(result, key=lambda x: x['total_purchases'], reverse=True)
+        return customer_rows()
 
 class ShiftSummaryView(generics.GenericAPIView):
     """Get shift summary for dashboard and reports"""
 
+    @cached_report(versions.SHIFT)
     def get(self, request):
         # Check if detailed report data is requested
         if request.query_params.get('report') == 'detailed':
@@ -1641,181 +1417,14 @@ class ShiftSummaryView(generics.GenericAPIView):
 
             active_shifts = Shift.objects.filter(status='open').count()
 
-    def _get_detailed_transactions_for_date(self, date):
-        """Get detailed transactions and items sold for a specific date"""
-        from sales.models import Sale, SaleItem
-        from payments.models import Payment
-
-        # Get all non-voided sales for the date
-        sales = Sale.objects.filter(
-            sale_date__date=date,
-            voided=False
-        ).select_related('customer').prefetch_related('saleitem_set', 'payment_set').order_by('-sale_date')
-
-        result = []
-        for sale in sales:
-            # Get payment info
-            payments = sale.payment_set.filter(status='completed')
-            payment_info = []
-            for payment in payments:
-                payment_info.append({
-                    'payment_type': payment.payment_type,
-                    'amount': float(payment.amount),
-                    'reference_number': payment.reference_number,
-                    'created_at': payment.created_at.isoformat()
-                })
-
-            # Get sale items
-            items = []
-            for item in sale.saleitem_set.all():
-                items.append({
-                    'product_name': item.product.name,
-                    'product_sku': item.product.sku,
-                    'quantity': item.quantity,
-                    'unit_price': float(item.unit_price),
-                    'discount': float(item.discount),
-                    'total_price': float(item.unit_price * item.quantity - item.discount)
-                })
-
-            result.append({
-                'transaction_id': sale.id,
-                'receipt_number': sale.receipt_number,
-                'sale_date': sale.sale_date.isoformat(),
-                'customer': sale.customer.name if sale.customer else 'Walk-in',
-                'sale_type': sale.sale_type,
-                'total_amount': float(sale.final_amount),
-                'tax_amount': float(sale.tax_amount),
-                'discount_amount': float(sale.discount_amount),
-                'final_amount': float(sale.final_amount),
-                'payments': payment_info,
-                'items': items
-            })
-
-        return result
-
-    def _get_detailed_transactions_for_range(self, date_from, date_to):
-        """Get detailed transactions and items sold for a date range"""
-        from sales.models import Sale, SaleItem
-        from payments.models import Payment
-
-        # Get all non-voided sales for the date range
-        sales = Sale.objects.filter(
-            sale_date__date__range=[date_from, date_to],
-            voided=False
-        ).select_related('customer').prefetch_related('saleitem_set', 'payment_set').order_by('-sale_date')
-
-        result = []
-        for sale in sales:
-            # Get payment info
-            payments = sale.payment_set.filter(status='completed')
-            payment_info = []
-            for payment in payments:
-                payment_info.append({
-                    'payment_type': payment.payment_type,
-                    'amount': float(payment.amount),
-                    'reference_number': payment.reference_number,
-                    'created_at': payment.created_at.isoformat()
-                })
-
-            # Get sale items
-            items = []
-            for item in sale.saleitem_set.all():
-                items.append({
-                    'product_name': item.product.name,
-                    'product_sku': item.product.sku,
-                    'quantity': item.quantity,
-                    'unit_price': float(item.unit_price),
-                    'discount': float(item.discount),
-                    'total_price': float(item.unit_price * item.quantity - item.discount)
-                })
-
-            result.append({
-                'transaction_id': sale.id,
-                'receipt_number': sale.receipt_number,
-                'sale_date': sale.sale_date.isoformat(),
-                'customer': sale.customer.name if sale.customer else 'Walk-in',
-                'sale_type': sale.sale_type,
-                'total_amount': float(sale.final_amount),
-                'tax_amount': float(sale.tax_amount),
-                'discount_amount': float(sale.discount_amount),
-                'final_amount': float(sale.final_amount),
-                'payments': payment_info,
-                'items': items
-            })
-
-        return result
-
-    def _get_detailed_transactions_for_shift(self, shift_id):
-        """Get detailed transactions and items sold for a specific shift"""
-        from sales.models import Sale, SaleItem
-        from payments.models import Payment
-
-        # Get all non-voided sales for the shift
-        sales = Sale.objects.filter(
-            shift_id=shift_id,
-            voided=False
-        ).select_related('customer').prefetch_related('saleitem_set', 'payment_set').order_by('-sale_date')
-
-        result = []
-        for sale in sales:
-            # Get payment info
-            payments = sale.payment_set.filter(status='completed')
-            payment_info = []
-            for payment in payments:
-                payment_info.append({
-                    'payment_type': payment.payment_type,
-                    'amount': float(payment.amount),
-                    'reference_number': payment.reference_number,
-                    'created_at': payment.created_at.isoformat()
-                })
-
-            # Get sale items
-            items = []
-            for item in sale.saleitem_set.all():
-                items.append({
-                    'product_name': item.product.name,
-                    'product_sku': item.product.sku,
-                    'quantity': item.quantity,
-                    'unit_price': float(item.unit_price),
-                    'discount': float(item.discount),
-                    'total_price': float(item.unit_price * item.quantity - item.discount)
-                })
-
-            result.append({
-                'transaction_id': sale.id,
-                'receipt_number': sale.receipt_number,
-                'sale_date': sale.sale_date.isoformat(),
-                'customer': sale.customer.name if sale.customer else 'Walk-in',
-                'sale_type': sale.sale_type,
-                'total_amount': float(sale.final_amount),
-                'tax_amount': float(sale.tax_amount),
-                'discount_amount': float(sale.discount_amount),
-                'final_amount': float(sale.final_amount),
-                'payments': payment_info,
-                'items': items
-            })
-
-        return result
-
-    def get(self, request):
-        # Check if detailed report data is requested
-        if request.query_params.get('report') == 'detailed':
-            # Return detailed shift report data
-            shift_data = self._get_shift_report_data()
-            return Response(shift_data)
-        else:
-            # Return dashboard summary data
-            from shifts.models import Shift
-
-            active_shifts = Shift.objects.filter(status='open').count()
-
+            today_start, today_end = day_bounds(timezone.localdate())
             completed_shifts_today = Shift.objects.filter(
-                end_time__date=timezone.now().date(),
+                end_time__gte=today_start, end_time__lt=today_end,
                 status='closed'
             ).count()
 
             total_shift_sales = Shift.objects.filter(
-                end_time__date=timezone.now().date(),
+                end_time__gte=today_start, end_time__lt=today_end,
                 status='closed'
             ).aggregate(total=Sum('total_sales'))['total'] or 0
 
@@ -1830,98 +1439,6 @@ class ShiftSummaryView(generics.GenericAPIView):
 
         return result
 
-    def _get_sale_chit_details(self, sale_id):
-        """Get detailed chit information for a specific sale"""
-        from sales.models import Sale, SaleItem
-        from payments.models import Payment
-
-        try:
-            # Get the sale with related data
-            sale = Sale.objects.select_related('customer', 'shift__cashier__user').prefetch_related(
-                'saleitem_set__product', 'payment_set'
-            ).get(id=sale_id, voided=False)
-
-            # Get sale items with product details
-            items = []
-            for item in sale.saleitem_set.all():
-                items.append({
-                    'id': item.id,
-                    'product_name': item.product.name,
-                    'product_sku': item.product.sku,
-                    'category': item.product.category.name if item.product.category else 'Uncategorized',
-                    'quantity': item.quantity,
-                    'unit_price': float(item.unit_price),
-                    'discount': float(item.discount),
-                    'line_total': float((item.unit_price * item.quantity) - item.discount),
-                    'cost_price': float(item.product.cost_price) if item.product.cost_price else 0,
-                    'profit': float(((item.unit_price - item.product.cost_price) * item.quantity) - item.discount) if item.product.cost_price else 0
-                })
-
-            # Get payment details
-            payments = []
-            payment_breakdown = {}
-            for payment in sale.payment_set.filter(status='completed'):
-                payments.append({
-                    'id': payment.id,
-                    'payment_type': payment.payment_type,
-                    'amount': float(payment.amount),
-                    'reference_number': payment.reference_number,
-                    'created_at': payment.created_at.isoformat(),
-                    'status': payment.status
-                })
-                # Aggregate payment amounts by type
-                payment_breakdown[payment.payment_type] = payment_breakdown.get(payment.payment_type, 0) + float(payment.amount)
-
-            # Calculate totals
-            subtotal = sum(item['line_total'] for item in items)
-            total_discount = sum(item['discount'] * item['quantity'] for item in items)
-            total_cost = sum(item['cost_price'] * item['quantity'] for item in items)
-            total_profit = sum(item['profit'] for item in items)
-
-            chit_data = {
-                'sale_id': sale.id,
-                'receipt_number': sale.receipt_number,
-                'sale_date': sale.sale_date.isoformat(),
-                'sale_type': sale.sale_type,
-                'customer': {
-                    'id': sale.customer.id if sale.customer else None,
-                    'name': sale.customer.name if sale.customer else 'Walk-in',
-                    'phone': sale.customer.phone if sale.customer else None
-                },
-                'cashier': {
-                    'id': sale.shift.cashier.id if sale.shift and sale.shift.cashier else None,
-                    'name': sale.shift.cashier.user.get_full_name() if sale.shift and sale.shift.cashier else 'Unknown',
-                    'username': sale.shift.cashier.user.username if sale.shift and sale.shift.cashier else 'Unknown'
-                } if sale.shift else None,
-                'shift': {
-                    'id': sale.shift.id if sale.shift else None,
-                    'start_time': sale.shift.start_time.isoformat() if sale.shift else None,
-                    'status': sale.shift.status if sale.shift else None
-                } if sale.shift else None,
-                'items': items,
-                'payments': payments,
-                'payment_breakdown': payment_breakdown,
-                'summary': {
-                    'item_count': len(items),
-                    'total_quantity': sum(item['quantity'] for item in items),
-                    'subtotal': subtotal,
-                    'tax_amount': float(sale.tax_amount),
-                    'discount_amount': float(sale.discount_amount),
-                    'final_amount': float(sale.final_amount),
-                    'total_cost': total_cost,
-                    'total_profit': total_profit,
-                    'profit_margin': (total_profit / subtotal * 100) if subtotal > 0 else 0
-                },
-                'status': 'completed',
-                'voided': sale.voided
-            }
-
-            return chit_data
-
-        except Sale.DoesNotExist:
-            return {'error': 'Sale not found or has been voided'}
-        except Exception as e:
-            return {'error': f'Error retrieving chit details: {str(e)}'}
     def _get_shift_report_data(self):
         """Get detailed shift data for reports"""
         from shifts.models import Shift
@@ -0,0 +1,289 @@
+"""
+Set-based checkout pipeline for POS sales.
+
+A sale is planned completely in memory first: products and candidate batches
+are loaded with one query each, FIFO allocations (see
+``inventory.allocation``) and payments are worked out in Python, and
+everything is validated before anything is written. The plan is then written
+with ``bulk_create`` and grouped ``F()`` updates, so the number of queries per
+sale stays fixed no matter how many lines the cart has. The day's sales
+rollups (``reports.rollups``) are updated in the same transaction.
+"""
+
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from inventory.allocation import StockAllocation, StockAllocationError
+from inventory.models import Product, StockMovement, SalesHistory
+from payments.models import Payment
+from reports.rollups import record_sale
+from shifts.models import Shift
+from .models import CartItem, Sale, SaleItem
+from .numbering import RECEIPT, next_number
+
+VALID_PAYMENT_METHODS = ['cash', 'mpesa', 'mobile', 'split']
+
+
+class CheckoutError(Exception):
+    """A problem with the submitted sale that is reported back to the till as-is."""
+
+
+def _to_decimal(value):
+    return Decimal(str(value))
+
+
+def _payment_amount(value, label):
+    """A split payment amount as a Decimal; tills may send numbers or strings"""
+    try:
+        amount = _to_decimal(value)
+    except ArithmeticError:
+        amount = None
+    if amount is None or not amount.is_finite() or amount < 0:
+        raise CheckoutError(f'Invalid {label} amount in split_data: {value!r}')
+    return amount
+
+
+def build_cart_items(items_data):
+    """Build unsaved CartItem rows from the frontend cart payload"""
+    cart_items = []
+    for item_data in items_data:
+        try:
+            cart_items.append(CartItem(
+                product_id=int(item_data.get('product')),
+                quantity=int(item_data.get('quantity', 1)),
+                unit_price=_to_decimal(item_data.get('unit_price', 0)),
+                discount=_to_decimal(item_data.get('discount', 0))
+            ))
+        except (TypeError, ValueError, ArithmeticError) as item_error:
+            raise CheckoutError(
+                f'Error creating cart item for product {item_data.get("product")}: {str(item_error)}'
+            )
+    return cart_items
+
+
+def attach_products(cart_items):
+    """Load every product referenced by the cart in a single query"""
+    products = Product.objects.in_bulk({item.product_id for item in cart_items})
+    for item in cart_items:
+        product = products.get(item.product_id)
+        if product is None:
+            raise CheckoutError(f'Error creating cart item for product {item.product_id}: product not found')
+        item.product = product
+    return cart_items
+
+
+def validate_stock(cart_items):
+    """Check quantities and on-hand stock for the whole cart before any writes"""
+    requested = {}
+    for item in cart_items:
+        if int(item.quantity) <= 0:
+            raise CheckoutError(f'Invalid quantity for product "{item.product.name}". Quantity must be positive.')
+        requested[item.product_id] = requested.get(item.product_id, 0) + int(item.quantity)
+
+    for item in cart_items:
+        product = item.product
+        if product.stock_quantity < requested[product.id]:
+            raise CheckoutError(
+                f'Insufficient stock for product "{product.name}". '
+                f'Available: {product.stock_quantity}, Requested: {requested[product.id]}'
+            )
+
+
+def apply_stock_deductions(sale, cart_items, allocation, cashier):
+    """Write the allocation plus one bulk INSERT each for movements and sales history"""
+    allocation.apply()
+
+    movements = []
+    history = []
+    for item, parts in zip(cart_items, allocation.parts):
+        product = item.product
+        for batch, quantity in parts:
+            if batch is not None:
+                reason = f'Sale {sale.receipt_number} - Batch {batch.batch_number}'
+            else:
+                reason = f'Sale {sale.receipt_number} - No batch tracking'
+
+            movements.append(StockMovement(
+                product=product,
+                movement_type='out',
+                quantity=-quantity,
+                reason=reason,
+                user=cashier
+            ))
+
+            record = SalesHistory(
+                product=product,
+                batch=batch,
+                customer=sale.customer,
+                quantity=quantity,
+                unit_price=item.unit_price,
+                cost_price=batch.cost_price if batch is not None else None,
+                total_price=_to_decimal(item.unit_price) * quantity,
+                receipt_number=sale.receipt_number,
+                sale_date=sale.sale_date
+            )
+            record.calculate_profit()
+            history.append(record)
+
+    StockMovement.objects.bulk_create(movements)
+    SalesHistory.objects.bulk_create(history)
+    return history
+
+
+def plan_payments(data, total_amount):
+    """
+    Validate the payment details and build the unsaved Payment rows.
+
+    Runs before the sale is written so a bad payment never leaves a sale
+    behind without its payment records.
+    """
+    payment_method = (data.get('payment_method') or '').strip().lower()
+    if not payment_method:
+        raise CheckoutError('Payment method is required for all transactions')
+
+    if payment_method not in VALID_PAYMENT_METHODS:
+        raise CheckoutError(f'Invalid payment method. Must be one of: {", ".join(VALID_PAYMENT_METHODS)}')
+
+    payments = []
+    if payment_method == 'split':
+        split_data = data.get('split_data') or {}
+        if not isinstance(split_data, dict):
+            raise CheckoutError('split_data must be an object with cash and/or mpesa amounts')
+        cash_amount = _payment_amount(split_data.get('cash') or 0, 'cash')
+        mpesa_amount = _payment_amount(split_data.get('mpesa') or 0, 'mpesa')
+        if cash_amount == 0 and mpesa_amount == 0:
+            raise ValueError('Split payment requires cash and/or mpesa amounts in split_data')
+
+        if cash_amount > 0:
+            payments.append(Payment(payment_type='cash', amount=cash_amount, status='completed'))
+        if mpesa_amount > 0:
+            payments.append(Payment(
+                payment_type='mpesa',
+                amount=mpesa_amount,
+                mpesa_number=data.get('mpesa_number', ''),
+                status='completed'
+            ))
+    else:
+        payment_type = 'mpesa' if payment_method in ['mpesa', 'mobile'] else 'cash'
+        payments.append(Payment(
+            payment_type=payment_type,
+            amount=total_amount,
+            mpesa_number=data.get('mpesa_number', '') if payment_type == 'mpesa' else '',
+            status='completed'
+        ))
+
+    # CRITICAL VALIDATION: Ensure at least one payment will be created
+    if not payments:
+        raise ValueError("No payment records were created for this transaction")
+
+    # Verify payment amounts total matches sale amount
+    total_payment_amount = sum(float(p.amount) for p in payments)
+    if abs(total_payment_amount - float(total_amount)) > 0.01:  # Allow small floating point differences
+        raise ValueError(f"Payment amount mismatch: payments total {total_payment_amount}, sale total {total_amount}")
+
+    return payments
+
+
+def update_shift_totals(shift, data, total_amount):
+    """Add the sale to the shift's running totals with a single F() UPDATE"""
+    payment_method = data.get('payment_method', 'cash').lower()
+    sale_amount = _to_decimal(total_amount)
+
+    totals = {'total_sales': F('total_sales') + sale_amount}
+    if payment_method == 'split':
+        split_data = data.get('split_data', {})
+        totals['cash_sales'] = F('cash_sales') + _to_decimal(split_data.get('cash') or 0)
+        totals['mobile_sales'] = F('mobile_sales') + _to_decimal(split_data.get('mpesa') or 0)
+    elif payment_method == 'cash':
+        totals['cash_sales'] = F('cash_sales') + sale_amount
+    elif payment_method in ['mpesa', 'mobile']:
+        totals['mobile_sales'] = F('mobile_sales') + sale_amount
+
+    Shift.objects.filter(pk=shift.pk).update(**totals)
+
+
+def receipt_number_for(data):
+    """
+    The till's own receipt number, or the next one from the counter.
+
+    Call before opening the sale's transaction (see ``sales.numbering``).
+    """
+    return data.get('receipt_number') or next_number(RECEIPT)
+
+
+def complete_sale(cart, cart_items, cashier, shift, data, receipt_number, customer=None, client_uuid=None,
+                  sale_date=None):
+    """
+    Turn a saved cart into a completed sale.
+
+    ``cart_items`` must already have their products attached (see
+    ``attach_products`` or ``select_related('product')``). Everything is
+    validated up front; the caller is expected to wrap this in
+    ``transaction.atomic()``, and to have taken ``receipt_number`` (see
+    ``receipt_number_for``) before doing so. ``client_uuid`` and
+    ``sale_date`` identify a sale queued on an offline till and when it was
+    rung up (see ``sales.sync``).
+    """
+    validate_stock(cart_items)
+
+    subtotal = sum(float(item.unit_price) * int(item.quantity) for item in cart_items)
+    tax_amount = float(data.get('tax_amount', 0))
+    discount_amount = float(data.get('discount_amount', 0))
+    total_amount = float(data.get('total_amount', subtotal + tax_amount - discount_amount))
+    payments = plan_payments(data, total_amount)
+
+    # Lock and allocate against current stock; the pre-checks above ran on
+    # unlocked reads and only give the till early feedback
+    try:
+        allocation = StockAllocation.allocate(
+            [(item.product_id, item.quantity) for item in cart_items]
+        )
+    except StockAllocationError as e:
+        raise CheckoutError(str(e))
+    for item in cart_items:
+        item.product = allocation.products[item.product_id]
+
+    sale = Sale(
+        cart=cart,
+        customer=customer,
+        shift=shift,
+        sale_type=data.get('sale_type', 'retail'),
+        total_amount=float(subtotal),
+        tax_amount=float(tax_amount),
+        discount_amount=float(discount_amount),
+        final_amount=float(total_amount),
+        receipt_number=receipt_number,
+        client_uuid=client_uuid,
+        sale_date=sale_date or timezone.now()
+    )
+    # Payments are written below; don't let the signal add a default one
+    sale._skip_default_payment = True
+    sale.save()
+
+    update_shift_totals(shift, data, total_amount)
+
+    SaleItem.objects.bulk_create([
+        SaleItem(
+            sale=sale,
+            product=item.product,
+            quantity=int(item.quantity),
+            unit_price=item.unit_price,
+            discount=item.discount
+        )
+        for item in cart_items
+    ])
+
+    try:
+        history = apply_stock_deductions(sale, cart_items, allocation, cashier)
+    except StockAllocationError as e:
+        raise CheckoutError(str(e))
+
+    for payment in payments:
+        payment.sale = sale
+    Payment.objects.bulk_create(payments)
+
+    record_sale(sale, history, payments)
+
+    return sale
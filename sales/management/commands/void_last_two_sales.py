@@ -36,7 +36,7 @@ class Command(BaseCommand):
                         # Restore product stock
                         from decimal import Decimal
                         product.stock_quantity = Decimal(str(product.stock_quantity)) + Decimal(str(quantity_to_restore))
-                        product.save(update_fields=['stock_quantity'])
+                        product.save(update_fields=['stock_quantity'], log_history=False)
 
                         # Create stock movement record
                         from inventory.models import StockMovement
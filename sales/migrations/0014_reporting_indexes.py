@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0005_remove_customer_branch_and_more'),
+        ('sales', '0013_remove_cart_branch_remove_invoice_branch_and_more'),
+        ('shifts', '0003_remove_shift_branch'),
+        ('users', '0002_alter_userprofile_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sale_date'], name='sales_sale_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(condition=models.Q(('voided', False)), fields=['sale_date'], name='sales_sale_live_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['shift', 'sale_date'], name='sales_sale_shift_date_idx'),
+        ),
+    ]
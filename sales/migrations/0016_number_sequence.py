@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('branches', '0002_initial'),
+        ('sales', '0015_sale_client_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(choices=[('receipt', 'Receipt'), ('invoice', 'Invoice')], max_length=20)),
+                ('day', models.DateField()),
+                ('last_value', models.PositiveIntegerField(default=0)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='branches.branch')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('series', 'branch', 'day'), name='sales_numseq_branch_day_uniq'), models.UniqueConstraint(condition=models.Q(('branch__isnull', True)), fields=('series', 'day'), name='sales_numseq_day_uniq')],
+            },
+        ),
+    ]
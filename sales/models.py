@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 # Create your models here.
 
@@ -44,15 +45,26 @@ class Sale(models.Model):
     tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     final_amount = models.DecimalField(max_digits=10, decimal_places=2)
-    sale_date = models.DateTimeField(auto_now_add=True)
+    # When the sale was rung up; earlier than when it was saved for sales synced from offline tills
+    sale_date = models.DateTimeField(default=timezone.now, editable=False)
     receipt_number = models.CharField(max_length=50, unique=True)
+    # Set by tills that queue sales offline (see sales.sync), so a re-sent sale is recognised
+    client_uuid = models.UUIDField(null=True, blank=True, unique=True, editable=False)
 
     # Void functionality
     voided = models.BooleanField(default=False)
     void_reason = models.TextField(blank=True, null=True)
     voided_at = models.DateTimeField(null=True, blank=True)
     voided_by = models.ForeignKey('users.UserProfile', on_delete=models.SET_NULL, null=True, blank=True, related_name='voided_sales')
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sale_date'], name='sales_sale_date_idx'),
+            # Most reports only look at sales that still count
+            models.Index(fields=['sale_date'], condition=models.Q(voided=False), name='sales_sale_live_date_idx'),
+            models.Index(fields=['shift', 'sale_date'], name='sales_sale_shift_date_idx'),
+        ]
+
     def __str__(self):
         return f"Sale {self.receipt_number}"
 
@@ -109,11 +121,17 @@ class Invoice(models.Model):
         return f"Invoice {self.invoice_number}"
 
     def save(self, *args, **kwargs):
-        if not self.invoice_number:
-            # Generate invoice number
-            from django.utils import timezone
-            self.invoice_number = f"INV{timezone.now().strftime('%Y%m%d')}{self.id or 1:04d}"
-        super().save(*args, **kwargs)
+        if self.invoice_number:
+            return super().save(*args, **kwargs)
+        from .numbering import INVOICE, next_number
+        # Number and row commit together, so a failed save leaves no gap
+        try:
+            with transaction.atomic():
+                self.invoice_number = next_number(INVOICE)
+                super().save(*args, **kwargs)
+        except Exception:
+            self.invoice_number = ''
+            raise
 
     @property
     def is_overdue(self):
@@ -143,3 +161,33 @@ class InvoiceItem(models.Model):
     @property
     def total(self):
         return self.subtotal + self.tax_amount - self.discount_amount
+
+
+class NumberSequence(models.Model):
+    """
+    Last number handed out in a document series, per branch and day.
+
+    Only ever moved forward through ``sales.numbering``; rows with no branch
+    hold the numbers of sales made outside a branch context.
+    """
+    SERIES_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('invoice', 'Invoice'),
+    ]
+
+    series = models.CharField(max_length=20, choices=SERIES_CHOICES)
+    branch = models.ForeignKey('branches.Branch', on_delete=models.CASCADE, null=True, blank=True)
+    day = models.DateField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['series', 'branch', 'day'], name='sales_numseq_branch_day_uniq'),
+            # NULLs never compare equal, so branchless counters need their own constraint
+            models.UniqueConstraint(
+                fields=['series', 'day'], condition=models.Q(branch__isnull=True), name='sales_numseq_day_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.series} {self.branch_id or '-'} {self.day}: {self.last_value}"
@@ -0,0 +1,74 @@
+"""
+Receipt and invoice numbers from per-branch, per-day counters.
+
+Numbers look like ``POS-20261017-00042`` (``POS-3-20261017-00042`` inside
+branch 3) and come from ``NumberSequence`` rows that are only ever moved with
+a single ``UPDATE ... SET last_value = last_value + n``, so concurrent tills
+are handed distinct numbers. The UPDATE locks the row until its transaction
+ends, so numbers are taken in a short transaction of their own, before the
+sale's transaction starts: every till in a branch shares the counter row,
+and holding it through a whole checkout would make them queue behind each
+other. A sale that then fails leaves a gap in the series.
+
+``allocate`` can also hand out a block of numbers at once, which tills
+reserve ahead of time to number sales they make while offline.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from branches.middleware import BranchContextMiddleware
+from .models import NumberSequence
+
+RECEIPT = 'receipt'
+INVOICE = 'invoice'
+
+# Prefix and zero-padded width of the counter, per series
+FORMATS = {
+    RECEIPT: ('POS-', 5),
+    INVOICE: ('INV-', 4),
+}
+
+
+def format_number(series, branch_id, day, value):
+    prefix, width = FORMATS[series]
+    branch_part = f'{branch_id}-' if branch_id else ''
+    return f'{prefix}{branch_part}{day:%Y%m%d}-{value:0{width}d}'
+
+
+def _advance(series, branch_id, day, count):
+    counters = NumberSequence.objects.filter(series=series, branch_id=branch_id, day=day)
+    if not counters.update(last_value=F('last_value') + count):
+        try:
+            # First number of the day; losing the race to another till is fine
+            with transaction.atomic():
+                NumberSequence.objects.create(series=series, branch_id=branch_id, day=day)
+        except IntegrityError:
+            pass
+        counters.update(last_value=F('last_value') + count)
+    return counters.values_list('last_value', flat=True).get()
+
+
+def allocate(series, count=1, branch=None, day=None):
+    """
+    Reserve ``count`` consecutive numbers and return them formatted, in order.
+
+    ``branch`` defaults to the current branch and ``day`` to today (local
+    time). Call outside the transaction that uses the numbers; inside it,
+    the counter row stays locked until that transaction ends.
+    """
+    if count < 1:
+        raise ValueError('count must be at least 1')
+    if branch is None:
+        branch = BranchContextMiddleware.get_current_branch()
+    branch_id = getattr(branch, 'pk', branch)
+    day = day or timezone.localdate()
+    with transaction.atomic():
+        last = _advance(series, branch_id, day, count)
+    return [format_number(series, branch_id, day, value) for value in range(last - count + 1, last + 1)]
+
+
+def next_number(series, branch=None, day=None):
+    """The next number in ``series`` (see ``allocate``)"""
+    return allocate(series, 1, branch, day)[0]
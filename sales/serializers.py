@@ -43,9 +43,25 @@ class SaleSerializer(serializers.ModelSerializer):
         except AttributeError:
             return None
 
+    def _payments(self, obj):
+        """
+        All of the sale's payments, in pk order, loaded at most once.
+
+        List and retrieve prefetch them for the whole page (see
+        SaleViewSet.get_queryset); everything below works from this list.
+        """
+        payments = getattr(obj, '_serializer_payments', None)
+        if payments is None:
+            payments = sorted(obj.payment_set.all(), key=lambda payment: payment.pk)
+            obj._serializer_payments = payments
+        return payments
+
+    def _completed_payments(self, obj):
+        return [payment for payment in self._payments(obj) if payment.status == 'completed']
+
     def get_payment_method(self, obj):
         # Determine payment method based on payment records
-        payments = list(obj.payment_set.filter(status='completed'))
+        payments = self._completed_payments(obj)
         if not payments:
             return 'cash'
 
@@ -69,7 +85,7 @@ class SaleSerializer(serializers.ModelSerializer):
 
     def get_split_data(self, obj):
         # For split payments, reconstruct split_data from payment records
-        payments = list(obj.payment_set.filter(status='completed'))
+        payments = self._completed_payments(obj)
         if len(payments) > 1:
             split_data = {}
             for payment in payments:
@@ -77,7 +93,7 @@ class SaleSerializer(serializers.ModelSerializer):
             return split_data
 
         # Fallback to old logic for legacy split payments
-        split_payment = obj.payment_set.filter(payment_type='split').first()
+        split_payment = next((payment for payment in self._payments(obj) if payment.payment_type == 'split'), None)
         if split_payment and split_payment.split_data:
             # Only return if it's truly split (both amounts > 0)
             split_data = {k: v for k, v in split_payment.split_data.items() if float(v) > 0}
@@ -0,0 +1,199 @@
+"""
+Bulk upload of sales queued by a till while it was offline.
+
+Every queued sale carries a UUID generated on the till. Sales are written
+through the normal checkout pipeline (``sales.checkout``), a chunk at a time:
+each chunk is one transaction, and each sale within it gets a savepoint, so
+one rejected sale doesn't take the rest of its chunk down with it. UUIDs that
+are already on file are reported as duplicates instead of being sold twice,
+which makes re-sending a whole batch after a dropped connection safe.
+
+Sales that come without a receipt number reserved by the till are numbered
+with one block per chunk, taken before the chunk's transaction starts (see
+``sales.numbering``).
+
+A sale may carry the ``sale_date`` it was rung up at, so it lands in that
+day's rollups and in the cashier's shift that was open at the time rather
+than the one open when the till reconnects. Dates more than
+``SYNC_MAX_AGE_DAYS`` old, or ahead of the server by more than
+``SYNC_CLOCK_SKEW``, are rejected.
+"""
+
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from customers.models import Customer
+from shifts.models import Shift
+from .checkout import CheckoutError, attach_products, build_cart_items, complete_sale
+from .models import Cart, CartItem, Sale
+from .numbering import RECEIPT, allocate
+
+logger = logging.getLogger(__name__)
+
+SYNC_CHUNK_SIZE = getattr(settings, 'SALES_SYNC_CHUNK_SIZE', 50)
+SYNC_MAX_SALES = getattr(settings, 'SALES_SYNC_MAX_SALES', 1000)
+SYNC_MAX_AGE_DAYS = getattr(settings, 'SALES_SYNC_MAX_AGE_DAYS', 7)
+# How far ahead of the server a till's clock may run; such dates are taken as now
+SYNC_CLOCK_SKEW = timedelta(minutes=5)
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+REJECTED = 'error'
+
+
+def _parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _parse_sale_date(value, now):
+    """The till's ``sale_date`` as an aware datetime, or None if it sent none"""
+    if not value:
+        return None
+    try:
+        sale_date = parse_datetime(str(value))
+    except ValueError:
+        sale_date = None
+    if sale_date is None:
+        raise CheckoutError('Invalid sale_date. Use an ISO 8601 date and time')
+    if timezone.is_naive(sale_date):
+        sale_date = timezone.make_aware(sale_date)
+    if sale_date < now - timedelta(days=SYNC_MAX_AGE_DAYS):
+        raise CheckoutError(f'sale_date is more than {SYNC_MAX_AGE_DAYS} days old')
+    if sale_date > now + SYNC_CLOCK_SKEW:
+        raise CheckoutError('sale_date is in the future')
+    return min(sale_date, now)
+
+
+def _cashier_shifts(cashier, now):
+    """The cashier's shifts that were open at some point in the sync window, latest first"""
+    return list(
+        Shift.objects.filter(cashier=cashier, start_time__lte=now).filter(
+            Q(end_time__isnull=True) | Q(end_time__gte=now - timedelta(days=SYNC_MAX_AGE_DAYS))
+        ).order_by('-start_time')
+    )
+
+
+def _shift_at(sale_date, shifts, default):
+    for shift in shifts:
+        if shift.start_time <= sale_date and (shift.end_time is None or sale_date <= shift.end_time):
+            return shift
+    return default
+
+
+def _result(client_uuid, outcome, sale=None, error=None):
+    result = {'client_uuid': str(client_uuid) if client_uuid else None, 'status': outcome}
+    if sale is not None:
+        result['sale_id'] = sale['id']
+        result['receipt_number'] = sale['receipt_number']
+    if error is not None:
+        result['error'] = error
+    return result
+
+
+def _existing_sales(client_uuids):
+    """``{client_uuid: {'id', 'receipt_number'}}`` for UUIDs already on file, in one query"""
+    rows = Sale.objects.filter(client_uuid__in=client_uuids).values('id', 'receipt_number', 'client_uuid')
+    return {row['client_uuid']: row for row in rows}
+
+
+def _sync_one(data, client_uuid, receipt_number, cashier, shift, customers, sale_date):
+    items_data = data.get('items') or []
+    if not items_data:
+        raise CheckoutError('No items provided')
+
+    customer = None
+    customer_id = data.get('customer')
+    if customer_id:
+        customer = customers.get(str(customer_id))
+        if customer is None:
+            raise CheckoutError('Customer not found or inactive')
+
+    cart_items = attach_products(build_cart_items(items_data))
+    cart = Cart.objects.create(cashier=cashier, customer=customer, status='closed')
+    for cart_item in cart_items:
+        cart_item.cart = cart
+    CartItem.objects.bulk_create(cart_items)
+    sale = complete_sale(
+        cart, cart_items, cashier, shift, data, receipt_number, customer=customer, client_uuid=client_uuid,
+        sale_date=sale_date
+    )
+    return {'id': sale.pk, 'receipt_number': sale.receipt_number}
+
+
+def sync_sales(sales_data, cashier, shift):
+    """
+    Write a batch of queued sales and return one result per sale, in order.
+
+    Each result has the sale's ``client_uuid`` and a ``status`` of
+    ``created`` or ``duplicate`` (with ``sale_id`` and ``receipt_number``),
+    or ``error`` (with an ``error`` message; nothing was written for it).
+    ``shift`` is used for sales without a ``sale_date``, or whose date falls
+    outside every shift of the cashier's.
+    """
+    now = timezone.now()
+    client_uuids = [_parse_uuid(data.get('client_uuid')) for data in sales_data]
+    shifts = _cashier_shifts(cashier, now) if any(data.get('sale_date') for data in sales_data) else []
+
+    customer_ids = {str(data['customer']) for data in sales_data if str(data.get('customer') or '').isdigit()}
+    customers = {}
+    if customer_ids:
+        customers = {
+            str(customer.pk): customer
+            for customer in Customer.objects.filter(pk__in=customer_ids, is_active=True)
+        }
+
+    results = []
+    for start in range(0, len(sales_data), SYNC_CHUNK_SIZE):
+        chunk = list(zip(sales_data[start:start + SYNC_CHUNK_SIZE], client_uuids[start:start + SYNC_CHUNK_SIZE]))
+        done = _existing_sales([client_uuid for _, client_uuid in chunk if client_uuid])
+        unnumbered = sum(
+            1 for data, client_uuid in chunk
+            if client_uuid and client_uuid not in done and not data.get('receipt_number')
+        )
+        numbers = iter(allocate(RECEIPT, unnumbered) if unnumbered else [])
+        with transaction.atomic():
+            for data, client_uuid in chunk:
+                if client_uuid is None:
+                    results.append(_result(data.get('client_uuid'), REJECTED, error='A valid client_uuid is required'))
+                    continue
+                if client_uuid in done:
+                    results.append(_result(client_uuid, DUPLICATE, sale=done[client_uuid]))
+                    continue
+                receipt_number = data.get('receipt_number') or next(numbers, None)
+                try:
+                    sale_date = _parse_sale_date(data.get('sale_date'), now)
+                    sale_shift = _shift_at(sale_date, shifts, shift) if sale_date else shift
+                    with transaction.atomic():
+                        sale = _sync_one(data, client_uuid, receipt_number, cashier, sale_shift, customers, sale_date)
+                except (CheckoutError, ValueError) as e:
+                    results.append(_result(client_uuid, REJECTED, error=str(e)))
+                    continue
+                except IntegrityError as e:
+                    # Another upload of the same sale won the race, or the
+                    # till sent a receipt number that is already taken
+                    existing = _existing_sales([client_uuid]).get(client_uuid)
+                    if existing is None:
+                        results.append(_result(client_uuid, REJECTED, error=str(e)))
+                        continue
+                    done[client_uuid] = existing
+                    results.append(_result(client_uuid, DUPLICATE, sale=existing))
+                    continue
+                except Exception:
+                    # Earlier chunks are already saved, so a 500 would leave
+                    # the till unable to tell what was; report it per sale
+                    logger.exception('Error syncing queued sale %s', client_uuid)
+                    results.append(_result(client_uuid, REJECTED, error='Unexpected error; the sale was not saved'))
+                    continue
+                done[client_uuid] = sale
+                results.append(_result(client_uuid, CREATED, sale=sale))
+    return results
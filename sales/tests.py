@@ -1,3 +1,490 @@
+import uuid
+from unittest import mock, skipUnless
 from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework import status
+from decimal import Decimal
+from datetime import date, timedelta
+from .models import Cart, CartItem, Invoice, Sale, SaleItem
+from .checkout import complete_sale
+from .numbering import RECEIPT, next_number
+from branches.models import Branch
+from customers.models import Customer
+from inventory.models import Category, Product, Batch, StockMovement, SalesHistory
+from payments.models import Payment
+from reports.models import SalesReport
+from reports.rollups import day_bounds
+from shifts.models import Shift
+from users.models import UserProfile
+from django.contrib.auth.models import User
 
-# Create your tests here.
+
+class CheckoutTestMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username='cashier', password='testpass')
+        self.profile = UserProfile.objects.create(user=self.user, role='cashier')
+        self.client.force_authenticate(user=self.user)
+        self.shift = Shift.objects.create(cashier=self.profile, opening_balance=Decimal('0.00'))
+        self.category = Category.objects.create(name="Spirits")
+
+    def make_product(self, sku, stock=100, batches=()):
+        product = Product.objects.create(
+            sku=sku,
+            name=f"Product {sku}",
+            category=self.category,
+            cost_price=Decimal('50.00'),
+            selling_price=Decimal('80.00'),
+            stock_quantity=stock
+        )
+        for offset, quantity in batches:
+            Batch.objects.create(
+                product=product,
+                batch_number=f"{sku}-B{offset}",
+                quantity=quantity,
+                cost_price=Decimal('50.00'),
+                expiry_date=date.today() + timedelta(days=30 + offset),
+                purchase_date=date.today() - timedelta(days=10 - offset),
+                status='received'
+            )
+        return product
+
+    def sale_payload(self, products, quantity=1, **extra):
+        items = [
+            {'product': product.id, 'quantity': quantity, 'unit_price': '80.00'}
+            for product in products
+        ]
+        payload = {
+            'items': items,
+            'payment_method': 'cash',
+            'total_amount': float(Decimal('80.00') * quantity * len(products)),
+        }
+        payload.update(extra)
+        return payload
+
+
+class SaleCheckoutTest(CheckoutTestMixin, APITestCase):
+    url = '/api/sales/'
+
+    def test_sale_deducts_stock_fifo(self):
+        product = self.make_product('WHISKY', stock=10, batches=[(0, 4), (5, 6)])
+        response = self.client.post(self.url, self.sale_payload([product], quantity=7), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 3)
+        oldest, newest = Batch.objects.filter(product=product).order_by('expiry_date')
+        self.assertEqual(oldest.quantity, 0)
+        self.assertEqual(newest.quantity, 3)
+
+        sale = Sale.objects.get()
+        self.assertEqual(SaleItem.objects.filter(sale=sale).count(), 1)
+        self.assertEqual(CartItem.objects.filter(cart=sale.cart).count(), 1)
+        self.assertEqual(StockMovement.objects.filter(product=product).count(), 2)
+        history = SalesHistory.objects.filter(receipt_number=sale.receipt_number)
+        self.assertEqual(sorted(h.quantity for h in history), [3, 4])
+        self.assertEqual(sum(h.profit for h in history), Decimal('210.00'))
+
+        payment = Payment.objects.get(sale=sale)
+        self.assertEqual(payment.payment_type, 'cash')
+        self.assertEqual(payment.amount, Decimal('560.00'))
+
+        self.shift.refresh_from_db()
+        self.assertEqual(self.shift.total_sales, Decimal('560.00'))
+        self.assertEqual(self.shift.cash_sales, Decimal('560.00'))
+
+    def test_product_without_batches_uses_product_stock(self):
+        product = self.make_product('GIN', stock=5)
+        response = self.client.post(self.url, self.sale_payload([product], quantity=2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 3)
+        record = SalesHistory.objects.get(product=product)
+        self.assertIsNone(record.batch)
+        self.assertIsNone(record.cost_price)
+
+    def test_duplicate_lines_do_not_double_allocate(self):
+        product = self.make_product('RUM', stock=5, batches=[(0, 5)])
+        payload = self.sale_payload([product, product], quantity=3)
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Insufficient stock', response.data['error'])
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 5)
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+
+    def test_invalid_payment_method_writes_nothing(self):
+        product = self.make_product('VODKA', stock=5, batches=[(0, 5)])
+        payload = self.sale_payload([product], payment_method='cheque')
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 5)
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_split_payment_creates_two_payments(self):
+        product = self.make_product('BEER', stock=5, batches=[(0, 5)])
+        payload = self.sale_payload([product], quantity=2, payment_method='split',
+                                    split_data={'cash': 100, 'mpesa': 60})
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(
+            sorted(Payment.objects.values_list('payment_type', flat=True)),
+            ['cash', 'mpesa']
+        )
+        self.shift.refresh_from_db()
+        self.assertEqual(self.shift.cash_sales, Decimal('100.00'))
+        self.assertEqual(self.shift.mobile_sales, Decimal('60.00'))
+
+    def test_query_count_does_not_grow_with_lines(self):
+        def count_queries(products):
+            payload = self.sale_payload(products, receipt_number=f'RCPT-{len(products)}')
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.url, payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+            return len(ctx.captured_queries)
+
+        small = [self.make_product(f'S{i}', batches=[(0, 50)]) for i in range(2)]
+        large = [self.make_product(f'L{i}', batches=[(0, 20), (3, 50)]) for i in range(20)]
+        self.assertEqual(count_queries(small), count_queries(large))
+
+
+class CompleteHeldOrderTest(CheckoutTestMixin, APITestCase):
+    def test_complete_held_order(self):
+        product = self.make_product('BRANDY', stock=10, batches=[(0, 10)])
+        response = self.client.post(
+            '/api/sales/', self.sale_payload([product], quantity=2, hold_order=True), format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        cart = Cart.objects.get(status='held')
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 10)
+
+        response = self.client.post(
+            f'/api/sales/{cart.id}/complete_held_order/',
+            {'payment_method': 'mpesa', 'mpesa_number': '0700000000'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.status, 'closed')
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 8)
+        payment = Payment.objects.get(sale__cart=cart)
+        self.assertEqual(payment.payment_type, 'mpesa')
+        self.assertEqual(payment.amount, Decimal('160.00'))
+
+
+class SaleSyncTest(CheckoutTestMixin, APITestCase):
+    url = '/api/sales/sync/'
+
+    def queued_sale(self, products, quantity=1, **extra):
+        return self.sale_payload(products, quantity=quantity, client_uuid=str(uuid.uuid4()), **extra)
+
+    def test_sync_creates_each_sale(self):
+        product = self.make_product('GIN', stock=20, batches=[(0, 20)])
+        sales = [self.queued_sale([product], quantity=2) for _ in range(3)]
+        response = self.client.post(self.url, {'sales': sales}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual([r['client_uuid'] for r in response.data['results']], [s['client_uuid'] for s in sales])
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 14)
+        self.assertEqual(Sale.objects.filter(client_uuid__isnull=False).count(), 3)
+        self.assertEqual(Payment.objects.count(), 3)
+        self.shift.refresh_from_db()
+        self.assertEqual(self.shift.total_sales, Decimal('480.00'))
+
+    def test_resending_a_batch_is_idempotent(self):
+        product = self.make_product('RUM', stock=10, batches=[(0, 10)])
+        sales = [self.queued_sale([product]), self.queued_sale([product])]
+        first = self.client.post(self.url, {'sales': sales}, format='json')
+        second = self.client.post(self.url, {'sales': sales}, format='json')
+        self.assertEqual(second.data['duplicate'], 2)
+        self.assertEqual(
+            [r['sale_id'] for r in second.data['results']],
+            [r['sale_id'] for r in first.data['results']]
+        )
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 8)
+
+    def test_a_rejected_sale_does_not_stop_the_rest(self):
+        product = self.make_product('VODKA', stock=3, batches=[(0, 3)])
+        sales = [
+            self.queued_sale([product], quantity=2),
+            self.queued_sale([product], quantity=2),
+            self.queued_sale([product], quantity=1),
+            self.sale_payload([product]),
+        ]
+        response = self.client.post(self.url, {'sales': sales}, format='json')
+        self.assertEqual(
+            [r['status'] for r in response.data['results']],
+            ['created', 'error', 'created', 'error']
+        )
+        self.assertIn('Insufficient stock', response.data['results'][1]['error'])
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(Sale.objects.count(), 2)
+        self.assertEqual(StockMovement.objects.filter(product=product).count(), 2)
+
+    def test_bad_split_amounts_are_rejected_per_sale(self):
+        product = self.make_product('BRANDY', stock=10, batches=[(0, 10)])
+        sales = [
+            self.queued_sale([product], payment_method='split', split_data={'cash': '50', 'mpesa': '30'}),
+            self.queued_sale([product], payment_method='split', split_data={'cash': 'lots', 'mpesa': 30}),
+            self.queued_sale([product], payment_method='split', split_data=['cash', 80]),
+            self.queued_sale([product]),
+        ]
+        response = self.client.post(self.url, {'sales': sales}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(
+            [r['status'] for r in response.data['results']],
+            ['created', 'error', 'error', 'created']
+        )
+        self.assertIn('Invalid cash amount', response.data['results'][1]['error'])
+        self.assertEqual(
+            sorted(Payment.objects.values_list('payment_type', 'amount')),
+            [('cash', Decimal('50.00')), ('cash', Decimal('80.00')), ('mpesa', Decimal('30.00'))]
+        )
+
+    def test_unexpected_errors_are_rejected_per_sale(self):
+        product = self.make_product('PORT', stock=10, batches=[(0, 10)])
+        sales = [self.queued_sale([product]) for _ in range(3)]
+        calls = []
+
+        def flaky_complete_sale(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError('till sent something odd')
+            return complete_sale(*args, **kwargs)
+
+        with mock.patch('sales.sync.complete_sale', flaky_complete_sale), self.assertLogs('sales.sync', 'ERROR'):
+            response = self.client.post(self.url, {'sales': sales}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'error', 'created'])
+        self.assertEqual(Sale.objects.count(), 2)
+
+    def test_sales_keep_the_time_and_shift_they_were_rung_up_in(self):
+        rung_up = timezone.now() - timedelta(days=2)
+        earlier_shift = Shift.objects.create(
+            cashier=self.profile, opening_balance=Decimal('0.00'), status='closed'
+        )
+        Shift.objects.filter(pk=earlier_shift.pk).update(
+            start_time=rung_up - timedelta(hours=4), end_time=rung_up + timedelta(hours=4)
+        )
+        Shift.objects.filter(pk=self.shift.pk).update(start_time=timezone.now() - timedelta(hours=1))
+        product = self.make_product('SHERRY', stock=10, batches=[(0, 10)])
+        sales = [
+            self.queued_sale([product], sale_date=rung_up.isoformat()),
+            self.queued_sale([product]),
+            self.queued_sale([product], sale_date=(timezone.now() - timedelta(days=30)).isoformat()),
+            self.queued_sale([product], sale_date='yesterday'),
+        ]
+        response = self.client.post(self.url, {'sales': sales}, format='json')
+        self.assertEqual(
+            [r['status'] for r in response.data['results']],
+            ['created', 'created', 'error', 'error']
+        )
+
+        offline, online = (Sale.objects.get(pk=r['sale_id']) for r in response.data['results'][:2])
+        self.assertEqual(offline.sale_date, rung_up)
+        self.assertEqual(offline.shift, earlier_shift)
+        self.assertEqual(online.shift, self.shift)
+        self.assertEqual(
+            SalesHistory.objects.get(receipt_number=offline.receipt_number).sale_date, rung_up
+        )
+        self.assertEqual(
+            SalesReport.objects.get(date=timezone.localdate(rung_up)).total_sales, Decimal('80.00')
+        )
+        earlier_shift.refresh_from_db()
+        self.assertEqual(earlier_shift.total_sales, Decimal('80.00'))
+
+    def test_sync_requires_an_open_shift(self):
+        self.shift.status = 'closed'
+        self.shift.save()
+        product = self.make_product('CIDER')
+        response = self.client.post(self.url, {'sales': [self.queued_sale([product])]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class VoidSaleTest(CheckoutTestMixin, APITestCase):
+    def test_void_restores_product_and_batch_stock(self):
+        product = self.make_product('CIDER', stock=10, batches=[(0, 4), (5, 6)])
+        response = self.client.post('/api/sales/', self.sale_payload([product], quantity=6), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        sale = Sale.objects.get()
+
+        response = self.client.post(f'/api/sales/{sale.id}/void_sale/', {'reason': 'Wrong item'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 10)
+        self.assertEqual(
+            sorted(Batch.objects.filter(product=product).values_list('quantity', flat=True)),
+            [4, 6]
+        )
+        self.assertTrue(StockMovement.objects.filter(product=product, movement_type='in', quantity=6).exists())
+        self.shift.refresh_from_db()
+        self.assertEqual(self.shift.total_sales, Decimal('0.00'))
+
+
+class SaleListQueryCountTest(CheckoutTestMixin, APITestCase):
+    def make_sales(self, count, split=False):
+        product = self.make_product(f'P{Sale.objects.count()}', stock=1000)
+        for _ in range(count):
+            n = Sale.objects.count() + 1
+            extra = {'payment_method': 'split', 'split_data': {'cash': 50, 'mpesa': 30}} if split else {}
+            response = self.client.post(
+                '/api/sales/', self.sale_payload([product], receipt_number=f'R{n}', **extra), format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+    def list_sales(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/sales/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(ctx.captured_queries)
+
+    def test_list_query_count_is_fixed(self):
+        self.make_sales(2)
+        _, few = self.list_sales()
+        self.make_sales(10)
+        self.make_sales(3, split=True)
+        sales, many = self.list_sales()
+        self.assertEqual(len(sales), 15)
+        self.assertEqual(few, many)
+        self.assertEqual(few, 2)
+
+        by_receipt = {sale['receipt_number']: sale for sale in sales}
+        self.assertEqual(by_receipt['R1']['payment_method'], 'cash')
+        self.assertIsNone(by_receipt['R1']['split_data'])
+        self.assertEqual(by_receipt['R15']['payment_method'], 'split')
+        self.assertEqual(by_receipt['R15']['split_data'], {'cash': 50.0, 'mpesa': 30.0})
+
+    def test_retrieve_loads_payments_once(self):
+        self.make_sales(1, split=True)
+        sale = Sale.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/sales/{sale.id}/')
+        self.assertEqual(response.data['payment_method'], 'split')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+class NumberingTest(CheckoutTestMixin, APITestCase):
+    def test_sales_in_the_same_second_get_distinct_receipts(self):
+        product = self.make_product('LAGER', stock=10, batches=[(0, 10)])
+        for _ in range(3):
+            response = self.client.post('/api/sales/', self.sale_payload([product]), format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        today = timezone.localdate().strftime('%Y%m%d')
+        self.assertEqual(
+            sorted(Sale.objects.values_list('receipt_number', flat=True)),
+            [f'POS-{today}-0000{n}' for n in (1, 2, 3)]
+        )
+
+    def test_counters_are_per_branch_and_day(self):
+        branch = Branch.objects.create(name='Westlands', location='Nairobi', address='-', phone='0700000000')
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(next_number(RECEIPT, day=yesterday), f'POS-{yesterday:%Y%m%d}-00001')
+        self.assertEqual(next_number(RECEIPT, branch=branch, day=yesterday), f'POS-{branch.pk}-{yesterday:%Y%m%d}-00001')
+        self.assertEqual(next_number(RECEIPT, day=yesterday), f'POS-{yesterday:%Y%m%d}-00002')
+
+    def test_failed_sales_leave_a_gap(self):
+        product = self.make_product('STOUT', stock=1)
+        response = self.client.post('/api/sales/', self.sale_payload([product], quantity=2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/sales/', self.sale_payload([product]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertTrue(response.data['receipt_number'].endswith('-00002'))
+
+    def test_invoices_get_consecutive_numbers(self):
+        customer = Customer.objects.create(name='Acme', phone='0711000000')
+        due = timezone.localdate() + timedelta(days=30)
+        numbers = [
+            Invoice.objects.create(customer=customer, due_date=due, total_amount=Decimal('10.00')).invoice_number
+            for _ in range(2)
+        ]
+        today = timezone.localdate().strftime('%Y%m%d')
+        self.assertEqual(numbers, [f'INV-{today}-0001', f'INV-{today}-0002'])
+
+    def test_reserved_blocks_do_not_overlap(self):
+        first = self.client.post('/api/sales/reserve_receipts/', {'count': 3}, format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED, first.data)
+        second = self.client.post('/api/sales/reserve_receipts/', {'count': 2}, format='json')
+        self.assertEqual(len(first.data['receipt_numbers']), 3)
+        self.assertTrue(first.data['receipt_numbers'][-1].endswith('-00003'))
+        self.assertTrue(second.data['receipt_numbers'][0].endswith('-00004'))
+
+        response = self.client.post('/api/sales/reserve_receipts/', {'count': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NumberingLockTest(CheckoutTestMixin, APITransactionTestCase):
+    """The counter row is only locked by its own, already committed, transaction"""
+
+    def outermost_transactions(self, post):
+        """Run ``post`` and return ``[(sql, outermost atomic block)]`` for every statement"""
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, connection.atomic_blocks[0] if connection.atomic_blocks else None))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = post()
+        self.assertIn(response.status_code, (status.HTTP_200_OK, status.HTTP_201_CREATED), response.data)
+        return statements
+
+    def assertCounterCommittedBeforeSale(self, statements):
+        counter = [block for sql, block in statements if 'sales_numbersequence' in sql]
+        sales = [block for sql, block in statements if sql.startswith('INSERT INTO "sales_sale"')]
+        self.assertTrue(counter)
+        self.assertTrue(sales)
+        for block in counter:
+            self.assertIsNotNone(block)
+            self.assertNotIn(block, sales)
+        first_sale = next(n for n, (sql, _) in enumerate(statements) if sql.startswith('INSERT INTO "sales_sale"'))
+        last_counter = max(n for n, (sql, _) in enumerate(statements) if 'sales_numbersequence' in sql)
+        self.assertLess(last_counter, first_sale)
+
+    def test_checkout_numbers_outside_the_sale_transaction(self):
+        product = self.make_product('LAGER', stock=10, batches=[(0, 10)])
+        statements = self.outermost_transactions(
+            lambda: self.client.post('/api/sales/', self.sale_payload([product]), format='json')
+        )
+        self.assertCounterCommittedBeforeSale(statements)
+
+    def test_sync_numbers_outside_the_chunk_transaction(self):
+        product = self.make_product('LAGER', stock=10, batches=[(0, 10)])
+        sales = [
+            {**self.sale_payload([product]), 'client_uuid': str(uuid.uuid4())}
+            for _ in range(3)
+        ]
+        statements = self.outermost_transactions(
+            lambda: self.client.post('/api/sales/sync/', {'sales': sales}, format='json')
+        )
+        self.assertCounterCommittedBeforeSale(statements)
+        self.assertEqual(Sale.objects.count(), 3)
+
+
+class SaleIndexTest(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(f'USING INDEX {index}', queryset.explain())
+
+    def test_date_range_filters_use_indexes(self):
+        start, end = day_bounds(timezone.localdate())
+        self.assertUsesIndex(Sale.objects.filter(sale_date__gte=start, sale_date__lt=end), 'sales_sale_date_idx')
+        self.assertUsesIndex(
+            Sale.objects.filter(sale_date__gte=start, sale_date__lt=end, voided=False),
+            'sales_sale_live_date_idx'
+        )
+        self.assertUsesIndex(Sale.objects.filter(shift_id=1, sale_date__gte=start), 'sales_sale_shift_date_idx')
@@ -1,3 +1,5 @@
+import logging
+
 from rest_framework import viewsets, status, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action
@@ -5,25 +7,46 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import F
 from django.conf import settings
 from .models import Cart, CartItem, Sale, SaleItem, Return, Invoice, InvoiceItem
 from .serializers import CartSerializer, CartItemSerializer, SaleSerializer, SaleItemSerializer, ReturnSerializer, InvoiceSerializer, InvoiceItemSerializer
+from .checkout import (
+    CheckoutError, attach_products, build_cart_items, complete_sale, receipt_number_for, validate_stock
+)
+from .sync import SYNC_MAX_SALES, sync_sales
+from .numbering import RECEIPT, allocate
+from inventory.allocation import restore_stock
+from reports.rollups import record_void
 from inventory.models import Product, StockMovement, SalesHistory
 from shifts.models import Shift
 from payments.models import Payment
 
+logger = logging.getLogger(__name__)
+
+# Largest block of receipt numbers a till can reserve at once
+RECEIPT_BLOCK_MAX = 500
+
 class CartViewSet(viewsets.ModelViewSet):
-    queryset = Cart.objects.all()
+    queryset = Cart.objects.select_related('customer', 'cashier__user').prefetch_related('cartitem_set__product')
     serializer_class = CartSerializer
 
 class CartItemViewSet(viewsets.ModelViewSet):
-    queryset = CartItem.objects.all()
+    queryset = CartItem.objects.select_related('product')
     serializer_class = CartItemSerializer
 
 class SaleViewSet(viewsets.ModelViewSet):
     queryset = Sale.objects.all()
     serializer_class = SaleSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # SaleSerializer derives payment_method/split_data from the
+            # payments; load them for the whole page in one query
+            queryset = queryset.select_related('customer', 'voided_by__user').prefetch_related('payment_set')
+        return queryset
+
     @action(detail=False, methods=['get'])
     def held_orders(self, request):
         """Get all held orders for the current cashier's shift"""
@@ -48,11 +71,71 @@ class SaleViewSet(viewsets.ModelViewSet):
         held_carts = Cart.objects.filter(
             cashier=cashier,
             status='held'
-        ).prefetch_related('cartitem_set__product').order_by('-created_at')
+        ).select_related('customer', 'cashier__user').prefetch_related('cartitem_set__product').order_by('-created_at')
 
         serializer = CartSerializer(held_carts, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """
+        Upload a batch of sales queued by an offline till.
+
+        Expects ``{"sales": [...]}``, each sale shaped like a ``create``
+        payload plus a till-generated ``client_uuid`` and, optionally, the
+        ``sale_date`` it was rung up at. Returns one result per sale in the
+        same order; re-sending a batch is safe.
+        """
+        sales_data = request.data.get('sales')
+        if not isinstance(sales_data, list) or not sales_data:
+            return Response({'error': 'No sales provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(sales_data) > SYNC_MAX_SALES:
+            return Response(
+                {'error': f'At most {SYNC_MAX_SALES} sales can be synced at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not all(isinstance(data, dict) for data in sales_data):
+            return Response({'error': 'Each sale must be an object'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cashier = getattr(request.user, 'userprofile', None)
+        if not cashier:
+            return Response(
+                {'error': 'User profile not found. Please contact administrator.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            current_shift = Shift.objects.get(cashier=cashier, status='open')
+        except Shift.DoesNotExist:
+            return Response(
+                {'error': 'No active shift found. Please start a shift before processing sales.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = sync_sales(sales_data, cashier, current_shift)
+        summary = {outcome: 0 for outcome in ('created', 'duplicate', 'error')}
+        for result in results:
+            summary[result['status']] += 1
+        return Response({'results': results, **summary})
+
+    @action(detail=False, methods=['post'])
+    def reserve_receipts(self, request):
+        """
+        Reserve a block of today's receipt numbers for a till to use offline.
+
+        The numbers are sent back with the queued sales (``sync``); unused
+        ones are simply skipped.
+        """
+        try:
+            count = int(request.data.get('count', 0))
+        except (TypeError, ValueError):
+            count = 0
+        if not 0 < count <= RECEIPT_BLOCK_MAX:
+            return Response(
+                {'error': f'count must be between 1 and {RECEIPT_BLOCK_MAX}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'receipt_numbers': allocate(RECEIPT, count)}, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def complete_held_order(self, request, pk=None):
         """Complete a held order by creating the sale and processing payment"""
@@ -84,288 +167,13 @@ class SaleViewSet(viewsets.ModelViewSet):
             )
 
         try:
+            receipt_number = receipt_number_for(request.data)
             with transaction.atomic():
-                # Calculate totals from cart items
-                cart_items = cart.cartitem_set.all()
-                subtotal = sum(float(item.unit_price) * int(item.quantity) for item in cart_items)
-                tax_amount = float(request.data.get('tax_amount', 0))
-                discount_amount = float(request.data.get('discount_amount', 0))
-                total_amount = float(request.data.get('total_amount', subtotal + tax_amount - discount_amount))
-                receipt_number = request.data.get('receipt_number', f'POS-{timezone.now().strftime("%Y%m%d%H%M%S")}')
-
-                # Create sale
-                from django.db.models.signals import post_save
-                from .signals import create_default_payment
-
-                # Temporarily disconnect the signal to prevent duplicate payments
-                post_save.disconnect(create_default_payment, sender=Sale)
-
-                sale = Sale.objects.create(
-                    cart=cart,
-                    customer=cart.customer,
-                    shift=current_shift,
-                    sale_type=request.data.get('sale_type', 'retail'),
-                    total_amount=float(subtotal),
-                    tax_amount=float(tax_amount),
-                    discount_amount=float(discount_amount),
-                    final_amount=float(total_amount),
-                    receipt_number=receipt_number
+                cart_items = list(cart.cartitem_set.select_related('product'))
+                sale = complete_sale(
+                    cart, cart_items, cashier, current_shift, request.data, receipt_number, customer=cart.customer
                 )
 
-                # Reconnect the signal
-                post_save.connect(create_default_payment, sender=Sale)
-
-                # Update shift totals
-                payment_method = request.data.get('payment_method', 'cash').lower()
-                from decimal import Decimal
-                sale_amount = Decimal(str(total_amount))
-
-                from django.db.models import F
-                update_fields = ['total_sales']
-                if payment_method == 'split':
-                    # For split payments, use the split data
-                    split_data = request.data.get('split_data', {})
-                    cash_amount = Decimal(str(split_data.get('cash', 0)))
-                    mpesa_amount = Decimal(str(split_data.get('mpesa', 0)))
-                    current_shift.cash_sales = F('cash_sales') + cash_amount
-                    current_shift.mobile_sales = F('mobile_sales') + mpesa_amount
-                    update_fields.extend(['cash_sales', 'mobile_sales'])
-                elif payment_method == 'cash':
-                    current_shift.cash_sales = F('cash_sales') + sale_amount
-                    update_fields.append('cash_sales')
-                elif payment_method in ['mpesa', 'mobile']:
-                    current_shift.mobile_sales = F('mobile_sales') + sale_amount
-                    update_fields.append('mobile_sales')
-
-                current_shift.total_sales = F('total_sales') + sale_amount
-                current_shift.save(update_fields=update_fields)
-
-                # Create sale items
-                for cart_item in cart_items:
-                    SaleItem.objects.create(
-                        sale=sale,
-                        product=cart_item.product,
-                        quantity=int(cart_item.quantity),
-                        unit_price=float(cart_item.unit_price),
-                        discount=float(cart_item.discount)
-                    )
-
-                # Deduct stock (same logic as in create method)
-                stock_deductions = []
-                for cart_item in cart_items:
-                    product = cart_item.product
-                    requested_quantity = int(cart_item.quantity)
-
-                    # Validate quantity is positive
-                    if requested_quantity <= 0:
-                        return Response(
-                            {'error': f'Invalid quantity for product "{product.name}". Quantity must be positive.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    if float(product.stock_quantity) < requested_quantity:
-                        return Response(
-                            {'error': f'Insufficient stock for product "{product.name}". Available: {product.stock_quantity}, Requested: {requested_quantity}'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    stock_deductions.append({
-                        'product': product,
-                        'quantity': requested_quantity,
-                        'cart_item': cart_item
-                    })
-
-                # Apply stock deductions
-                for deduction in stock_deductions:
-                    product = deduction['product']
-                    remaining_quantity = deduction['quantity']
-
-                    from inventory.models import Batch
-                    available_batches = Batch.objects.filter(
-                        product=product,
-                        quantity__gt=0
-                    ).exclude(
-                        status__in=['damaged', 'expired'],
-                        expiry_date__lt=timezone.now().date()
-                    ).order_by('expiry_date', 'purchase_date')
-
-                    batch_deductions = []
-                    for batch in available_batches:
-                        if remaining_quantity <= 0:
-                            break
-
-                        take_quantity = min(remaining_quantity, batch.quantity)
-                        batch_deductions.append({
-                            'batch': batch,
-                            'quantity': take_quantity
-                        })
-                        remaining_quantity -= take_quantity
-
-                    total_available = sum(d['quantity'] for d in batch_deductions)
-                    if total_available < deduction['quantity']:
-                        if not available_batches.exists() and float(product.stock_quantity) >= deduction['quantity']:
-                            from decimal import Decimal
-                            product.stock_quantity = Decimal(str(product.stock_quantity)) - Decimal(str(deduction['quantity']))
-                            product.save(update_fields=['stock_quantity'])
-
-                            StockMovement.objects.create(
-                                product=product,
-                                movement_type='out',
-                                quantity=-deduction['quantity'],
-                                reason=f'Sale {sale.receipt_number} - No batch tracking',
-                                user=cashier
-                            )
-
-                            SalesHistory.objects.create(
-                                product=product,
-                                batch=None,
-                                quantity=deduction['quantity'],
-                                unit_price=deduction['cart_item'].unit_price,
-                                cost_price=0,
-                                total_price=deduction['cart_item'].unit_price * deduction['quantity'],
-                                receipt_number=sale.receipt_number,
-                                sale_date=sale.sale_date
-                            )
-                            continue
-                        else:
-                            return Response(
-                                {'error': f'Insufficient stock for product "{product.name}". Available: {total_available}, Required: {deduction["quantity"]}'},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-
-                    # Apply batch deductions
-                    for batch_deduction in batch_deductions:
-                        batch = batch_deduction['batch']
-                        quantity = batch_deduction['quantity']
-
-                        from decimal import Decimal
-                        batch.quantity = Decimal(str(batch.quantity)) - Decimal(str(quantity))
-                        batch.save(update_fields=['quantity'])
-
-                        product.stock_quantity = Decimal(str(product.stock_quantity)) - Decimal(str(quantity))
-                        product.save(update_fields=['stock_quantity'])
-
-                        StockMovement.objects.create(
-                            product=product,
-                            movement_type='out',
-                            quantity=-quantity,
-                            reason=f'Sale {sale.receipt_number} - Batch {batch.batch_number}',
-                            user=cashier
-                        )
-
-                        SalesHistory.objects.create(
-                            product=product,
-                            batch=batch,
-                            quantity=quantity,
-                            unit_price=deduction['cart_item'].unit_price,
-                            cost_price=batch.cost_price,
-                            total_price=deduction['cart_item'].unit_price * quantity,
-                            receipt_number=sale.receipt_number,
-                            sale_date=sale.sale_date
-                        )
-
-                # Check if payments already exist for this sale (prevent duplicates)
-                existing_payments = sale.payment_set.filter(status='completed')
-                if existing_payments.exists():
-                    created_payments = list(existing_payments)
-                else:
-                    # Check if payments already exist for this sale (prevent duplicates)
-                    existing_payments = sale.payment_set.filter(status='completed')
-                    if existing_payments.exists():
-                        created_payments = list(existing_payments)
-                    else:
-                        # STRICT VALIDATION: Require payment method and ensure payment creation succeeds
-                        payment_method = request.data.get('payment_method', '').strip().lower()
-                        if not payment_method:
-                            return Response(
-                                {'error': 'Payment method is required for all transactions'},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-    
-                        # Validate payment method
-                        valid_payment_methods = ['cash', 'mpesa', 'mobile', 'split']
-                        if payment_method not in valid_payment_methods:
-                            return Response(
-                                {'error': f'Invalid payment method. Must be one of: {", ".join(valid_payment_methods)}'},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-    
-                        # Validate split payment data if split method selected
-                        if payment_method == 'split':
-                            split_data = request.data.get('split_data', {})
-                            if not split_data or (split_data.get('cash', 0) == 0 and split_data.get('mpesa', 0) == 0):
-                                raise ValueError('Split payment requires cash and/or mpesa amounts in split_data')
-    
-                        # Create payment record for the sale
-                        created_payments = []
-                        if payment_method == 'split':
-                            # For split payments, create appropriate payment records
-                            split_data = request.data.get('split_data', {})
-                            cash_amount = split_data.get('cash', 0)
-                            mpesa_amount = split_data.get('mpesa', 0)
-    
-                            # Check if it's truly split (both amounts > 0) or pure payment
-                            if cash_amount > 0 and mpesa_amount > 0:
-                                # True split payment - create two records
-                                payment = Payment.objects.create(
-                                    sale=sale,
-                                    payment_type='cash',
-                                    amount=cash_amount,
-                                    status='completed'
-                                )
-                                created_payments.append(payment)
-    
-                                payment = Payment.objects.create(
-                                    sale=sale,
-                                    payment_type='mpesa',
-                                    amount=mpesa_amount,
-                                    mpesa_number=request.data.get('mpesa_number', ''),
-                                    status='completed'
-                                )
-                                created_payments.append(payment)
-                            elif mpesa_amount > 0:
-                                # Pure M-Pesa payment
-                                payment = Payment.objects.create(
-                                    sale=sale,
-                                    payment_type='mpesa',
-                                    amount=mpesa_amount,
-                                    mpesa_number=request.data.get('mpesa_number', ''),
-                                    status='completed'
-                                )
-                                created_payments.append(payment)
-                            elif cash_amount > 0:
-                                # Pure cash payment
-                                payment = Payment.objects.create(
-                                    sale=sale,
-                                    payment_type='cash',
-                                    amount=cash_amount,
-                                    status='completed'
-                                )
-                                created_payments.append(payment)
-                        else:
-                            # Single payment method
-                            payment_type = 'cash'
-                            if payment_method in ['mpesa', 'mobile']:
-                                payment_type = 'mpesa'
-    
-                            payment = Payment.objects.create(
-                                sale=sale,
-                                payment_type=payment_type,
-                                amount=total_amount,
-                                mpesa_number=request.data.get('mpesa_number', '') if payment_type == 'mpesa' else '',
-                                status='completed'
-                            )
-                            created_payments.append(payment)
-    
-                        # CRITICAL VALIDATION: Ensure at least one payment was created
-                        if not created_payments:
-                            raise ValueError("No payment records were created for this transaction")
-    
-                        # Verify payment amounts total matches sale amount
-                        total_payment_amount = sum(float(p.amount) for p in created_payments)
-                        if abs(total_payment_amount - float(total_amount)) > 0.01:  # Allow small floating point differences
-                            raise ValueError(f"Payment amount mismatch: payments total {total_payment_amount}, sale total {total_amount}")
-
                 # Update cart status to closed
                 cart.status = 'closed'
                 cart.save()
@@ -374,10 +182,10 @@ class SaleViewSet(viewsets.ModelViewSet):
                 serializer = self.get_serializer(sale)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"Error completing held order: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error completing held order %s", pk)
 
             # Provide user-friendly error messages
             error_message = str(e)
@@ -469,6 +277,15 @@ class SaleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        sale_items = list(sale.saleitem_set.select_related('product'))
+        for sale_item in sale_items:
+            # Validate quantity is positive
+            if sale_item.quantity <= 0:
+                return Response(
+                    {'error': f'Invalid quantity for product "{sale_item.product.name}" in voided sale. Quantity must be positive.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
         try:
             with transaction.atomic():
                 # Mark sale as voided
@@ -479,44 +296,29 @@ class SaleViewSet(viewsets.ModelViewSet):
                 sale.save()
 
                 # Restore stock quantities
-                for sale_item in sale.saleitem_set.all():
-                    product = sale_item.product
-                    quantity_to_restore = sale_item.quantity
-
-                    # Validate quantity is positive
-                    if quantity_to_restore <= 0:
-                        return Response(
-                            {'error': f'Invalid quantity for product "{product.name}" in voided sale. Quantity must be positive.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    # Restore product stock
-                    from decimal import Decimal
-                    product.stock_quantity = Decimal(str(product.stock_quantity)) + Decimal(str(quantity_to_restore))
-                    product.save(update_fields=['stock_quantity'])
-
-                    # Create stock movement record
-                    from inventory.models import StockMovement
-                    StockMovement.objects.create(
-                        product=product,
+                product_totals = {}
+                movements = []
+                for sale_item in sale_items:
+                    product_totals[sale_item.product_id] = product_totals.get(sale_item.product_id, 0) + sale_item.quantity
+                    movements.append(StockMovement(
+                        product=sale_item.product,
                         movement_type='in',
-                        quantity=quantity_to_restore,
+                        quantity=sale_item.quantity,
                         reason=f'Sale void {sale.receipt_number} - {void_reason}',
-                        user=request.user.userprofile if hasattr(request.user, 'userprofile') else None
-                    )
+                        user=sale.voided_by
+                    ))
 
-                    # Update batch quantities if applicable
-                    from inventory.models import Batch, SalesHistory
-                    sales_history_records = SalesHistory.objects.filter(
-                        product=product,
-                        receipt_number=sale.receipt_number
-                    )
+                # Put batch quantities back from the sales history of this receipt
+                batch_totals = {}
+                for batch_id, quantity in SalesHistory.objects.filter(
+                    receipt_number=sale.receipt_number,
+                    batch__isnull=False
+                ).values_list('batch_id', 'quantity'):
+                    batch_totals[batch_id] = batch_totals.get(batch_id, 0) + quantity
 
-                    for history_record in sales_history_records:
-                        if history_record.batch:
-                            batch = history_record.batch
-                            batch.quantity = Decimal(str(batch.quantity)) + Decimal(str(history_record.quantity))
-                            batch.save(update_fields=['quantity'])
+                restore_stock(product_totals, batch_totals)
+                StockMovement.objects.bulk_create(movements)
+                record_void(sale)
 
                 # Update shift totals (subtract the voided sale)
                 if sale.shift:
@@ -549,9 +351,7 @@ class SaleViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            print(f"Error voiding sale: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error voiding sale %s", pk)
             return Response({
                 'error': 'Failed to void sale',
                 'details': str(e)
@@ -562,19 +362,21 @@ class SaleViewSet(viewsets.ModelViewSet):
         Custom create method to handle sale creation from frontend cart data
         """
         try:
+            # Check if this is a hold order request
+            is_hold_order = request.data.get('hold_order', False)
+
+            # Get items from request (frontend cart data)
+            items_data = request.data.get('items', [])
+            if not items_data:
+                return Response(
+                    {'error': 'No items provided'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Numbered ahead of the sale's transaction (see sales.numbering)
+            receipt_number = None if is_hold_order else receipt_number_for(request.data)
+
             with transaction.atomic():
-                # Check if this is a hold order request
-                is_hold_order = request.data.get('hold_order', False)
-
-                # Get items from request (frontend cart data)
-                items_data = request.data.get('items', [])
-                print(f"Received items data: {items_data}")
-                print(f"Request data types: {[type(item.get('unit_price')) for item in items_data]}")
-                if not items_data:
-                    return Response(
-                        {'error': 'No items provided'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
 
                 # Get cashier from authenticated user (required for shift validation)
                 cashier = None
@@ -596,385 +398,50 @@ class SaleViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-                # Create cart first
-                cart_status = 'held' if is_hold_order else 'closed'
-                cart = Cart.objects.create(
-                    cashier=cashier,
-                    status=cart_status
-                )
-
-                # Create cart items from frontend data
-                cart_items = []
-                for item_data in items_data:
-                    try:
-                        print(f"Processing item: {item_data}")
-                        print(f"Item types - product: {type(item_data.get('product'))}, quantity: {type(item_data.get('quantity'))}, unit_price: {type(item_data.get('unit_price'))}")
-
-                        cart_item = CartItem.objects.create(
-                            cart=cart,
-                            product_id=item_data.get('product'),
-                            quantity=int(item_data.get('quantity', 1)),
-                            unit_price=float(item_data.get('unit_price', 0)),
-                            discount=float(item_data.get('discount', 0))
-                        )
-                        cart_items.append(cart_item)
-                    except Exception as item_error:
-                        print(f"Error creating cart item: {str(item_error)}")
-                        print(f"Item data: {item_data}")
-                        return Response(
-                            {'error': f'Error creating cart item for product {item_data.get("product")}: {str(item_error)}'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                # Get sale type and apply wholesale business rules
-                sale_type = request.data.get('sale_type', 'retail')
-
-                # Get customer if provided (needed for wholesale validation)
-                customer_id = request.data.get('customer')
-
-                # Validate stock availability and prepare stock deduction
-                stock_deductions = []
-                total_quantity = 0
-                for cart_item in cart_items:
-                    product = cart_item.product
-                    requested_quantity = int(cart_item.quantity)
-
-                    # Validate quantity is positive
-                    if requested_quantity <= 0:
-                        return Response(
-                            {'error': f'Invalid quantity for product "{product.name}". Quantity must be positive.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    total_quantity += requested_quantity
-
-                    if float(product.stock_quantity) < requested_quantity:
-                        return Response(
-                            {'error': f'Insufficient stock for product "{product.name}". Available: {product.stock_quantity}, Requested: {requested_quantity}'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    # Wholesale validation: Check minimum quantity if wholesale price is used
-                    if sale_type == 'wholesale' and hasattr(product, 'wholesale_price') and product.wholesale_price and product.wholesale_price > 0:
-                        # Minimum quantity is always 1 for all sales (no wholesale minimum check)
-                        min_quantity = 1
-                        if requested_quantity < min_quantity:
-                            return Response(
-                                {'error': f'Product "{product.name}" requires minimum {min_quantity} units. Requested: {requested_quantity}'},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-
-                    stock_deductions.append({
-                        'product': product,
-                        'quantity': requested_quantity,
-                        'cart_item': cart_item
-                    })
-
-                # Wholesale validation: Minimum total order quantity
-                # Minimum quantity is always 1 for all sales (no wholesale minimum check)
-                min_total_quantity = 1
-                if sale_type == 'wholesale' and total_quantity < min_total_quantity:
-                    return Response(
-                        {'error': f'Orders require minimum {min_total_quantity} items total. Current total: {total_quantity}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                # Calculate totals (ensure numeric types)
-                print(f"Cart items for calculation: {[(item.unit_price, type(item.unit_price), item.quantity, type(item.quantity)) for item in cart_items]}")
-                subtotal = sum(float(item.unit_price) * int(item.quantity) for item in cart_items)
-                tax_amount = float(request.data.get('tax_amount', 0))
-                discount_amount = float(request.data.get('discount_amount', 0))
-                total_amount = float(request.data.get('total_amount', subtotal + tax_amount - discount_amount))
-                print(f"Calculated amounts - subtotal: {subtotal}, total: {total_amount}")
-                receipt_number = request.data.get('receipt_number', f'POS-{timezone.now().strftime("%Y%m%d%H%M%S")}')
+                # Build and validate the whole cart in memory before writing anything
+                cart_items = attach_products(build_cart_items(items_data))
+                validate_stock(cart_items)
 
                 # Get customer if provided
                 customer = None
+                customer_id = request.data.get('customer')
                 if customer_id:
                     from customers.models import Customer
                     try:
                         customer = Customer.objects.get(id=customer_id, is_active=True)
-                        cart.customer = customer
-                        cart.save()
                     except Customer.DoesNotExist:
                         return Response(
                             {'error': 'Customer not found or inactive'},
                             status=status.HTTP_400_BAD_REQUEST
                         )
 
+                # Create cart and its items
+                cart = Cart.objects.create(
+                    cashier=cashier,
+                    customer=customer,
+                    status='held' if is_hold_order else 'closed'
+                )
+                for cart_item in cart_items:
+                    cart_item.cart = cart
+                CartItem.objects.bulk_create(cart_items)
+
                 # If this is a hold order, don't create sale or deduct stock
                 if is_hold_order:
-                    # Serialize and return the cart
                     cart_serializer = CartSerializer(cart)
                     return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
 
-                # Create sale
-                print(f"Creating sale with subtotal: {subtotal} (type: {type(subtotal)}), total_amount: {total_amount} (type: {type(total_amount)})")
-
-                # Check credit limit for wholesale customers - REMOVED as per requirements
-
-                from django.db.models.signals import post_save
-                from .signals import create_default_payment
-
-                # Temporarily disconnect the signal to prevent duplicate payments
-                post_save.disconnect(create_default_payment, sender=Sale)
-
-                sale = Sale.objects.create(
-                    cart=cart,
-                    customer=customer,
-                    shift=current_shift,
-                    sale_type=request.data.get('sale_type', 'retail'),
-                    total_amount=float(subtotal),
-                    tax_amount=float(tax_amount),
-                    discount_amount=float(discount_amount),
-                    final_amount=float(total_amount),
-                    receipt_number=receipt_number
+                sale = complete_sale(
+                    cart, cart_items, cashier, current_shift, request.data, receipt_number, customer=customer
                 )
 
-                # Reconnect the signal
-                post_save.connect(create_default_payment, sender=Sale)
-
-                # Update shift totals if there's an active shift
-                if current_shift:
-                    from decimal import Decimal
-                    payment_method = request.data.get('payment_method', 'cash').lower()
-                    sale_amount = Decimal(str(total_amount))
-
-                    # Update shift totals based on payment method using F expressions to avoid race conditions
-                    from django.db.models import F
-                    update_fields = ['total_sales']
-                    if payment_method == 'split':
-                        # For split payments, use the split data
-                        split_data = request.data.get('split_data', {})
-                        cash_amount = Decimal(str(split_data.get('cash', 0)))
-                        mpesa_amount = Decimal(str(split_data.get('mpesa', 0)))
-                        current_shift.cash_sales = F('cash_sales') + cash_amount
-                        current_shift.mobile_sales = F('mobile_sales') + mpesa_amount
-                        update_fields.extend(['cash_sales', 'mobile_sales'])
-                    elif payment_method == 'cash':
-                        current_shift.cash_sales = F('cash_sales') + sale_amount
-                        update_fields.append('cash_sales')
-                    elif payment_method in ['mpesa', 'mobile']:
-                        current_shift.mobile_sales = F('mobile_sales') + sale_amount
-                        update_fields.append('mobile_sales')
-
-                    current_shift.total_sales = F('total_sales') + sale_amount
-                    current_shift.save(update_fields=update_fields)
-
-                # Create sale items from cart items
-                for cart_item in cart_items:
-                    print(f"Creating sale item: quantity={cart_item.quantity} (type: {type(cart_item.quantity)}), unit_price={cart_item.unit_price} (type: {type(cart_item.unit_price)})")
-                    SaleItem.objects.create(
-                        sale=sale,
-                        product=cart_item.product,
-                        quantity=int(cart_item.quantity),
-                        unit_price=float(cart_item.unit_price),
-                        discount=float(cart_item.discount)
-                    )
-
-                # Deduct stock using FIFO (First-In, First-Out) from batches
-                for deduction in stock_deductions:
-                    product = deduction['product']
-                    remaining_quantity = deduction['quantity']
-
-                    # Get available batches for this product, ordered by expiry date (FIFO)
-                    from inventory.models import Batch
-                    available_batches = Batch.objects.filter(
-                        product=product,
-                        quantity__gt=0
-                    ).exclude(
-                        status__in=['damaged', 'expired'],  # Exclude damaged/expired batches
-                        expiry_date__lt=timezone.now().date()  # Don't use expired batches
-                    ).order_by('expiry_date', 'purchase_date')  # FIFO: oldest first
-
-                    batch_deductions = []
-                    for batch in available_batches:
-                        if remaining_quantity <= 0:
-                            break
-
-                        # Calculate how much to take from this batch
-                        take_quantity = min(remaining_quantity, batch.quantity)
-
-                        batch_deductions.append({
-                            'batch': batch,
-                            'quantity': take_quantity
-                        })
-
-                        remaining_quantity -= take_quantity
-
-                    # Check if we have enough stock across all batches
-                    total_available = sum(d['quantity'] for d in batch_deductions)
-                    if total_available < deduction['quantity']:
-                        # If no batches found but product has stock, allow the sale (fallback for missing batch data)
-                        if not available_batches.exists() and float(product.stock_quantity) >= deduction['quantity']:
-                            print(f"No batches found for product {product.name}, but product has {product.stock_quantity} stock. Allowing sale.")
-                            # Skip batch deduction logic and just reduce product stock
-                            from decimal import Decimal
-                            product.stock_quantity = Decimal(str(product.stock_quantity)) - Decimal(str(deduction['quantity']))
-                            product.save(update_fields=['stock_quantity'])
-
-                            # Create stock movement record without batch
-                            StockMovement.objects.create(
-                                product=product,
-                                movement_type='out',
-                                quantity=-deduction['quantity'],
-                                reason=f'Sale {sale.receipt_number} - No batch tracking',
-                                user=cashier
-                            )
-
-                            # Create sales history record without batch
-                            SalesHistory.objects.create(
-                                product=product,
-                                batch=None,  # No batch
-                                quantity=deduction['quantity'],
-                                unit_price=deduction['cart_item'].unit_price,
-                                cost_price=None,  # Unknown cost
-                                total_price=deduction['cart_item'].unit_price * deduction['quantity'],
-                                receipt_number=sale.receipt_number,
-                                sale_date=sale.sale_date
-                            )
-                            continue  # Skip the rest of batch processing
-                        else:
-                            return Response(
-                                {'error': f'Insufficient stock for product "{product.name}". Available: {total_available}, Required: {deduction["quantity"]}'},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-
-                    # Apply the deductions
-                    for batch_deduction in batch_deductions:
-                        batch = batch_deduction['batch']
-                        quantity = batch_deduction['quantity']
-
-                        # Reduce batch quantity
-                        from decimal import Decimal
-                        batch.quantity = Decimal(str(batch.quantity)) - Decimal(str(quantity))
-                        batch.save(update_fields=['quantity'])
-
-                        # Deduct from product total stock
-                        product.stock_quantity = Decimal(str(product.stock_quantity)) - Decimal(str(quantity))
-                        product.save(update_fields=['stock_quantity'])
-
-                        # Create stock movement record
-                        StockMovement.objects.create(
-                            product=product,
-                            movement_type='out',
-                            quantity=-quantity,  # Negative for stock out
-                            reason=f'Sale {sale.receipt_number} - Batch {batch.batch_number}',
-                            user=cashier
-                        )
-
-                        # Create sales history record with batch information
-                        SalesHistory.objects.create(
-                            product=product,
-                            batch=batch,
-                            quantity=quantity,
-                            unit_price=deduction['cart_item'].unit_price,
-                            cost_price=batch.cost_price,
-                            total_price=deduction['cart_item'].unit_price * quantity,
-                            receipt_number=sale.receipt_number,
-                            sale_date=sale.sale_date
-                        )
-
-                # STRICT VALIDATION: Require payment method and ensure payment creation succeeds
-                payment_method = request.data.get('payment_method', '').strip().lower()
-                if not payment_method:
-                    return Response(
-                        {'error': 'Payment method is required for all transactions'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                # Validate payment method
-                valid_payment_methods = ['cash', 'mpesa', 'mobile', 'split']
-                if payment_method not in valid_payment_methods:
-                    return Response(
-                        {'error': f'Invalid payment method. Must be one of: {", ".join(valid_payment_methods)}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                # Validate split payment data if split method selected
-                if payment_method == 'split':
-                    split_data = request.data.get('split_data', {})
-                    if not split_data or (split_data.get('cash', 0) == 0 and split_data.get('mpesa', 0) == 0):
-                        raise ValueError('Split payment requires cash and/or mpesa amounts in split_data')
-
-                # Create payment record for the sale
-                created_payments = []
-                if payment_method == 'split':
-                    # For split payments, create appropriate payment records
-                    split_data = request.data.get('split_data', {})
-                    cash_amount = split_data.get('cash', 0)
-                    mpesa_amount = split_data.get('mpesa', 0)
-
-                    # Check if it's truly split (both amounts > 0) or pure payment
-                    if cash_amount > 0 and mpesa_amount > 0:
-                        # True split payment - create two records
-                        payment = Payment.objects.create(
-                            sale=sale,
-                            payment_type='cash',
-                            amount=cash_amount,
-                            status='completed'
-                        )
-                        created_payments.append(payment)
-
-                        payment = Payment.objects.create(
-                            sale=sale,
-                            payment_type='mpesa',
-                            amount=mpesa_amount,
-                            mpesa_number=request.data.get('mpesa_number', ''),
-                            status='completed'
-                        )
-                        created_payments.append(payment)
-                    elif mpesa_amount > 0:
-                        # Pure M-Pesa payment
-                        payment = Payment.objects.create(
-                            sale=sale,
-                            payment_type='mpesa',
-                            amount=mpesa_amount,
-                            mpesa_number=request.data.get('mpesa_number', ''),
-                            status='completed'
-                        )
-                        created_payments.append(payment)
-                    elif cash_amount > 0:
-                        # Pure cash payment
-                        payment = Payment.objects.create(
-                            sale=sale,
-                            payment_type='cash',
-                            amount=cash_amount,
-                            status='completed'
-                        )
-                        created_payments.append(payment)
-                else:
-                    # Single payment method
-                    payment_type = 'cash'
-                    if payment_method in ['mpesa', 'mobile']:
-                        payment_type = 'mpesa'
-
-                    payment = Payment.objects.create(
-                        sale=sale,
-                        payment_type=payment_type,
-                        amount=total_amount,
-                        mpesa_number=request.data.get('mpesa_number', '') if payment_type == 'mpesa' else '',
-                        status='completed'
-                    )
-                    created_payments.append(payment)
-
-                # CRITICAL VALIDATION: Ensure at least one payment was created
-                if not created_payments:
-                    raise ValueError("No payment records were created for this transaction")
-
-                # Verify payment amounts total matches sale amount
-                total_payment_amount = sum(float(p.amount) for p in created_payments)
-                if abs(total_payment_amount - float(total_amount)) > 0.01:  # Allow small floating point differences
-                    raise ValueError(f"Payment amount mismatch: payments total {total_payment_amount}, sale total {total_amount}")
-
                 # Serialize and return the sale
                 serializer = self.get_serializer(sale)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"Error creating sale: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error creating sale")
 
             # Provide user-friendly error messages
             error_message = str(e)
@@ -1003,15 +470,15 @@ class SaleViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 class SaleItemViewSet(viewsets.ModelViewSet):
-    queryset = SaleItem.objects.all()
+    queryset = SaleItem.objects.select_related('product')
     serializer_class = SaleItemSerializer
 
 class ReturnViewSet(viewsets.ModelViewSet):
-    queryset = Return.objects.all()
+    queryset = Return.objects.select_related('sale', 'processed_by__user')
     serializer_class = ReturnSerializer
 
 class InvoiceViewSet(viewsets.ModelViewSet):
-    queryset = Invoice.objects.all()
+    queryset = Invoice.objects.select_related('customer', 'created_by__user').prefetch_related('items__product')
     serializer_class = InvoiceSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['customer', 'status', 'sale']
@@ -1092,7 +559,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 class InvoiceItemViewSet(viewsets.ModelViewSet):
-    queryset = InvoiceItem.objects.all()
+    queryset = InvoiceItem.objects.select_related('product')
     serializer_class = InvoiceItemSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['invoice', 'product']
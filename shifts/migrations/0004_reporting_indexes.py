@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shifts', '0003_remove_shift_branch'),
+        ('users', '0002_alter_userprofile_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shift',
+            index=models.Index(fields=['cashier', 'status'], name='shifts_shift_cashier_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shift',
+            index=models.Index(fields=['start_time'], name='shifts_shift_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shift',
+            index=models.Index(fields=['end_time'], name='shifts_shift_end_idx'),
+        ),
+    ]
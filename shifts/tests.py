@@ -1,3 +1,21 @@
+from unittest import skipUnless
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from .models import Shift
+from reports.rollups import day_bounds
 
-# Create your tests here.
+
+@skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+class ShiftIndexTest(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(f'USING INDEX {index}', queryset.explain())
+
+    def test_lookups_use_indexes(self):
+        start, end = day_bounds(timezone.localdate())
+        self.assertUsesIndex(Shift.objects.filter(cashier_id=1, status='open'), 'shifts_shift_cashier_idx')
+        self.assertUsesIndex(Shift.objects.filter(start_time__gte=start), 'shifts_shift_start_idx')
+        self.assertUsesIndex(
+            Shift.objects.filter(end_time__gte=start, end_time__lt=end, status='closed'),
+            'shifts_shift_end_idx'
+        )
@@ -1,13 +1,28 @@
+import logging
+
 from rest_framework import viewsets, generics, status
 from rest_framework.response import Response
+from django.db.models import Prefetch
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from .models import Shift
 from .serializers import ShiftSerializer
+from reports.rollups import day_bounds
+
+logger = logging.getLogger(__name__)
+
+
+def shifts_with_sales():
+    """Shifts with everything ShiftSerializer reads, including the nested sales"""
+    from sales.models import Sale
+    sales = Sale.objects.select_related('customer', 'voided_by__user').prefetch_related('payment_set')
+    return Shift.objects.select_related('cashier__user', 'approved_by__user').prefetch_related(
+        Prefetch('sale_set', queryset=sales)
+    )
 
 class ShiftViewSet(viewsets.ModelViewSet):
-    queryset = Shift.objects.all()
+    queryset = shifts_with_sales()
     serializer_class = ShiftSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['cashier', 'status', 'start_time', 'end_time']
@@ -57,9 +72,8 @@ class EndShiftView(generics.CreateAPIView):
 
         try:
             shift = Shift.objects.get(cashier=cashier, status='open')
-            print(f"EndShiftView: Found open shift {shift.id} for user {cashier.user.username}")
         except Shift.DoesNotExist:
-            print(f"EndShiftView: No open shift found for user {cashier.user.username}")
+            logger.info("No open shift to end for user %s", request.user)
             return Response({
                 'error': '❌ No Active Shift',
                 'message': 'You do not have an active shift to end.',
@@ -67,7 +81,7 @@ class EndShiftView(generics.CreateAPIView):
                 'action_required': 'Start a shift first'
             }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"EndShiftView: Error finding shift: {str(e)}")
+            logger.exception("Error finding open shift for user %s", request.user)
             return Response({
                 'error': '❌ Shift Error',
                 'message': 'An error occurred while accessing your shift information.',
@@ -109,8 +123,10 @@ class EndShiftView(generics.CreateAPIView):
 
         # Final totals are already calculated during sales
         shift.save()
-        print(f"EndShiftView: Shift {shift.id} closed successfully for user {cashier.user.username}")
-        print(f"EndShiftView: Expected: {expected_balance}, Actual: {actual_closing_balance}, Discrepancy: {discrepancy}")
+        logger.info(
+            "Shift %s closed by %s: expected %s, actual %s, discrepancy %s",
+            shift.id, request.user, expected_balance, actual_closing_balance, discrepancy
+        )
 
         serializer = self.get_serializer(shift)
 
@@ -154,23 +170,18 @@ class CurrentShiftView(generics.GenericAPIView):
             defaults={'role': 'cashier'}
         )
         if created:
-            print(f"CurrentShiftView: Created UserProfile for user {request.user}")
+            logger.info("Created UserProfile for user %s", request.user)
 
         try:
-            shift = Shift.objects.get(cashier=user_profile, status='open')
-            print(f"CurrentShiftView: Found open shift {shift.id} for user {user_profile.user.username}")
-            print(f"CurrentShiftView: Shift data - status: {shift.status}, start_time: {shift.start_time}")
+            shift = shifts_with_sales().get(cashier=user_profile, status='open')
             serializer = self.get_serializer(shift)
             data = serializer.data
-            print(f"CurrentShiftView: Serialized data: {data}")
+            logger.debug("Current shift for %s: %s", request.user, data)
             return Response(data, status=status.HTTP_200_OK)
         except Shift.DoesNotExist:
-            print(f"CurrentShiftView: No open shift found for user {user_profile.user.username}")
             return Response({'detail': 'No active shift found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            print(f"CurrentShiftView: Error serializing shift: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error serializing current shift for user %s", request.user)
             return Response({'error': f'Error retrieving shift data: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -183,15 +194,15 @@ class AllShiftsView(generics.ListAPIView):
     ordering = ['-start_time']
 
     def get_queryset(self):
-        queryset = Shift.objects.all()
+        queryset = shifts_with_sales()
 
         # Filter by date range if provided
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
 
         if start_date:
-            queryset = queryset.filter(start_time__date__gte=start_date)
+            queryset = queryset.filter(start_time__gte=day_bounds(start_date)[0])
         if end_date:
-            queryset = queryset.filter(start_time__date__lte=end_date)
+            queryset = queryset.filter(start_time__lt=day_bounds(end_date)[1])
 
         return queryset
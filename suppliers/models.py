@@ -56,23 +56,21 @@ class PurchaseOrder(models.Model):
 
     def update_status(self):
         """Update order status based on received items"""
-        items = self.items.all()
-        if not items.exists():
+        counts = self.items.aggregate(
+            total=models.Count('pk'),
+            started=models.Count('pk', filter=models.Q(received_quantity__gt=0)),
+            outstanding=models.Count('pk', filter=models.Q(received_quantity__lt=models.F('quantity'))),
+        )
+        if not counts['total']:
             self.status = 'pending'
+        elif counts['started'] == 0:
+            self.status = 'ordered'
+        elif counts['outstanding'] == 0:
+            self.status = 'received'
         else:
-            received_count = items.filter(received_quantity__gt=0).count()
-            total_count = items.count()
+            self.status = 'partially_received'
 
-            if received_count == 0:
-                self.status = 'ordered'
-            elif received_count == total_count:
-                # Check if all items are fully received
-                fully_received = all(item.received_quantity >= item.quantity for item in items)
-                self.status = 'received' if fully_received else 'partially_received'
-            else:
-                self.status = 'partially_received'
-
-        self.save()
+        self.save(update_fields=['status', 'updated_at'])
 
 class PurchaseOrderItem(models.Model):
     purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='items')
@@ -0,0 +1,136 @@
+"""
+Set-based receiving of purchase order deliveries.
+
+A delivery is every line received against one purchase order in one go.
+The lines are validated against the order's items in memory first; then the
+batches and StockMovements are written with ``bulk_create``, product stock
+and the items' received quantities are moved with grouped ``F()`` updates,
+and the order's status is recomputed once at the end. The number of queries
+stays fixed however many lines the delivery has.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from branches import versions
+from inventory.allocation import restore_stock
+from inventory.models import Batch, StockMovement
+from .models import PurchaseOrder, PurchaseOrderItem
+
+RECEIVE_MAX_LINES = getattr(settings, 'PURCHASE_RECEIVE_MAX_LINES', 1000)
+
+
+class ReceivingError(Exception):
+    """A problem with the submitted delivery; the message is safe to show to the user."""
+
+
+def _parse_line(line):
+    if not isinstance(line, dict):
+        raise ReceivingError('Each line must be an object')
+    try:
+        item_id = int(line.get('item_id'))
+        quantity = int(line.get('quantity'))
+    except (TypeError, ValueError):
+        raise ReceivingError('Each line needs a numeric item_id and quantity')
+    if quantity < 1:
+        raise ReceivingError(f'Quantity for item {item_id} must be at least 1')
+    expiry_date = line.get('expiry_date') or None
+    if expiry_date is not None:
+        try:
+            expiry_date = parse_date(str(expiry_date))
+        except ValueError:
+            expiry_date = None
+        if expiry_date is None:
+            raise ReceivingError(f'Invalid expiry_date for item {item_id}. Use YYYY-MM-DD')
+    return item_id, quantity, line.get('batch_number') or '', expiry_date
+
+
+def receive_delivery(purchase_order, lines, user=None):
+    """
+    Receive ``lines`` against ``purchase_order`` and return the new batches.
+
+    Each line is ``{"item_id", "quantity", "batch_number"?, "expiry_date"?}``;
+    an item may appear on several lines (one per batch). Raises
+    ReceivingError, with nothing written, if any line is invalid or would
+    take an item past its ordered quantity. ``purchase_order.status`` is
+    updated in place.
+    """
+    if not lines:
+        raise ReceivingError('No lines provided')
+    if len(lines) > RECEIVE_MAX_LINES:
+        raise ReceivingError(f'At most {RECEIVE_MAX_LINES} lines can be received at once')
+    parsed = [_parse_line(line) for line in lines]
+
+    with transaction.atomic():
+        order = PurchaseOrder.objects.select_for_update().select_related('supplier').get(pk=purchase_order.pk)
+        if order.status == 'cancelled':
+            raise ReceivingError('Cannot receive against a cancelled purchase order')
+        items = {
+            item.pk: item
+            for item in PurchaseOrderItem.objects.select_for_update().filter(
+                purchase_order=order,
+                pk__in={item_id for item_id, _, _, _ in parsed}
+            ).order_by('pk')
+        }
+
+        received = {}
+        for item_id, quantity, _, _ in parsed:
+            if item_id not in items:
+                raise ReceivingError(f'Purchase order item {item_id} not found')
+            received[item_id] = received.get(item_id, 0) + quantity
+        for item_id, quantity in received.items():
+            item = items[item_id]
+            if item.received_quantity + quantity > item.quantity:
+                raise ReceivingError(
+                    f'Received quantity exceeds ordered quantity for item {item_id}. '
+                    f'Ordered: {item.quantity}, already received: {item.received_quantity}, receiving: {quantity}'
+                )
+
+        today = timezone.localdate()
+        batches = Batch.objects.bulk_create([
+            Batch(
+                product_id=items[item_id].product_id,
+                batch_number=batch_number or items[item_id].batch_number or f'{order.order_number}-{item_id}',
+                quantity=quantity,
+                cost_price=items[item_id].unit_price,
+                expiry_date=expiry_date or items[item_id].expiry_date,
+                purchase_date=order.order_date,
+                supplier=order.supplier,
+                purchase_order_item_id=item_id,
+                status='received',
+                received_date=today
+            )
+            for item_id, quantity, batch_number, expiry_date in parsed
+        ])
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                product_id=batch.product_id,
+                movement_type='in',
+                quantity=batch.quantity,
+                reason=f'Batch {batch.batch_number} received',
+                user=user
+            )
+            for batch in batches
+        ])
+
+        product_totals = {}
+        for item_id, quantity in received.items():
+            product_id = items[item_id].product_id
+            product_totals[product_id] = product_totals.get(product_id, 0) + quantity
+        restore_stock(product_totals)
+
+        PurchaseOrderItem.objects.filter(pk__in=list(received)).update(
+            received_quantity=F('received_quantity') + Case(
+                *[When(pk=pk, then=Value(quantity)) for pk, quantity in received.items()],
+                output_field=IntegerField()
+            )
+        )
+        order.update_status()
+
+        # Bulk writes send no signals
+        versions.bump_on_commit([versions.CATALOGUE, versions.STOCK])
+    purchase_order.status = order.status
+    return batches
@@ -1,3 +1,95 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from inventory.models import Batch, Product, StockMovement
+from users.models import UserProfile
+from .models import PurchaseOrder, PurchaseOrderItem, Supplier
+
+
+class PurchaseOrderReceivingTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='storekeeper', password='testpass')
+        self.profile = UserProfile.objects.create(user=self.user, role='storekeeper')
+        self.client.force_authenticate(user=self.user)
+        self.supplier = Supplier.objects.create(name='Keroche', phone='0700000000')
+        self.order = PurchaseOrder.objects.create(supplier=self.supplier, status='ordered')
+        self.products = [
+            Product.objects.create(
+                sku=f'RCV{n}', name=f'Vodka {n}', cost_price=Decimal('400.00'),
+                selling_price=Decimal('550.00'), stock_quantity=5
+            )
+            for n in range(3)
+        ]
+        self.items = [
+            PurchaseOrderItem.objects.create(
+                purchase_order=self.order, product=product, quantity=24, unit_price=Decimal('400.00')
+            )
+            for product in self.products
+        ]
+        self.url = f'/api/purchase-orders/{self.order.pk}/receive/'
+
+    def test_receives_whole_delivery(self):
+        lines = [
+            {'item_id': self.items[0].pk, 'quantity': 12, 'batch_number': 'A1', 'expiry_date': '2030-01-31'},
+            {'item_id': self.items[0].pk, 'quantity': 12, 'batch_number': 'A2'},
+            {'item_id': self.items[1].pk, 'quantity': 24, 'batch_number': 'B1'},
+            {'item_id': self.items[2].pk, 'quantity': 24, 'batch_number': 'C1'},
+        ]
+        response = self.client.post(self.url, {'lines': lines}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['batch_ids']), 4)
+        self.assertEqual(response.data['status'], 'received')
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('stock_quantity', flat=True)), [29, 29, 29]
+        )
+        self.assertEqual(
+            list(PurchaseOrderItem.objects.order_by('pk').values_list('received_quantity', flat=True)), [24, 24, 24]
+        )
+        self.assertEqual(Batch.objects.filter(status='received', purchase_order_item__isnull=False).count(), 4)
+        self.assertEqual(StockMovement.objects.filter(movement_type='in', user=self.profile).count(), 4)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        lines = [{'item_id': item.pk, 'quantity': 1} for item in self.items]
+        with self.assertNumQueries(11):
+            self.client.post(self.url, {'lines': lines[:1]}, format='json')
+        with self.assertNumQueries(11):
+            self.client.post(self.url, {'lines': lines}, format='json')
+
+    def test_partial_delivery(self):
+        response = self.client.post(self.url, {'lines': [{'item_id': self.items[0].pk, 'quantity': 6}]}, format='json')
+        self.assertEqual(response.data['status'], 'partially_received')
+
+    def test_over_receiving_writes_nothing(self):
+        lines = [
+            {'item_id': self.items[0].pk, 'quantity': 20},
+            {'item_id': self.items[0].pk, 'quantity': 5},
+        ]
+        response = self.client.post(self.url, {'lines': lines}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Batch.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock_quantity, 5)
+
+    def test_item_from_another_order_is_refused(self):
+        other = PurchaseOrder.objects.create(supplier=self.supplier)
+        item = PurchaseOrderItem.objects.create(
+            purchase_order=other, product=self.products[0], quantity=1, unit_price=Decimal('400.00')
+        )
+        response = self.client.post(self.url, {'lines': [{'item_id': item.pk, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_receive_batch_counts_quantity_once(self):
+        response = self.client.post(
+            f'/api/purchase-orders/{self.order.pk}/receive_batch/',
+            {'item_id': self.items[0].pk, 'quantity': 10, 'batch_number': 'SINGLE'},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].received_quantity, 10)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock_quantity, 15)
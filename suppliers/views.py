@@ -5,6 +5,7 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from .models import Supplier, SupplierPriceHistory, PurchaseOrder, PurchaseOrderItem
 from .serializers import SupplierSerializer, SupplierPriceHistorySerializer, PurchaseOrderSerializer, PurchaseOrderItemSerializer
+from .receiving import ReceivingError, receive_delivery
 
 class SupplierViewSet(viewsets.ModelViewSet):
     queryset = Supplier.objects.all()
@@ -15,7 +16,7 @@ class SupplierViewSet(viewsets.ModelViewSet):
     ordering = ['name']
 
 class SupplierPriceHistoryViewSet(viewsets.ModelViewSet):
-    queryset = SupplierPriceHistory.objects.all()
+    queryset = SupplierPriceHistory.objects.select_related('supplier', 'product')
     serializer_class = SupplierPriceHistorySerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['supplier', 'product']
@@ -33,6 +34,12 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
     ordering = ['-order_date']
     http_method_names = ['get', 'post', 'put', 'patch', 'delete']  # Explicitly allow PATCH
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related('supplier').prefetch_related('items__product')
+        return queryset
+
     def partial_update(self, request, *args, **kwargs):
         """Handle PATCH requests for partial updates"""
         kwargs['partial'] = True
@@ -42,43 +49,38 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
     def receive_batch(self, request, pk=None):
         """Receive a batch for a purchase order item"""
         purchase_order = self.get_object()
-        item_id = request.data.get('item_id')
-        batch_number = request.data.get('batch_number')
-        quantity = request.data.get('quantity')
-        expiry_date = request.data.get('expiry_date')
-
         try:
-            item = purchase_order.items.get(id=item_id)
-        except PurchaseOrderItem.DoesNotExist:
-            return Response({'error': 'Purchase order item not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        if item.received_quantity + quantity > item.quantity:
-            return Response({'error': 'Received quantity exceeds ordered quantity'}, status=status.HTTP_400_BAD_REQUEST)
+            batches = receive_delivery(purchase_order, [request.data], user=getattr(request.user, 'userprofile', None))
+        except ReceivingError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create batch
-        from inventory.models import Batch
-        batch = Batch.objects.create(
-            product=item.product,
-            batch_number=batch_number,
-            quantity=quantity,
-            expiry_date=expiry_date,
-            purchase_date=purchase_order.order_date,
-            supplier=purchase_order.supplier,
-            purchase_order_item=item,
-            status='ordered'
-        )
+        return Response({'message': 'Batch received successfully', 'batch_id': batches[0].id})
 
-        # Receive the batch (adds to stock)
-        batch.receive_batch()
+    @action(detail=True, methods=['post'])
+    def receive(self, request, pk=None):
+        """
+        Receive a whole delivery against the purchase order.
 
-        # Update the purchase order item's received quantity
-        item.received_quantity += quantity
-        item.save()
+        Expects ``{"lines": [{"item_id", "quantity", "batch_number"?,
+        "expiry_date"?}, ...]}``; all lines are received or none are.
+        """
+        purchase_order = self.get_object()
+        lines = request.data.get('lines')
+        if not isinstance(lines, list):
+            return Response({'error': 'lines must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            batches = receive_delivery(purchase_order, lines, user=getattr(request.user, 'userprofile', None))
+        except ReceivingError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({'message': 'Batch received successfully', 'batch_id': batch.id})
+        return Response({
+            'message': f'{len(batches)} batches received successfully',
+            'batch_ids': [batch.id for batch in batches],
+            'status': purchase_order.status,
+        })
 
 class PurchaseOrderItemViewSet(viewsets.ModelViewSet):
-    queryset = PurchaseOrderItem.objects.all()
+    queryset = PurchaseOrderItem.objects.select_related('product')
     serializer_class = PurchaseOrderItemSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['purchase_order', 'product']
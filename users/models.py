@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from branches.utils import BranchManager
 
 # Create your models here.
 
@@ -17,6 +18,8 @@ class UserProfile(models.Model):
     phone = models.CharField(max_length=15, blank=True)
     branch = models.ForeignKey('branches.Branch', on_delete=models.SET_NULL, null=True, blank=True)
     is_active = models.BooleanField(default=True)
+
+    objects = BranchManager()
     
     def __str__(self):
         return f"{self.user.username} - {self.role}"
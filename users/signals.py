@@ -1,8 +1,12 @@
+import logging
+
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import UserProfile
 
+logger = logging.getLogger(__name__)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """
@@ -17,7 +21,7 @@ def create_user_profile(sender, instance, created, **kwargs):
             )
         except Exception as e:
             # Log the error but don't fail the user creation
-            print(f"Error creating UserProfile for user {instance.username}: {str(e)}")
+            logger.exception("Error creating UserProfile for user %s", instance.username)
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):